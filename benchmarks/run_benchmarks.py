@@ -0,0 +1,292 @@
+# Microbenchmarks for the wire codecs and storage hot paths
+#
+# Run from the repository root:
+#   python -m benchmarks.run_benchmarks --output bench.json
+#   python -m benchmarks.run_benchmarks --baseline bench.json --threshold 0.2
+import argparse
+import contextlib
+import gc
+import json
+import logging
+import platform
+import socket
+import struct
+import sys
+import time
+import tracemalloc
+from gossip.codes import GOSSIP_ANNOUNCE, GOSSIP_P2P_PUSH
+from gossip.dispatch import Dispatcher
+from gossip.message import AnnounceMessage, AnnounceView, GossipSendContentMessage, GossipPullResponseMessage, \
+    ContentView, PeerAddressView, BatchView, pack_batch_frame, pack_relay_message
+from gossip.message_storage import MessageStorage
+from gossip.peer_table import PeerTable
+from gossip.queues import IncomingItem, P2PItem
+from gossip.utils import FrameReader, parse_header
+
+BENCHMARKS = {}
+
+# Additional allocations per operation compared to the baseline which count as a regression
+ALLOCATION_TOLERANCE = 0.5
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function does the setup and returns the operation to be measured,
+    or a context manager yielding it if resources like sockets have to be released after the run.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def announce_body(size=64):
+    return struct.pack(">BBH", 5, 0, 1001) + b"x" * size
+
+
+def peers(count):
+    return ["10.{}.{}.{}:{}".format(i >> 16 & 255, i >> 8 & 255, i & 255, 1024 + i % 60000) for i in range(count)]
+
+
+@benchmark("announce_parse")
+def bench_announce_parse():
+    body = announce_body()
+    return lambda: AnnounceMessage(body)
+
+
+@benchmark("announce_view")
+def bench_announce_view():
+    body = memoryview(announce_body())
+    return lambda: AnnounceView(body).data_type
+
+
+@benchmark("dispatch_push")
+def bench_dispatch_push():
+    body = memoryview(struct.pack(">BBBBH", 10, 0, 0, 1, 6001))
+    dispatcher = Dispatcher({GOSSIP_P2P_PUSH: lambda sender, body: PeerAddressView(body).address})
+    return lambda: dispatcher.dispatch(GOSSIP_P2P_PUSH, "10.0.0.1:40000", body)
+
+
+@benchmark("send_content_prepare")
+def bench_send_content_prepare():
+    body = announce_body()
+    return lambda: GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=GOSSIP_ANNOUNCE)
+
+
+@benchmark("relay_announce")
+def bench_relay_announce():
+    body = announce_body(1024)
+    received = GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=GOSSIP_ANNOUNCE)
+    message_body = memoryview(received)[4:]
+    return lambda: GossipSendContentMessage(message_body=message_body).prepare_relay_message()
+
+
+@benchmark("pack_relay_message")
+def bench_pack_relay_message():
+    content = memoryview(announce_body(1024))
+    return lambda: pack_relay_message(GOSSIP_ANNOUNCE, content)
+
+
+@benchmark("relay_announce_view")
+def bench_relay_announce_view():
+    body = announce_body(1024)
+    received = GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=GOSSIP_ANNOUNCE)
+    message_body = memoryview(received)[4:]
+    return lambda: ContentView(message_body).relay_message()
+
+
+def register_pull_response(count):
+    @benchmark("pull_response_encode_{}".format(count))
+    def bench_encode():
+        peer_list = PeerTable(count, peers(count))
+        return GossipPullResponseMessage(peer_list).prepare_message
+
+    @benchmark("pull_response_decode_{}".format(count))
+    def bench_decode():
+        message = GossipPullResponseMessage(PeerTable(count, peers(count))).prepare_message()
+        return lambda: GossipPullResponseMessage(PeerTable(count), message_body=message[4:]).update_peer_list()
+
+
+for peer_count in (10, 1000, 10000):
+    register_pull_response(peer_count)
+
+
+@benchmark("parse_header_socketpair")
+@contextlib.contextmanager
+def bench_parse_header():
+    sender, receiver = socket.socketpair()
+    body = GossipSendContentMessage(msg_to_send=announce_body()).prepare_message(inner_msg_type=GOSSIP_ANNOUNCE)
+
+    def operation():
+        sender.sendall(body)
+        return parse_header(receiver)
+    with sender, receiver:
+        yield operation
+
+
+@benchmark("frame_reader_socketpair")
+@contextlib.contextmanager
+def bench_frame_reader():
+    sender, receiver = socket.socketpair()
+    body = GossipSendContentMessage(msg_to_send=announce_body()).prepare_message(inner_msg_type=GOSSIP_ANNOUNCE)
+    reader = FrameReader(receiver)
+
+    def operation():
+        sender.sendall(body)
+        return reader.read_messages()
+    with sender, receiver:
+        yield operation
+
+
+def register_frames(batched, count=10):
+    @benchmark("frame_reader_{}_{}".format('batch' if batched else 'single', count))
+    @contextlib.contextmanager
+    def bench_frames():
+        # reads count relayed announces from a socket and takes them apart down to their contents
+        sender, receiver = socket.socketpair()
+        body = GossipSendContentMessage(msg_to_send=announce_body()).prepare_message(inner_msg_type=GOSSIP_ANNOUNCE)
+        data = b"".join(pack_batch_frame([body] * count)) if batched else body * count
+        reader = FrameReader(receiver)
+
+        def operation():
+            sender.sendall(data)
+            contents = []
+            while len(contents) < count:
+                for frame in reader.read_messages():
+                    if batched:
+                        contents.extend(BatchView(frame.data).contents)
+                    else:
+                        contents.append(ContentView(frame.data))
+            return contents
+        with sender, receiver:
+            yield operation
+
+
+for batched_frames in (False, True):
+    register_frames(batched_frames)
+
+
+@benchmark("incoming_item")
+def bench_incoming_item():
+    body = memoryview(announce_body())
+    return lambda: IncomingItem("10.0.0.1:40000", GOSSIP_ANNOUNCE, body)
+
+
+@benchmark("p2p_item_send")
+def bench_p2p_item_send():
+    message = announce_body()
+    return lambda: P2PItem(0, "10.0.0.1:6001", message)
+
+
+@benchmark("message_storage_add_full")
+def bench_message_storage_add():
+    message_storage = MessageStorage(cache_size=50)
+    for i in range(50):
+        message_storage.add_data(1001, b"x" * 64, 5)
+    data = b"y" * 64
+    return lambda: message_storage.add_data(1001, data, 5)
+
+
+def measure(operation, min_time):
+    """
+    :param operation: callable to be measured
+    :param min_time: minimum number of seconds to run the operation for
+    :return: dict with ops_per_sec, allocations_per_op, allocated_bytes_per_op and peak_bytes_per_op
+    """
+    # speed, the number of iterations grows until a run takes at least min_time
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            operation()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        iterations *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * 1.2))
+
+    # memory, the results are kept alive so the blocks allocated for them show up in the snapshot difference,
+    # temporaries which are freed again within an operation only show up in the peak
+    samples = min(iterations, 100)
+    results = [None] * samples
+    # a full collection empties the free lists, so what earlier benchmarks freed is not reused without an allocation
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    before_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for i in range(samples):
+        results[i] = operation()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # the snapshots allocate themselves while tracing
+    own = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    changes = after.filter_traces(own).compare_to(before.filter_traces(own), 'filename')
+    return {
+        'ops_per_sec': iterations / elapsed,
+        'allocations_per_op': sum(change.count_diff for change in changes) / samples,
+        'allocated_bytes_per_op': sum(change.size_diff for change in changes) / samples,
+        'peak_bytes_per_op': (peak - before_size) / samples,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: list of benchmark names which are slower than the baseline by more than threshold
+        or allocate more blocks per operation
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get('benchmarks', {}).get(name)
+        if not old:
+            continue
+        change = result['ops_per_sec'] / old['ops_per_sec'] - 1
+        allocations = result['allocations_per_op'] - old.get('allocations_per_op', result['allocations_per_op'])
+        print("{:32} {:>14.0f} ops/s {:>+8.1%} {:>8.2f} allocs/op {:>+6.2f}".format(
+            name, result['ops_per_sec'], change, result['allocations_per_op'], allocations))
+        # fractions of an allocation come from the measurement itself
+        if change < -threshold or allocations >= ALLOCATION_TOLERANCE:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs microbenchmarks for the gossip codecs and storage')
+    parser.add_argument('-o', '--output', type=str, help='File to write the results to as JSON')
+    parser.add_argument('-b', '--baseline', type=str, help='JSON results of an earlier run to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help='Fail if a benchmark is slower than the baseline by more than this fraction '
+                             'or allocates more per operation')
+    parser.add_argument('-m', '--min-time', type=float, default=0.2, help='Minimum seconds per benchmark')
+    parser.add_argument('-k', dest='filter', type=str, help='Only run benchmarks containing this string')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        benchmark_setup = setup()
+        if not isinstance(benchmark_setup, contextlib.AbstractContextManager):
+            benchmark_setup = contextlib.nullcontext(benchmark_setup)
+        with benchmark_setup as operation:
+            results[name] = measure(operation, args.min_time)
+
+    report = {'python': platform.python_version(), 'benchmarks': results}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions beyond {:.0%}: {}".format(args.threshold, ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
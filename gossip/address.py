@@ -0,0 +1,184 @@
+# Encoding of peer addresses in the form <ipv4>:<port>, [<ipv6>]:<port> or <hostname>:<port>
+#
+# Addresses are kept packed as tagged records: family tag (1 byte), length of the address (1 byte),
+# the address as packed by inet_pton or as ascii hostname, and the port (2 bytes). The length lets
+# decoders skip records of families they don't know, so new families can be added later.
+#
+# On the wire IPv4 addresses keep the 6 byte format of the first protocol version (4 address bytes
+# and the port), which peers that only know that format understand:
+# - PUSH and PULL carry one address, 6 bytes for IPv4 or one tagged record otherwise.
+# - Peer lists, sent in pull responses and shuffles, start with the number of IPv4 peers, followed by
+#   their 6 byte records and then the tagged records of all other peers. Old peers stop reading after
+#   the IPv4 records and so ignore the rest.
+import socket
+import struct
+
+# Family tags of packed addresses
+ADDRESS_IPV4 = 1
+ADDRESS_IPV6 = 2
+ADDRESS_HOSTNAME = 3
+
+# Size of an IPv4 address with its port in the first protocol version
+LEGACY_RECORD_SIZE = 6
+
+# Largest peer list a pull response can carry with its 16 bit size field, after the message header
+MAX_PEER_LIST_SIZE = 65535 - 4
+
+_IPV4_PREFIX = bytes((ADDRESS_IPV4, 4))
+_unpack_u16 = struct.Struct(">H").unpack_from
+_unpack_ipv4 = struct.Struct(">2xBBBBH").unpack
+# Length of the address of each known family, 0 if it varies
+_ADDRESS_LENGTHS = {ADDRESS_IPV4: 4, ADDRESS_IPV6: 16, ADDRESS_HOSTNAME: 0}
+
+
+def _known(family, length):
+    return _ADDRESS_LENGTHS.get(family, -1) in (length, 0) and length > 0
+
+
+def split_address(address):
+    """
+    :param address: address in format <ipv4>:<port>, [<ipv6>]:<port> or <hostname>:<port>
+    :return: tuple of host, without brackets, and port as int
+    """
+    host, separator, port = address.rpartition(':')
+    if not separator:
+        raise ValueError("Address {} has no port".format(address))
+    if host.startswith('[') and host.endswith(']'):
+        host = host[1:-1]
+    return host, int(port)
+
+
+def format_address(host, port):
+    """
+    :param host: ipv4 or ipv6 address or hostname, e.g. as returned by accept
+    :param port: port
+    :return: address in format <ipv4>:<port>, [<ipv6>]:<port> or <hostname>:<port>
+    """
+    if ':' in host:
+        # ipv4 clients of a dual stack socket are reported as mapped ipv6 addresses
+        if host.startswith('::ffff:') and '.' in host:
+            return "{}:{}".format(host[7:], port)
+        return "[{}]:{}".format(host, port)
+    return "{}:{}".format(host, port)
+
+
+def address_family(host):
+    """
+    :param host: ipv4 or ipv6 address or hostname to bind or connect to
+    :return: socket.AF_INET6 for ipv6 addresses, socket.AF_INET otherwise
+    """
+    return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+
+def pack_address(address):
+    """
+    :param address: address in format <ipv4>:<port>, [<ipv6>]:<port> or <hostname>:<port>
+    :return: tagged record of the address
+    """
+    host, port = split_address(address)
+    port = port.to_bytes(2, byteorder='big')
+    try:
+        return _IPV4_PREFIX + socket.inet_pton(socket.AF_INET, host) + port
+    except OSError:
+        pass
+    try:
+        return bytes((ADDRESS_IPV6, 16)) + socket.inet_pton(socket.AF_INET6, host) + port
+    except OSError:
+        pass
+    name = host.encode('ascii')
+    if not 0 < len(name) < 256:
+        raise ValueError("Invalid hostname {}".format(host))
+    return bytes((ADDRESS_HOSTNAME, len(name))) + name + port
+
+
+def unpack_address(record):
+    """
+    :param record: tagged record of an address
+    :return: address in format <ipv4>:<port>, [<ipv6>]:<port> or <hostname>:<port>
+    """
+    family, length = record[0], record[1]
+    if family == ADDRESS_IPV4 and length == 4:
+        return "%d.%d.%d.%d:%d" % _unpack_ipv4(record)
+    host = bytes(record[2:2 + length])
+    port = _unpack_u16(record, 2 + length)[0]
+    if family == ADDRESS_IPV6 and length == 16:
+        return "[{}]:{}".format(socket.inet_ntop(socket.AF_INET6, host), port)
+    if family == ADDRESS_HOSTNAME:
+        return "{}:{}".format(host.decode('ascii'), port)
+    raise ValueError("Unknown address family {} of length {}".format(family, length))
+
+
+def encode_address(record):
+    """
+    :param record: tagged record of an address
+    :return: the address as sent in PUSH and PULL messages
+    """
+    if record[0] == ADDRESS_IPV4:
+        return record[2:]
+    if len(record) == LEGACY_RECORD_SIZE:
+        # a two letter hostname would be taken for an ipv4 address, the padding is ignored by decode_address
+        return record + b'\0'
+    return record
+
+
+def decode_address(body):
+    """
+    :param body: body of a PUSH or PULL message
+    :return: tagged record of the address it carries
+    :raises ValueError: if the body is no address of a known family
+    """
+    if len(body) == LEGACY_RECORD_SIZE:
+        return _IPV4_PREFIX + bytes(body)
+    if len(body) < 4 or len(body) < 4 + body[1] or not _known(body[0], body[1]):
+        raise ValueError("Invalid address of {} bytes".format(len(body)))
+    return bytes(body[:4 + body[1]])
+
+
+def encode_peer_list(records, max_size=MAX_PEER_LIST_SIZE):
+    """
+    :param records: tagged records of the peers
+    :param max_size: maximum size of the encoded list, peers which don't fit are left out
+    :return: the peers as sent in pull responses and shuffles
+    """
+    legacy = []
+    tagged = []
+    size = 2
+    for record in records:
+        if record[0] == ADDRESS_IPV4:
+            size += LEGACY_RECORD_SIZE
+            if size > max_size:
+                break
+            legacy.append(record[2:])
+        else:
+            size += len(record)
+            if size > max_size:
+                break
+            tagged.append(record)
+    return len(legacy).to_bytes(2, byteorder='big') + b''.join(legacy) + b''.join(tagged)
+
+
+def decode_peer_list(body):
+    """
+    :param body: peers as sent in pull responses and shuffles
+    :return: list of the tagged records of the peers, records of unknown families are skipped
+    :raises ValueError: if the body is too short for the number of ipv4 peers it announces
+    """
+    view = memoryview(body)
+    if len(view) < 2:
+        raise ValueError("Peer list of {} bytes has no peer count".format(len(view)))
+    end = 2 + LEGACY_RECORD_SIZE * _unpack_u16(view)[0]
+    if end > len(view):
+        raise ValueError("Peer list of {} bytes is too short for {} ipv4 peers".format(
+            len(view), (end - 2) // LEGACY_RECORD_SIZE))
+    legacy = bytes(view[2:end])
+    records = [_IPV4_PREFIX + legacy[offset:offset + LEGACY_RECORD_SIZE]
+               for offset in range(0, len(legacy) - LEGACY_RECORD_SIZE + 1, LEGACY_RECORD_SIZE)]
+    offset = end
+    while offset + 4 <= len(view):
+        size = 4 + view[offset + 1]
+        if offset + size > len(view):
+            break
+        if _known(view[offset], view[offset + 1]):
+            records.append(bytes(view[offset:offset + size]))
+        offset += size
+    return records
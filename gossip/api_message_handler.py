@@ -1,87 +1,109 @@
-# Handles received announce messages at API layer and creates threads to send corresp. notification messages
+# Handles received announce messages at API layer and sends the corresponding notification messages
 import logging
 
 from gossip.message import *
-from threading import Thread, Lock
-import socket
+from gossip.seen_cache import SeenCache
+from gossip.log import MESSAGE_LOG
+from gossip.queues import P2PItem
+from threading import Thread
 
 
 class AnnounceMessageHandler(Thread):
     """
     Thread to wait on queue of announce messages and take req. action
     """
-    def __init__(self, queue, message_storage, connections, p2p_queue):
+    def __init__(self, queue, message_storage, connections, p2p_queue, seen_cache, batch_size=64, batch_wait=0,
+                 pending_validations=None):
         """
         Constructor
 
         :param queue: Queue from which announced messages are retrieved
         :param message_storage: cache to store messages and subscribers
-        :param connections: connections that already exist
+        :param connections: ConnectionRegistry of the connected API clients, values have a send method
+        :param p2p_queue: queue to put messages to be sent to other peers
+        :param seen_cache: digests of announce messages which were already relayed
+        :param batch_size: maximum number of announce messages taken from the queue at once
+        :param batch_wait: seconds to wait for more messages to fill a batch, 0 to take only what is queued
+        :param pending_validations: PendingValidations holding back relays until the announces were validated
         """
         Thread.__init__(self)
         self.queue = queue
         self.message_storage = message_storage
-        self.lock = Lock()
         self.connections = connections
         self.p2p_queue = p2p_queue
+        self.seen_cache = seen_cache
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pending_validations = pending_validations
 
     def run(self):
         while True:
-            # Processing one announce message from the queue
-            r = self.queue.get()
-            m = AnnounceMessage(r['message'])
+            # Processing everything queued in one pass
+            rs = self.queue.get_batch(self.batch_size, self.batch_wait)
+            self.handle_batch(rs)
+            self.queue.tasks_done(len(rs))
 
-            with self.lock:
-                msg_id = self.message_storage.add_data(m.data_type, m.data, m.ttl)
-                msg = self.message_storage.messages[msg_id]
-
-                # Find all subscribers of that announce message and create threads
-                for sub in self.message_storage.get_subscribers(m.data_type):
-                    n = NotifThread(sub, m.data_type, msg_id, msg, self.connections)
-                    n.start()
-
-                if r['resend']:
-                    # send to peer queue from where it will be transmitted to all known peers
-                    logging.info("Sending to all peers")
-                    self.p2p_queue.put({'action':P2P_ACTION_SEND_ALL, 'message':r['message']})
-            self.queue.task_done()
-
-
-class NotifThread(Thread):
-    """
-    Thread to create and send Notification message
-    """
-    def __init__(self, addr, data_type, msg_id, msg, connections):
+    def handle_announce(self, r):
         """
-        Constructor
+        Stores an announce message, notifies its subscribers and relays it if requested
+        :param r: AnnounceItem with the announce message body and whether it has to be resent to all peers
+        :return: id under which the message was stored, None if it was malformed
+        """
+        msg_ids = self.handle_batch([r])
+        return msg_ids[0] if msg_ids else None
 
-        :param addr: addr of subscriber in format <host>:<port>
-        :param data_type: data type of message to be created
-        :param msg_id: id of created message
-        :param msg: message to be sent
-        :param connections: connections that already exist
+    def handle_batch(self, rs):
         """
-        Thread.__init__(self)
-        self.addr = addr
-        self.data_type = data_type
-        self.msg_id = msg_id
-        self.msg = msg
-        self.connections = connections
+        Handles a batch of announce messages. Copies of the same announcement within the batch are only
+        handled once and all announcements to be resent go to the peers in a single SEND_ALL request.
+        :param rs: list of AnnounceItems as taken by handle_announce
+        :return: ids under which the distinct messages were stored, malformed messages are dropped
+        """
+        announces = {}
+        for r in rs:
+            digest = SeenCache.digest(r.message)
+            if digest not in announces:
+                announces[digest] = r
+            elif r.resend and not announces[digest].resend:
+                announces[digest] = announces[digest]._replace(resend=True)
 
-    def run(self):
-        new_conn = False
-        if self.addr in self.connections.keys():
-            conn = self.connections[self.addr]
-        else:
-            new_conn = True
-            host, port = self.addr.split(":")
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.connect((host, port))
+        msg_ids = []
+        resend = []
+        for digest, r in announces.items():
+            m = AnnounceView(r.message)
+            try:
+                data_type = m.data_type
+            except ValueError as error:
+                # a malformed announce must not stop the handling of all others
+                MESSAGE_LOG.warning("Dropping malformed announce: %s", error)
+                continue
+            msg_id = self.message_storage.add_data(data_type, m.data, m.ttl)
+            msg = self.message_storage.get_message(msg_id)
+            msg_ids.append(msg_id)
+
+            # Encode the notification once and queue it to every connected subscriber
+            subscribers = self.message_storage.get_subscribers(data_type)
+            if subscribers:
+                notification = NotificationMessage(msg_id, data_type, msg.message).prepare_message()
+                for sub in subscribers:
+                    connection = self.connections.get(sub)
+                    if connection is not None:
+                        connection.send(notification)
 
-        notif = NotificationMessage(self.msg_id, self.data_type, self.msg["message"])
-        m = notif.prepare_message()
+            if r.relay:
+                # relayed once a subscriber validated the announce
+                self.pending_validations.add(msg_id, data_type, r.relay, has_subscribers=bool(subscribers))
 
-        conn.sendall(m)
+            if r.resend:
+                # remember own announcements so they are not relayed again when peers send them back,
+                # one which was already sent or received before reached the peers then
+                if self.seen_cache.check_and_add(digest):
+                    MESSAGE_LOG.debug("Not resending duplicate announce message")
+                else:
+                    resend.append(r.message)
 
-        if new_conn:
-            conn.close()
+        if resend:
+            # send to peer queue from where it will be transmitted to all known peers
+            MESSAGE_LOG.debug("Sending %d announces to all peers", len(resend))
+            self.p2p_queue.put(P2PItem(P2P_ACTION_SEND_ALL, messages=resend))
+        return msg_ids
@@ -0,0 +1,421 @@
+# asyncio transport: serves the API and P2P ports and sends to peers from a single event loop
+import asyncio
+import logging
+from collections import deque
+from threading import Event, Thread
+import gossip.exceptions as e
+import gossip.codes as c
+from gossip.message import GossipSendContentMessage, is_send_content
+from gossip.server import HELLO_MESSAGE, process_api_message
+from gossip.utils import FrameReader
+from gossip.connection_manager import configure_socket
+from gossip.connection_writer import POLICY_BLOCK, POLICY_DROP, MAX_FRAME_SIZE, add_frames, message_size
+from gossip.log import MESSAGE_LOG
+from gossip.address import format_address, split_address
+from gossip.metrics import REGISTRY, count_received, count_sent
+from gossip.queues import IncomingItem, P2PItem
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnection:
+    """
+    Socket like wrapper around an asyncio stream writer.
+    Lets the handler threads send on a connection that is owned by the event loop.
+
+    Like the queue of ConnectionWriter, at most queue_size messages wait in the write buffer of the stream.
+    Further messages are dropped with POLICY_DROP, with POLICY_BLOCK put and send wait until the peer took
+    enough of them.
+
+    Once batching is enabled, send content messages written in the same iteration of the event loop, or
+    within frame_batch_wait seconds, are packed into batch frames of up to frame_batch_size bytes like
+    ConnectionWriter does. Any other message first writes the batch frame which is being filled.
+    """
+    def __init__(self, loop, writer, layer, queue_size=1024, policy=POLICY_DROP):
+        """
+        :param loop: event loop owning the writer
+        :param writer: asyncio.StreamWriter of the connection
+        :param layer: 'p2p' or 'api', used as label of the metrics
+        :param queue_size: maximum number of messages waiting to be sent
+        :param policy: POLICY_DROP to discard new messages or POLICY_BLOCK to wait when the buffer is full
+        """
+        self.loop = loop
+        self.writer = writer
+        self.layer = layer
+        self.queue_size = queue_size
+        self.policy = policy
+        self.dropped = 0
+        self.name = format_address(*writer.get_extra_info('peername')[:2])
+        # sizes of the messages which are not completely sent yet, oldest first, and their sum
+        self.buffered = deque()
+        self.buffered_size = 0
+        # send content messages waiting for the batch frame they are packed into, and the size of the frame
+        self.batch = []
+        self.batch_size = 4
+        self.flush_handle = None
+        self.frame_batch_size = 0
+        self.frame_batch_wait = 0
+        # drain waits until the write buffer is empty
+        writer.transport.set_write_buffer_limits(high=0)
+
+    def pending(self):
+        """
+        Called on the event loop
+        :return: number of written messages which are not completely sent yet, including those waiting
+            for their batch frame
+        """
+        # the transport sends its buffer in order, so everything written before the rest of the buffer is sent
+        sent = self.buffered_size - self.writer.transport.get_write_buffer_size()
+        while self.buffered and sent >= self.buffered[0]:
+            size = self.buffered.popleft()
+            sent -= size
+            self.buffered_size -= size
+        return len(self.buffered) + len(self.batch)
+
+    def write(self, message):
+        """
+        Writes a message, called on the event loop
+        :param message: packed message, either bytes like or a tuple of bytes like parts
+        :return: False if the message was dropped
+        """
+        if self.policy == POLICY_DROP and self.pending() >= self.queue_size:
+            self.dropped += 1
+            REGISTRY.inc('gossip_messages_dropped_total', stage='send_queue')
+            MESSAGE_LOG.warning("Send buffer of %s full, dropped message", self.name)
+            return False
+        if self.frame_batch_size and is_send_content(message):
+            self.add_to_batch(message)
+            return True
+        self.flush()
+        self.writer.writelines(message if isinstance(message, tuple) else (message,))
+        count_sent(message, self.layer)
+        size = message_size(message)
+        self.buffered.append(size)
+        self.buffered_size += size
+        return True
+
+    def add_to_batch(self, message):
+        # the outer header of each message is dropped in the batch frame
+        size = message_size(message) - 4
+        if self.batch and self.batch_size + size > self.frame_batch_size:
+            self.flush()
+        self.batch.append(message)
+        self.batch_size += size
+        if self.batch_size >= self.frame_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            # like ConnectionWriter, only wait for more messages while a batch frame is being filled
+            if self.frame_batch_wait:
+                self.flush_handle = self.loop.call_later(self.frame_batch_wait, self.flush)
+            else:
+                self.flush_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        """
+        Writes the batch frame which is being filled, called on the event loop
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.batch:
+            return
+        buffers = []
+        add_frames(buffers, self.batch)
+        self.writer.writelines(buffers)
+        # like ConnectionWriter, messages are counted once they were handed on, not while they wait
+        for message in self.batch:
+            count_sent(message, self.layer)
+        # the frame is accounted for as its messages, the first one carries the header of the frame
+        sizes = [message_size(self.batch[0])] + [message_size(message) - 4 for message in self.batch[1:]]
+        self.buffered.extend(sizes)
+        self.buffered_size += sum(sizes)
+        self.batch = []
+        self.batch_size = 4
+
+    async def put(self, message):
+        """
+        Writes a message, with POLICY_BLOCK waits first while the write buffer is full
+        :return: False if the message was dropped
+        """
+        try:
+            while self.policy == POLICY_BLOCK and self.pending() >= self.queue_size:
+                await self.writer.drain()
+        except ConnectionError as error:
+            # the reader of the connection cleans up, the other peers of a relay still get the message
+            logger.debug("Could not send to %s %s", self.name, error)
+            return False
+        return self.write(message)
+
+    def send(self, message):
+        """
+        Same interface as ConnectionWriter, called by other threads
+        :return: False if the message was dropped, with POLICY_DROP it may still be dropped on the event loop
+        """
+        if self.policy == POLICY_BLOCK:
+            try:
+                return asyncio.run_coroutine_threadsafe(self.put(message), self.loop).result()
+            except RuntimeError as error:
+                # the event loop stopped
+                logger.debug("Could not send %s", error)
+                return False
+        self.loop.call_soon_threadsafe(self.write, message)
+        return True
+
+    def enable_batching(self, frame_batch_size, frame_batch_wait=0):
+        """
+        Lets the connection pack send content messages into batch frames, the peer has to understand them
+        :param frame_batch_size: maximum size of a batch frame in bytes
+        :param frame_batch_wait: seconds to wait for more send content messages to fill a batch frame
+        """
+        self.frame_batch_wait = frame_batch_wait
+        self.frame_batch_size = min(frame_batch_size, MAX_FRAME_SIZE)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.flush_and_close)
+
+    def flush_and_close(self):
+        self.flush()
+        self.writer.close()
+
+
+async def read_messages(reader, frame_reader):
+    """Reads one chunk from an asyncio stream
+
+    :param reader: asyncio.StreamReader of the connection
+    :param frame_reader: FrameReader buffering the unfinished messages of the connection
+    :return: list of all complete messages, each in the format returned by parse_header
+    """
+    data = await reader.read(frame_reader.chunk_size)
+    return frame_reader.feed(data)
+
+
+async def wait_for_capacity(queue):
+    """Waits until a bounded queue has room again
+
+    Not reading from a connection while the queue is full lets TCP slow down its sender.
+    :param queue: BoundedPriorityQueue the messages of the connection are put into
+    """
+    if not queue.full():
+        return
+    loop = asyncio.get_running_loop()
+    room = loop.create_future()
+    queue.when_not_full(lambda: loop.call_soon_threadsafe(_set_done, room))
+    await room
+
+
+def _set_done(future):
+    # the waiting reader may have been cancelled meanwhile
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncTransportThread(Thread):
+    """
+    Thread running the event loop which replaces APIServerThread, P2PServerThread,
+    their client threads and P2PMessageHandler with coroutines.
+    """
+    def __init__(self, api_address, api_port, p2p_address, p2p_port, api_connections, p2p_connections,
+                 announce_queue, incoming_queue, p2p_queue, message_storage, degree, pending_validations=None,
+                 send_queue_size=1024, send_queue_policy=POLICY_DROP):
+        """Constructor.
+
+        :param api_address: address of the API server
+        :param api_port: port of the API server, 0 to pick a free one
+        :param p2p_address: address of the P2P server
+        :param p2p_port: port of the P2P server, 0 to pick a free one
+        :param api_connections: ConnectionRegistry of the connected API clients
+        :param p2p_connections: ConnectionManager of the active p2p connections
+        :param announce_queue: Queue to put received announce messages
+        :param incoming_queue: queue to put messages received from other peers
+        :param p2p_queue: shared queue from which messages to be sent to other peers are read
+        :param message_storage: cache to store messages and subscribers
+        :param degree: maximum connections that can be handled by this peer
+        :param pending_validations: PendingValidations if relays wait for validation, otherwise None
+        :param send_queue_size: maximum number of messages waiting to be sent on each connection
+        :param send_queue_policy: POLICY_DROP or POLICY_BLOCK, what to do when a slow peer fills its buffer
+        """
+        Thread.__init__(self)
+        self.api_address = api_address
+        self.api_port = api_port
+        self.p2p_address = p2p_address
+        self.p2p_port = p2p_port
+        self.api_connections = api_connections
+        self.p2p_connections = p2p_connections
+        self.announce_queue = announce_queue
+        self.incoming_queue = incoming_queue
+        self.p2p_queue = p2p_queue
+        self.message_storage = message_storage
+        self.pending_validations = pending_validations
+        self.degree = degree
+        self.send_queue_size = send_queue_size
+        self.send_queue_policy = send_queue_policy
+        self.loop = None
+        self.connect_slots = None
+        # set once both servers listen, api_port and p2p_port then hold the bound ports
+        self.started = Event()
+        self.stopping = False
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as error:
+            logger.error("Async transport crashed: %s", error)
+
+    def stop(self):
+        """
+        Closes the servers, the thread ends once process_p2p_queue took the next item
+        """
+        self.stopping = True
+        # wakes up the read of the p2p queue, sending to no peers has no effect
+        self.p2p_queue.put(P2PItem(c.P2P_ACTION_SEND_ALL, messages=()))
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        # bounds the number of handshakes in flight, like connect_slots of the threaded transport
+        self.connect_slots = asyncio.Semaphore(self.p2p_connections.max_connecting)
+        api_server = await asyncio.start_server(self.handle_api_client, self.api_address, self.api_port)
+        self.api_port = api_server.sockets[0].getsockname()[1]
+        logger.info("Started API Server at %s:%s", self.api_address, self.api_port)
+        p2p_server = await asyncio.start_server(self.handle_p2p_client, self.p2p_address, self.p2p_port)
+        self.p2p_port = p2p_server.sockets[0].getsockname()[1]
+        logger.info("Started P2P Server at %s:%s", self.p2p_address, self.p2p_port)
+        self.started.set()
+
+        async with api_server, p2p_server:
+            await self.process_p2p_queue()
+
+    def connection(self, writer, layer):
+        return AsyncConnection(self.loop, writer, layer, self.send_queue_size, self.send_queue_policy)
+
+    ############################ API ############################
+
+    async def handle_api_client(self, reader, writer):
+        oip, oport = writer.get_extra_info('peername')[:2]
+        configure_socket(writer.get_extra_info('socket'))
+        logger.info("Started API Client for %s:%s", oip, oport)
+        oaddr = format_address(oip, oport)
+        self.api_connections[oaddr] = self.connection(writer, 'api')
+        try:
+            frame_reader = FrameReader()
+            while True:
+                await wait_for_capacity(self.announce_queue)
+                for msg in await read_messages(reader, frame_reader):
+                    count_received(msg, 'api')
+                    process_api_message(msg, oaddr, self.announce_queue, self.message_storage,
+                                        self.pending_validations)
+
+        except e.ClientDisconnected as error:
+            logger.debug("Client disconnected: %s", error)
+        except e.InvalidHeader as error:
+            logger.error("Invalid header: %s", error)
+        except e.InvalidSize as error:
+            logger.error("Invalid size: %s", error)
+        except e.InvalidMessageType as error:
+            logger.error("Invalid message type: %s", error)
+        except Exception as error:
+            logger.error("API Client crashed: %s", error)
+        self.api_connections.pop(oaddr, None)
+        self.message_storage.remove_subscriber(oaddr)
+        writer.close()
+        logger.info("API Client completed %s:%s", oip, oport)
+
+    ############################ P2P ############################
+
+    async def handle_p2p_client(self, reader, writer):
+        oip, oport = writer.get_extra_info('peername')[:2]
+        configure_socket(writer.get_extra_info('socket'))
+        await self.read_p2p_messages(reader, writer, oip, oport)
+
+    async def read_p2p_messages(self, reader, writer, oip, oport, registered=False):
+        logger.info("Started P2P Client for %s:%s", oip, oport)
+        oaddr = format_address(oip, oport)
+        if not registered:
+            connection = self.connection(writer, 'p2p')
+            self.p2p_connections[oaddr] = {'connection': connection, 'p2p_server_address': oaddr,
+                                           'writer': connection}
+            connection.write(HELLO_MESSAGE)
+        try:
+            frame_reader = FrameReader()
+            while True:
+                await wait_for_capacity(self.incoming_queue)
+                for msg in await read_messages(reader, frame_reader):
+                    count_received(msg, 'p2p')
+                    # add p2p message received on the connection to shared queue
+                    self.incoming_queue.put(IncomingItem(oaddr, msg.type, msg.data))
+
+        except e.ClientDisconnected:
+            logger.debug("Client disconnected")
+        except e.InvalidHeader as error:
+            logger.error("Invalid header: %s", error)
+        except e.InvalidSize as error:
+            logger.error("Invalid size: %s", error)
+        except e.InvalidMessageType as error:
+            logger.error("Invalid message type: %s", error)
+        except Exception as error:
+            logger.error("P2P Client crashed: %s", error)
+        self.p2p_connections.pop(oaddr, None)
+        writer.close()
+        logger.info("P2P Client completed %s:%s", oip, oport)
+        self.incoming_queue.put(IncomingItem(oaddr, c.P2P_CONNECTION_CLOSED, None))
+
+    async def process_p2p_queue(self):
+        while not self.stopping:
+            # the blocking queue is read by a single executor thread, sending happens on the loop
+            m = await self.loop.run_in_executor(None, self.p2p_queue.get)
+            try:
+                if m.action == c.P2P_ACTION_SEND:
+                    await self.send(m.to_address, m.message)
+                elif m.action == c.P2P_ACTION_SEND_ALL:
+                    # wrap each announce once and write the same frame to all open p2p connections
+                    connections = self.p2p_connections.snapshot()
+                    for message in m.messages:
+                        a = GossipSendContentMessage(msg_to_send=message).prepare_message(inner_msg_type=c.GOSSIP_ANNOUNCE)
+                        for _, connection in connections:
+                            await connection['connection'].put(a)
+                        REGISTRY.observe('gossip_relay_fanout', len(connections))
+                elif m.action == c.P2P_ACTION_RELAY:
+                    # forward the received announces to all open p2p connections except their sender
+                    connections = self.p2p_connections.snapshot()
+                    for message, sender in m.messages:
+                        fanout = 0
+                        for addr, connection in connections:
+                            if addr != sender:
+                                await connection['connection'].put(message)
+                                fanout += 1
+                        REGISTRY.observe('gossip_relay_fanout', fanout)
+            except Exception as error:
+                logger.error("Could not send message %s", error)
+            self.p2p_queue.task_done()
+
+    async def send(self, to_addr, message):
+        # reuse a connection to the peer, also when it connected to us from an ephemeral port
+        connection = self.p2p_connections.lookup(to_addr)
+        if connection:
+            await connection['connection'].put(message)
+        elif self.p2p_connections.begin_connect(to_addr, message, self.degree):
+            # connecting runs in its own task, so the queue is not blocked by the handshake
+            self.loop.create_task(self.connect(to_addr, message))
+
+    async def connect(self, to_addr, message):
+        try:
+            host, port = split_address(to_addr)
+            async with self.connect_slots:
+                logger.info("Creating new conn for %s %s", host, port)
+                reader, writer = await asyncio.open_connection(host, port)
+        except ConnectionRefusedError as error:
+            logger.error("Connection refused by %s %s", to_addr, error)
+            self.p2p_connections.finish_connect(to_addr)
+            return
+        except Exception as error:
+            logger.error("Could not establish connection to %s %s", to_addr, error)
+            self.p2p_connections.finish_connect(to_addr)
+            return
+        configure_socket(writer.get_extra_info('socket'))
+        connection = self.connection(writer, 'p2p')
+        connection.write(message)
+        connection.write(HELLO_MESSAGE)
+        entry = {'connection': connection, 'p2p_server_address': to_addr, 'writer': connection}
+        for queued in self.p2p_connections.finish_connect(to_addr, entry):
+            connection.write(queued)
+        # also start a reader to handle further messages
+        await self.read_p2p_messages(reader, writer, host, port, registered=True)
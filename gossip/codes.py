@@ -11,7 +11,20 @@ GOSSIP_P2P_SEND_CONTENT = 507
 MIN = 500
 MAX = 507
 
+# Inner types of GOSSIP_P2P_SEND_CONTENT messages, peers which don't know them ignore them
+GOSSIP_P2P_SHUFFLE = 508
+GOSSIP_P2P_SHUFFLE_REPLY = 509
+# Capabilities of the sender, sent once when a connection is opened
+GOSSIP_P2P_HELLO = 510
+
+# Frame carrying several send content messages, only sent to peers which announced CAPABILITY_BATCH
+GOSSIP_P2P_BATCH = 511
+
+# Capabilities announced in GOSSIP_P2P_HELLO messages, bit flags
+CAPABILITY_BATCH = 1
+
 # Codes to handle actions for p2p processing
 P2P_ACTION_SEND = 0
 P2P_ACTION_SEND_ALL = 1
 P2P_CONNECTION_CLOSED = 2
+P2P_ACTION_RELAY = 3
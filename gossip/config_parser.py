@@ -1,4 +1,42 @@
 import ini, logging
+from gossip.address import split_address
+
+logger = logging.getLogger(__name__)
+
+# Optional entries of the [gossip] section and their default values
+DEFAULTS = {
+    'transport': 'threaded',
+    'workers': 1,
+    'cache_max_age': 0,
+    'max_peers': 1000,
+    'max_connecting': 8,
+    'log_level': 'INFO',
+    'log_levels': '',
+    'log_message_rate': 10,
+    'log_queue': False,
+    'metrics_address': '',
+    'announce_queue_size': 10000,
+    'batch_size': 64,
+    'batch_wait_ms': 0,
+    'incoming_queue_size': 10000,
+    'p2p_queue_size': 10000,
+    'gossip_interval': 10,
+    'gossip_max_interval': 120,
+    'gossip_fanout': 3,
+    'gossip_mode': 'pushpull',
+    'shuffle_length': 8,
+    'pull_response_size': 64,
+    'relay_policy': 'immediate',
+    'pending_validations_size': 1000,
+    'validation_timeout': 5,
+    'validation_timeout_policy': 'drop',
+    'seen_cache_size': 10000,
+    'seen_cache_ttl': 600,
+    'send_queue_size': 1024,
+    'send_queue_policy': 'drop',
+    'frame_batch_size': 16384,
+    'frame_batch_wait_ms': 0,
+}
 
 def parse_address(host):
     """ Split host into address and port.
@@ -8,28 +46,30 @@ def parse_address(host):
     """
     if ':' not in host:
         return {}
-    s = host.replace('[','').replace(']','').split(':')
-    port = int(s[-1])
-    address = ':'.join(s[:-1])
+    address, port = split_address(host)
     return {'address': address, 'port': port}
 
 def parse_config(path_to_config_file):
     """ Parse configuration file and return a dictonary with all relevant data
     
     :param path_to_config_file: string which stores the path to the configuration file which is to be parsed. Caller makes sure that the file actually exists
-    :return: Dict which contains all relevant entries for gossip, so the entire [gossip] section and everything which doesn't belong to any section. 'bootstrapper', 'p2p_address' and 'api_address' get parsed using parse_address
+    :return: Dict which contains all relevant entries for gossip, so the entire [gossip] section and everything which doesn't belong to any section. 'bootstrapper', 'p2p_address', 'api_address' and, if set, 'metrics_address' get parsed using parse_address. Missing optional entries are filled in from DEFAULTS
     """
-    logging.info('Reading in configuration file {}'.format(path_to_config_file))
+    logger.info('Reading in configuration file %s', path_to_config_file)
     with open(path_to_config_file, 'r') as f:
         config = ini.parse(f.read())
         config['gossip']['bootstrapper'] = parse_address(config['gossip']['bootstrapper'])
         config['gossip']['p2p_address'] = parse_address(config['gossip']['p2p_address'])
         config['gossip']['api_address'] = parse_address(config['gossip']['api_address'])
+        if config['gossip'].get('metrics_address'):
+            config['gossip']['metrics_address'] = parse_address(config['gossip']['metrics_address'])
 
     retconf={'hostkey': config['hostkey']}
+    for i in DEFAULTS.keys():
+        retconf[i] = DEFAULTS[i]
     for i in config['gossip'].keys():
         retconf[i] = config['gossip'][i]
-    logging.info('Configuration is: {}'.format(retconf))
+    logger.info('Configuration is: %s', retconf)
     return retconf
 
 if __name__ == '__main__':
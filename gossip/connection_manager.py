@@ -0,0 +1,211 @@
+# Tables of the open connections, shared by the transports and the handlers
+import logging
+import socket
+from threading import BoundedSemaphore
+from gossip.codes import CAPABILITY_BATCH
+from gossip.locks import InstrumentedLock
+
+logger = logging.getLogger(__name__)
+
+# Seconds a connection is idle before keepalive probes are sent, seconds between probes and probes until it is closed
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 5
+
+
+def configure_socket(sock):
+    """
+    Disables Nagle's algorithm, the writers already batch pending messages into one write, and enables
+    TCP keepalive so peers which disappeared without closing their connection are noticed
+    :param sock: connected TCP socket
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # the keepalive timings can not be set on all platforms
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+class ConnectionRegistry(dict):
+    """
+    Open connections of one layer, index: address of the remote endpoint in format <host>:<port>.
+    Changes are guarded by lock, see gossip.locks. Threads sending to all connections iterate
+    a snapshot, so clients connecting and disconnecting meanwhile do not disturb them.
+    """
+    def __init__(self, name):
+        """
+        :param name: name of the registry, used as label of the lock metrics
+        """
+        dict.__init__(self)
+        self.lock = InstrumentedLock(name, reentrant=True)
+        self._snapshot = ()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            dict.__setitem__(self, key, value)
+            self._snapshot = None
+
+    def __delitem__(self, key):
+        with self.lock:
+            dict.__delitem__(self, key)
+            self._snapshot = None
+
+    def pop(self, key, *default):
+        with self.lock:
+            self._snapshot = None
+            return dict.pop(self, key, *default)
+
+    def snapshot(self):
+        """
+        :return: tuple of (address, connection) pairs, shared by all readers until the registry changes
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self.lock:
+                if self._snapshot is None:
+                    self._snapshot = tuple(dict.items(self))
+                snapshot = self._snapshot
+        return snapshot
+
+
+class ConnectionManager(ConnectionRegistry):
+    """
+    Open p2p connections, index: address of the remote endpoint in format <host>:<port>, value: dict with
+    the socket as 'connection', the 'p2p_server_address' the peer listens on and the 'writer' of the connection.
+
+    Connections accepted from other peers are keyed by their ephemeral port, so they are also indexed by the
+    server address the peer advertised. lookup finds a connection under either address, so messages to a
+    peer reuse any open connection to it.
+
+    Connection attempts are tracked until they finished. Messages to an address which is being connected
+    to are queued and sent on the new connection instead of opening a second one, and at most
+    max_connecting handshakes are in flight at the same time.
+
+    Peers announce their capabilities in a hello message after connecting, they are kept as 'capabilities' of
+    the connection. Send content messages to peers which understand batch frames are packed into them.
+
+    Attributes:
+        by_server: dict, index: advertised p2p server address, value: key of the connection
+        connecting: dict, index: address being connected to, value: list of messages to send once connected
+    """
+    def __init__(self, max_connecting=8, frame_batch_size=0, frame_batch_wait=0):
+        """
+        :param max_connecting: maximum number of connection attempts running at the same time
+        :param frame_batch_size: maximum size of batch frames sent to peers which support them, 0 to never send them
+        :param frame_batch_wait: seconds the writers wait for more send content messages to fill a batch frame
+        """
+        ConnectionRegistry.__init__(self, 'p2p_connections')
+        self.by_server = {}
+        self.connecting = {}
+        self.max_connecting = max_connecting
+        self.connect_slots = BoundedSemaphore(max_connecting)
+        self.frame_batch_size = frame_batch_size
+        self.frame_batch_wait = frame_batch_wait
+
+    def __setitem__(self, key, entry):
+        with self.lock:
+            old = dict.get(self, key)
+            if old is not None:
+                self._unindex(key, old)
+            ConnectionRegistry.__setitem__(self, key, entry)
+            self.by_server[entry['p2p_server_address']] = key
+
+    def __delitem__(self, key):
+        with self.lock:
+            self._unindex(key, self[key])
+            ConnectionRegistry.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        with self.lock:
+            if key not in self:
+                return dict.pop(self, key, *default)
+            entry = ConnectionRegistry.pop(self, key)
+            self._unindex(key, entry)
+            return entry
+
+    def _unindex(self, key, entry):
+        if self.by_server.get(entry['p2p_server_address']) == key:
+            del self.by_server[entry['p2p_server_address']]
+
+    def set_server_address(self, key, server_address):
+        """
+        Records the server address a peer advertised on a connection
+        :param key: address of the remote endpoint of the connection
+        :param server_address: address of the p2p server of the peer in format <host>:<port>
+        """
+        with self.lock:
+            entry = dict.get(self, key)
+            if entry is None:
+                return
+            self._unindex(key, entry)
+            entry['p2p_server_address'] = server_address
+            self.by_server[server_address] = key
+
+    def set_capabilities(self, key, capabilities):
+        """
+        Records the capabilities a peer announced on a connection and enables batch frames if it supports them
+        :param key: address of the remote endpoint of the connection
+        :param capabilities: bit flags of the CAPABILITY_* codes
+        """
+        with self.lock:
+            entry = dict.get(self, key)
+            if entry is None:
+                return
+            entry['capabilities'] = capabilities
+        if capabilities & CAPABILITY_BATCH and self.frame_batch_size:
+            entry['writer'].enable_batching(self.frame_batch_size, self.frame_batch_wait)
+
+    def lookup(self, address):
+        """
+        :param address: remote endpoint or advertised server address of a peer
+        :return: the open connection to the peer or None
+        """
+        with self.lock:
+            entry = dict.get(self, address)
+            if entry is None and address in self.by_server:
+                entry = dict.get(self, self.by_server[address])
+            return entry
+
+    def addresses(self):
+        """
+        :return: set of all addresses which are connected or being connected to, under either of their addresses
+        """
+        with self.lock:
+            return set(self) | set(self.by_server) | set(self.connecting)
+
+    def begin_connect(self, address, message, degree):
+        """
+        Registers a connection attempt, unless one to the same address is already running
+        or the open and pending connections reached degree
+        :param address: address of the p2p server to connect to
+        :param message: first message to send on the connection
+        :param degree: maximum number of connections
+        :return: True if the caller has to open the connection, False if the message was queued or dropped
+        """
+        with self.lock:
+            queued = self.connecting.get(address)
+            if queued is not None:
+                queued.append(message)
+                return False
+            if len(self) + len(self.connecting) >= degree:
+                logger.info("Could not add socket for %s, connection limit exceeded", address)
+                return False
+            self.connecting[address] = []
+            return True
+
+    def finish_connect(self, address, entry=None):
+        """
+        Ends a connection attempt
+        :param address: address passed to begin_connect
+        :param entry: the new connection to register under address, None if the attempt failed
+        :return: list of the messages queued while connecting, to be sent on the new connection
+        """
+        with self.lock:
+            if entry is not None:
+                self[address] = entry
+            queued = self.connecting.pop(address, [])
+        if entry is None and queued:
+            logger.info("Dropped %d messages queued for %s", len(queued), address)
+        return queued
@@ -0,0 +1,225 @@
+# Long lived writer threads which own all writes to a single connection
+import logging
+import queue
+import time
+from threading import Thread
+from gossip.message import is_send_content, pack_batch_frame
+from gossip.metrics import REGISTRY, count_sent
+from gossip.log import MESSAGE_LOG
+
+logger = logging.getLogger(__name__)
+
+# What to do when the outbound queue of a slow connection is full
+POLICY_DROP = 'drop'
+POLICY_BLOCK = 'block'
+
+# Seconds a blocked sender waits before it checks again whether the writer was closed
+BLOCK_CHECK_INTERVAL = 0.1
+
+# Maximum number of buffers passed to a single sendmsg call, below IOV_MAX of common platforms
+MAX_BUFFERS = 512
+
+# Largest frame the 16 bit size field of the header allows
+MAX_FRAME_SIZE = 65535
+
+
+class ConnectionWriter(Thread):
+    """
+    Thread to send messages on one connection. Messages are put into a bounded queue
+    and everything pending is written with a single scatter/gather write, so frames of
+    concurrent senders never interleave.
+
+    Once batching is enabled, for peers which announced CAPABILITY_BATCH, consecutive send content messages
+    are packed into batch frames of up to frame_batch_size bytes. Like Nagle's algorithm the writer then waits
+    up to frame_batch_wait seconds for more of them before writing, unless another message is pending.
+    """
+    def __init__(self, connection, name, queue_size, policy=POLICY_DROP, max_batch_size=65536, layer='p2p'):
+        """
+        :param connection: connection to write to
+        :param name: address of the connection, used for logging
+        :param queue_size: maximum number of messages waiting to be sent
+        :param policy: POLICY_DROP to discard new messages or POLICY_BLOCK to wait when the queue is full
+        :param max_batch_size: maximum number of bytes written at once
+        :param layer: 'p2p' or 'api', used as label of the metrics
+        """
+        Thread.__init__(self, daemon=True)
+        self.connection = connection
+        self.name = name
+        self.queue = queue.Queue(queue_size)
+        self.policy = policy
+        self.max_batch_size = max_batch_size
+        self.layer = layer
+        self.dropped = 0
+        self.closed = False
+        self.frame_batch_size = 0
+        self.frame_batch_wait = 0
+
+    def enable_batching(self, frame_batch_size, frame_batch_wait=0):
+        """
+        Lets the writer pack send content messages into batch frames, the peer has to understand them
+        :param frame_batch_size: maximum size of a batch frame in bytes
+        :param frame_batch_wait: seconds to wait for more send content messages to fill a batch frame
+        """
+        self.frame_batch_wait = frame_batch_wait
+        self.frame_batch_size = min(frame_batch_size, MAX_FRAME_SIZE)
+
+    def send(self, message):
+        """
+        Queues a message to be sent
+        :param message: packed message, either bytes like or a tuple of bytes like parts
+        :return: False if the message was dropped
+        """
+        if self.closed:
+            return False
+        if self.policy == POLICY_BLOCK:
+            # a writer which stopped after a failed send never takes from the queue again
+            while True:
+                try:
+                    self.queue.put(message, timeout=BLOCK_CHECK_INTERVAL)
+                    break
+                except queue.Full:
+                    if self.closed:
+                        return False
+            return not self.closed
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            REGISTRY.inc('gossip_messages_dropped_total', stage='send_queue')
+            MESSAGE_LOG.warning("Send queue of %s full, dropped message", self.name)
+            return False
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            # the writer checks closed after its current batch
+            pass
+
+    def run(self):
+        while not self.closed:
+            messages = self.take_pending()
+            if messages[-1] is None:
+                messages.pop()
+                self.closed = True
+            try:
+                send_buffers(self.connection, self.frame(messages))
+            except OSError as error:
+                logger.error("Could not send to %s %s", self.name, error)
+                self.closed = True
+                continue
+            # only what was written is counted, not messages which were dropped or discarded
+            for message in messages:
+                count_sent(message, self.layer)
+        self.discard_pending()
+        logger.debug("Exiting writer for %s", self.name)
+
+    def discard_pending(self):
+        # wakes up senders blocked on the full queue, they see that the writer is closed
+        discarded = 0
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is not None:
+                discarded += 1
+        if discarded:
+            logger.debug("Discarded %d messages for %s", discarded, self.name)
+
+    def take_pending(self):
+        """
+        Waits for the next message and takes everything else that is pending as well
+        :return: list of messages, the last one is None if the writer was closed
+        """
+        message = self.queue.get()
+        messages = [message]
+        size = 0
+        wait = self.frame_batch_wait if self.frame_batch_size else 0
+        deadline = time.monotonic() + wait
+        while message is not None:
+            size += message_size(message)
+            if size >= self.max_batch_size:
+                break
+            # only wait while a batch frame is being filled, other messages are sent right away
+            if wait and (size >= self.frame_batch_size or not is_send_content(message)):
+                wait = 0
+            timeout = deadline - time.monotonic() if wait else 0
+            try:
+                message = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            messages.append(message)
+        return messages
+
+    def frame(self, messages):
+        """
+        :param messages: messages to write
+        :return: list of buffers to write, with consecutive send content messages packed into batch frames
+            if batching is enabled
+        """
+        buffers = []
+        pending = []
+        pending_size = 4
+        limit = self.frame_batch_size
+        for message in messages:
+            if limit and is_send_content(message):
+                # the outer header of each message is dropped in the batch frame
+                size = message_size(message) - 4
+                if pending and pending_size + size > limit:
+                    add_frames(buffers, pending)
+                    pending = []
+                    pending_size = 4
+                pending.append(message)
+                pending_size += size
+                continue
+            if pending:
+                add_frames(buffers, pending)
+                pending = []
+                pending_size = 4
+            buffers.extend(message if isinstance(message, tuple) else (message,))
+        if pending:
+            add_frames(buffers, pending)
+        return buffers
+
+
+def message_size(message):
+    """
+    :param message: packed message, either bytes like or a tuple of bytes like parts
+    :return: size of the message in bytes
+    """
+    if isinstance(message, tuple):
+        return sum(len(part) for part in message)
+    return len(message)
+
+
+def add_frames(buffers, messages):
+    """
+    Adds send content messages to the buffers to write, as batch frame if there is more than one
+    :param buffers: list of buffers to write
+    :param messages: send content messages which fit into one batch frame
+    """
+    if len(messages) == 1:
+        message = messages[0]
+        buffers.extend(message if isinstance(message, tuple) else (message,))
+        return
+    buffers.extend(pack_batch_frame(messages))
+    REGISTRY.observe('gossip_batch_frame_messages', len(messages))
+
+
+def send_buffers(connection, buffers):
+    """
+    Sends all buffers with scatter/gather writes, so they don't have to be joined into one bytes object first
+    :param connection: socket to write to
+    :param buffers: list of bytes like objects
+    """
+    buffers = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer)]
+    while buffers:
+        sent = connection.sendmsg(buffers[:MAX_BUFFERS])
+        # drop what was sent completely and continue with the rest of a partially sent buffer
+        while sent and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if sent:
+            buffers[0] = buffers[0][sent:]
@@ -0,0 +1,59 @@
+# Registry of the message types a node accepts and of the handlers they are dispatched to
+import gossip.codes as c
+
+# Message types accepted in the header of a received message, index: message type, value: name
+MESSAGE_TYPES = {value: name for name, value in vars(c).items()
+                 if name.startswith('GOSSIP_') and c.MIN <= value <= c.MAX}
+
+
+def register_message_type(msg_type, name):
+    """
+    Lets messages of a third party type pass the header check, their handlers are registered
+    with the Dispatcher of the API or the P2P handler
+    :param msg_type: 16 bit message type
+    :param name: name of the message type, registering the same type under another name is an error
+    """
+    if not 0 <= msg_type <= 0xffff:
+        raise ValueError("Message type {} does not fit into 16 bits".format(msg_type))
+    registered = MESSAGE_TYPES.setdefault(msg_type, name)
+    if registered != name:
+        raise ValueError("Message type {} is already registered as {}".format(msg_type, registered))
+
+
+# batch frames are outer types, but were added after the contiguous range of MIN..MAX
+register_message_type(c.GOSSIP_P2P_BATCH, 'GOSSIP_P2P_BATCH')
+
+
+class Dispatcher:
+    """
+    Table of message handlers, index: message type. Handlers are bound once, e.g. to the methods of the
+    handling thread, so dispatching a message is a single dict lookup.
+    """
+    __slots__ = ('handlers',)
+
+    def __init__(self, handlers=None):
+        """
+        :param handlers: dict, index: message type, value: callable handling messages of that type
+        """
+        self.handlers = dict(handlers or {})
+
+    def register(self, msg_type, handler, replace=False):
+        """
+        :param msg_type: message type to handle
+        :param handler: callable taking the same arguments as passed to dispatch
+        :param replace: True to replace a handler which is already registered for msg_type
+        """
+        if msg_type in self.handlers and not replace:
+            raise ValueError("A handler for message type {} is already registered".format(msg_type))
+        self.handlers[msg_type] = handler
+
+    def dispatch(self, msg_type, *args):
+        """
+        Calls the handler of msg_type with args
+        :return: False if no handler is registered for msg_type
+        """
+        handler = self.handlers.get(msg_type)
+        if handler is None:
+            return False
+        handler(*args)
+        return True
@@ -0,0 +1,62 @@
+# Locks of the state shared between the threads of a node
+#
+# Locking model:
+# - Every shared structure owns exactly one lock, which guards all of its attributes: the p2p and api
+#   ConnectionRegistry, MessageStorage, SubscriberRegistry, SeenCache, PeerTable and PendingValidations.
+#   Threads never guard shared state with locks of their own.
+# - A lock is only held while the structure is read or updated in memory, never while writing to a
+#   socket, putting into a queue or calling into another structure. Locks are therefore never nested
+#   and can not deadlock, except that a structure may re-enter its own RLock.
+# - Threads which iterate a structure while others change it, e.g. to send an announce to all
+#   connections, take a snapshot: an immutable copy which is rebuilt only after the structure changed.
+import time
+from threading import Lock, RLock
+
+
+class InstrumentedLock:
+    """
+    Lock which counts how often it was acquired and how often and how long a thread had to wait for it.
+    Uncontended acquisitions cost one extra non-blocking attempt.
+    """
+    def __init__(self, name, reentrant=False):
+        """
+        :param name: name of the guarded structure, used as label of the metrics
+        :param reentrant: True to wrap an RLock, which the owning thread can acquire again
+        """
+        self.name = name
+        self.lock = RLock() if reentrant else Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self.lock.acquire(False):
+            if not blocking:
+                return False
+            started = time.monotonic()
+            if not self.lock.acquire(True, timeout):
+                return False
+            # the counters are only written while holding the lock
+            self.contended += 1
+            self.wait_seconds += time.monotonic() - started
+        self.acquisitions += 1
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def register_metrics(self, metrics):
+        """
+        Exposes the counters as gossip_lock_*{lock=name}
+        :param metrics: registry to expose the counters in
+        """
+        metrics.gauge('gossip_lock_acquisitions_total', lambda: self.acquisitions, lock=self.name)
+        metrics.gauge('gossip_lock_contended_total', lambda: self.contended, lock=self.name)
+        metrics.gauge('gossip_lock_wait_seconds_total', lambda: self.wait_seconds, lock=self.name)
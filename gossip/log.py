@@ -0,0 +1,109 @@
+# Logging setup of a node: levels per subsystem, rate limited per message logs and a non-blocking handler
+#
+# Every module logs through logging.getLogger(__name__), so the subsystems are the module names,
+# e.g. gossip.server or gossip.p2p_handler. Logs written for single messages go to MESSAGE_LOG,
+# gossip.messages, which is rate limited and can be silenced on its own.
+# Arguments are passed %-style, so the message is only formatted if the record is actually emitted.
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from threading import Lock
+
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Logger for everything which is logged once per received or sent message
+MESSAGE_LOG = logging.getLogger('gossip.messages')
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most rate records per second through for every message template, with bursts of up to
+    rate records. The number of suppressed records is appended to the next record that passes.
+    Only runs for records whose level is enabled, so disabled logs cost nothing extra.
+    """
+    def __init__(self, rate, clock=time.monotonic):
+        """
+        :param rate: records per second and template, 0 for unlimited
+        :param clock: function returning the current time in seconds
+        """
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.clock = clock
+        # index: message template, value: [tokens, time of last update, suppressed records]
+        self.buckets = {}
+        self.lock = Lock()
+
+    def filter(self, record):
+        if not self.rate:
+            return True
+        now = self.clock()
+        with self.lock:
+            bucket = self.buckets.get(record.msg)
+            if bucket is None:
+                bucket = self.buckets[record.msg] = [self.rate, now, 0]
+            else:
+                bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = "{} ({} similar suppressed)".format(record.msg, suppressed)
+        return True
+
+
+def parse_levels(levels):
+    """
+    :param levels: string of comma separated logger=LEVEL pairs, e.g. "gossip.server=DEBUG,gossip.messages=WARNING"
+    :return: dict, index: logger name, value: level name
+    """
+    parsed = {}
+    for entry in levels.split(','):
+        if '=' not in entry:
+            continue
+        name, level = entry.split('=', 1)
+        parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+def setup_logging(level='INFO', levels='', message_rate=0, use_queue=False, stream=None):
+    """
+    Configures the root logger. Can be called again, e.g. once the configuration file was read.
+
+    :param level: level of all loggers without their own entry in levels
+    :param levels: levels of single subsystems as accepted by parse_levels
+    :param message_rate: records per second and template let through by MESSAGE_LOG, 0 for unlimited
+    :param use_queue: if True, records are handed to a queue and written by a background thread,
+        so threads handling sockets never wait for the log output
+    :param stream: stream to write to, sys.stderr if not given
+    :return: the started QueueListener if use_queue is True, otherwise None
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        if isinstance(handler, logging.handlers.QueueHandler) and hasattr(handler, 'listener'):
+            handler.listener.stop()
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name, subsystem_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(subsystem_level)
+
+    for message_filter in list(MESSAGE_LOG.filters):
+        MESSAGE_LOG.removeFilter(message_filter)
+    if message_rate:
+        MESSAGE_LOG.addFilter(RateLimitFilter(message_rate))
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(FORMAT))
+    if not use_queue:
+        root.addHandler(output)
+        return None
+    # SimpleQueue is unbounded, so putting a record never blocks
+    handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    handler.listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    handler.listener.start()
+    root.addHandler(handler)
+    return handler.listener
@@ -1,14 +1,247 @@
 # Classes for the different message types
 import struct
+from typing import NamedTuple
 from gossip.codes import *
+from gossip.address import LEGACY_RECORD_SIZE, MAX_PEER_LIST_SIZE, format_address, pack_address, unpack_address, encode_address, \
+    decode_address, encode_peer_list, decode_peer_list
 import logging
 
+logger = logging.getLogger(__name__)
+
+
+def unpack_peer_list(body):
+    """
+    :param body: peer list of a pull response or shuffle, see gossip.address
+    :return: list of peers in format <host>:<port>
+    """
+    return [unpack_address(record) for record in decode_peer_list(body)]
+
+
+def pack_peer_list(peers, max_size=MAX_PEER_LIST_SIZE):
+    """
+    :param peers: iterable of peers in format <host>:<port>
+    :param max_size: maximum size of the packed list, peers which don't fit are left out
+    :return: peer list as sent in pull responses and shuffles
+    """
+    return encode_peer_list([pack_address(peer) for peer in peers], max_size)
+
+
+# Most peers a pull response can carry with its 16 bit size field, if all of them are ipv4 addresses
+MAX_PULL_RESPONSE_PEERS = (MAX_PEER_LIST_SIZE - 2) // 6
+
+
+def pack_relay_message(inner_msg_type, content):
+    """
+    Pack received content to be relayed to other peers with its ttl reduced by 1.
+    Only the headers and the ttl are packed again, the rest of the received content is reused without copying it.
+    :param inner_msg_type: inner message type of the content, the ttl is its first byte
+    :param content: received content body
+    :return: tuple of buffers which make up the message or None if the ttl is used up
+    """
+    ttl = content[0]
+    # ttl 0 means unlimited hops, with ttl 1 this peer is the last one to receive the message
+    if ttl == 1:
+        return None
+    if ttl != 0:
+        ttl -= 1
+    inner_size = 4 + len(content)
+    header = struct.pack(">HHHHB", 4 + inner_size, GOSSIP_P2P_SEND_CONTENT, inner_size, inner_msg_type, ttl)
+    return header, memoryview(content)[1:]
+
+
+_CONTENT_TYPE = GOSSIP_P2P_SEND_CONTENT.to_bytes(2, byteorder='big')
+
+
+def is_send_content(message):
+    """
+    :param message: packed message, either bytes like or a tuple of bytes like parts
+    :return: True if it is a send content message, which can be sent as part of a batch frame
+    """
+    first = message[0] if isinstance(message, tuple) else message
+    return first[2:4] == _CONTENT_TYPE
+
+
+def pack_batch_frame(messages):
+    """
+    Pack send content messages into one batch frame. Only the outer header of each message is dropped,
+    the rest is reused without copying it.
+    :param messages: packed send content messages, each bytes like or a tuple of bytes like parts,
+        which fit into one frame together
+    :return: tuple of buffers which make up the batch frame
+    """
+    parts = [None]
+    size = 4
+    for message in messages:
+        if isinstance(message, tuple):
+            parts.append(memoryview(message[0])[4:])
+            parts.extend(message[1:])
+            size += sum(len(part) for part in message) - 4
+        else:
+            parts.append(memoryview(message)[4:])
+            size += len(message) - 4
+    parts[0] = struct.pack(">HH", size, GOSSIP_P2P_BATCH)
+    return tuple(parts)
+
+
+# Views of received messages. They only keep the message body and unpack fields when they are read,
+# so dispatching a message builds nothing but a tuple. Reading a field of a truncated message raises ValueError.
+
+_unpack_u16 = struct.Struct(">H").unpack_from
+_unpack_legacy_address = struct.Struct(">BBBBH").unpack
+
+
+def _truncated(body):
+    return ValueError("Truncated message of {} bytes".format(len(body)))
+
+
+class AnnounceView(NamedTuple):
+    """Received announce message"""
+    body: memoryview
+
+    @property
+    def ttl(self):
+        try:
+            return self.body[0]
+        except IndexError:
+            raise _truncated(self.body) from None
+
+    @property
+    def data_type(self):
+        try:
+            return _unpack_u16(self.body, 2)[0]
+        except struct.error:
+            raise _truncated(self.body) from None
+
+    @property
+    def data(self):
+        return self.body[4:]
+
+
+class NotifyView(NamedTuple):
+    """Received notify message"""
+    body: memoryview
+
+    @property
+    def data_type(self):
+        try:
+            return _unpack_u16(self.body, 2)[0]
+        except struct.error:
+            raise _truncated(self.body) from None
+
+
+class ValidationView(NamedTuple):
+    """Received validation message"""
+    body: memoryview
+
+    @property
+    def msg_id(self):
+        try:
+            return _unpack_u16(self.body)[0]
+        except struct.error:
+            raise _truncated(self.body) from None
+
+    @property
+    def valid(self):
+        try:
+            return bool(self.body[3])
+        except IndexError:
+            raise _truncated(self.body) from None
+
+
+class PeerAddressView(NamedTuple):
+    """Received push or pull message, both carry the p2p server address of their sender"""
+    body: memoryview
+
+    @property
+    def record(self):
+        return decode_address(self.body)
+
+    @property
+    def address(self):
+        if len(self.body) == LEGACY_RECORD_SIZE:
+            return "%d.%d.%d.%d:%d" % _unpack_legacy_address(self.body)
+        return unpack_address(decode_address(self.body))
+
+
+class PullResponseView(NamedTuple):
+    """Received pull response message"""
+    body: memoryview
+
+    @property
+    def records(self):
+        return decode_peer_list(self.body)
+
+
+class ContentView(NamedTuple):
+    """Received send content message"""
+    body: memoryview
+
+    @property
+    def inner_type(self):
+        try:
+            return _unpack_u16(self.body, 2)[0]
+        except struct.error:
+            raise _truncated(self.body) from None
+
+    @property
+    def content(self):
+        return self.body[4:]
+
+    def relay_message(self):
+        content = self.content
+        if not content:
+            raise _truncated(self.body)
+        return pack_relay_message(self.inner_type, content)
+
+
+class BatchView(NamedTuple):
+    """Received batch frame, the bodies of several send content messages one after the other"""
+    body: memoryview
+
+    @property
+    def contents(self):
+        """
+        :return: list of ContentViews of the carried messages, a malformed rest of the frame is left out
+        """
+        body = self.body
+        contents = []
+        offset = 0
+        while offset + 4 <= len(body):
+            # the inner size includes the inner header
+            end = offset + _unpack_u16(body, offset)[0]
+            if end < offset + 4 or end > len(body):
+                break
+            contents.append(ContentView(body[offset:end]))
+            offset = end
+        return contents
+
+
+class HelloView(NamedTuple):
+    """Content of a received hello message"""
+    content: memoryview
+
+    @property
+    def capabilities(self):
+        # later versions may append fields, which are ignored
+        return _unpack_u16(self.content)[0] if len(self.content) >= 2 else 0
+
+
+class ShuffleView(NamedTuple):
+    """Content of a received shuffle or shuffle reply message"""
+    content: memoryview
+
+    @property
+    def peers(self):
+        return unpack_peer_list(self.content)
+
 
 class AnnounceMessage:
     """
     Class to unpack and store an announce message.
     Accepts the message body as input.
     """
+    __slots__ = ('ttl', 'res', 'data_type', 'data')
+
     def __init__(self, message_body):
         self.ttl, self.res, self.data_type = struct.unpack(">BBH", message_body[:4])
         self.data = message_body[4:]
@@ -19,22 +252,14 @@ class AnnounceMessage:
     def get_storage_data(self):
         return {'data_type': self.data_type, 'data': self.data, 'ttl': self.ttl}
 
-    def reduce_ttl(self):
-        modified_ttl = self.ttl
-        # If ttl is 0, hops are unlimited
-        if self.ttl != 0:
-            modified_ttl -= 1
-        updated_message = struct.pack(">BBH", modified_ttl, self.res, self.data_type)
-        updated_message += self.data
-
-        return updated_message
-
 
 class NotifyMessage:
     """
         Class to unpack and store a notify message.
         Accepts the message body as input.
     """
+    __slots__ = ('res', 'data_type')
+
     def __init__(self, message_body):
         self.res, self.data_type = struct.unpack(">HH", message_body)
 
@@ -46,6 +271,8 @@ class NotificationMessage:
     """
         Class to pack a notification message.
     """
+    __slots__ = ('msg_type', 'msg_id', 'data_type', 'data', 'size', 'message')
+
     def __init__(self, msg_id, data_type, data):
         """
         Constructor
@@ -71,6 +298,8 @@ class ValidationMessage:
         Class to unpack and store a validation message.
         Accepts the message body as input.
     """
+    __slots__ = ('msg_id', 'res', 'valid')
+
     def __init__(self, message_body):
         self.msg_id, self.res, self.valid = struct.unpack(">HB?", message_body)
 
@@ -82,9 +311,11 @@ class GossipPullMessage:
     """
         Class to handle either receiving of a pull message or sending a pull message
     """
+    __slots__ = ('msg_type', 'ip', 'port', 'message')
+
     def __init__(self, self_ip=None, self_port=None, message_body=None):
         """
-        :param self_ip: to send a pull message, use this parameter for own ip
+        :param self_ip: to send a pull message, use this parameter for own ip, hostname or ipv6 address
         :param self_port: to send a pull message, use this parameter for own port
         :param message_body: if pull message was received, use this parameter
         """
@@ -92,7 +323,6 @@ class GossipPullMessage:
             self.msg_type = GOSSIP_P2P_PULL
             self.ip = self_ip
             self.port = self_port
-            self.size = 10
         if message_body:
             self.message = message_body
 
@@ -101,19 +331,15 @@ class GossipPullMessage:
         Pack a pull message with our own address
         :return: packed message
         """
-        ip1, ip2, ip3, ip4 = (int(x) for x in self.ip.split("."))
-        message = struct.pack(">HHBBBBH", self.size, self.msg_type, ip1, ip2, ip3, ip4, self.port)
-        return message
+        body = encode_address(pack_address(format_address(self.ip, self.port)))
+        return struct.pack(">HH", 4 + len(body), self.msg_type) + body
 
     def get_requester_address(self):
         """
         Extract peer who sent pull message
         :return: extracted peer address
         """
-        ip1, ip2, ip3, ip4, port = struct.unpack(">BBBBH", self.message)
-        requester_addr = "{}.{}.{}.{}:{}".format(ip1, ip2, ip3, ip4, port)
-
-        return requester_addr
+        return unpack_address(decode_address(self.message))
 
 
 class GossipPullResponseMessage:
@@ -121,13 +347,17 @@ class GossipPullResponseMessage:
         Class to handle Response messages received to our pull request or
         to send a Response to a Pull message received
     """
-    def __init__(self, peer_list, message_body=None):
+    __slots__ = ('peer_list', 'msg_type', 'max_peers', 'message')
+
+    def __init__(self, peer_list, message_body=None, max_peers=MAX_PULL_RESPONSE_PEERS):
         """
-        :param peer_list: known list of peers
+        :param peer_list: PeerTable of known peers
         :param message_body: if pull response message was received, use this parameter
+        :param max_peers: maximum number of peers sent, a random sample is sent if more are known
         """
         self.peer_list = peer_list
         self.msg_type = GOSSIP_P2P_PULL_RESPONSE
+        self.max_peers = min(max_peers, MAX_PULL_RESPONSE_PEERS)
         if message_body:
             self.message = message_body
 
@@ -136,30 +366,21 @@ class GossipPullResponseMessage:
         Pack a pull response message with our known list of peers
         :return: packed message
         """
-        peer_count = len(self.peer_list)
-        size = 4 + 2 + 6*peer_count
-        message = struct.pack(">HHH", size, self.msg_type, peer_count)
-        for peer in self.peer_list:
-            ip, port = peer.split(":")
-            ip1, ip2, ip3, ip4 = (int(x) for x in ip.split("."))
-            message += struct.pack(">BBBBH", ip1, ip2, ip3, ip4, int(port))
-        return message
+        if len(self.peer_list) > self.max_peers:
+            body = encode_peer_list(self.peer_list.sample_records(self.max_peers))
+        else:
+            body = self.peer_list.packed()
+        return struct.pack(">HH", 4 + len(body), self.msg_type) + body
 
     def update_peer_list(self):
         """
         Extract peers from received pull response message and add them to our known peer list
         :return: peers received from this response message
         """
-        peer_count = int.from_bytes(self.message[0:2], byteorder='big')
-        obtained_peers = []
-        for i in range(peer_count):
-            ip1, ip2, ip3, ip4, port = struct.unpack(">BBBBH", self.message[2+6*i: 2+6*(i+1)])
-            peer = "{}.{}.{}.{}:{}".format(ip1, ip2, ip3, ip4, int(port))
-            obtained_peers.append(peer)
-            if peer not in self.peer_list:
-                self.peer_list.append(peer)
-        logging.info("New peer list: {}".format(self.peer_list))
-        return obtained_peers
+        records = decode_peer_list(self.message)
+        self.peer_list.add_records(records)
+        logger.debug("Received %d peers, %d known", len(records), len(self.peer_list))
+        return [unpack_address(record) for record in records]
 
 
 class GossipPushMessage:
@@ -167,10 +388,12 @@ class GossipPushMessage:
         Class to handle received messages which are Pushed and
         also to send Push messages with our ip
     """
+    __slots__ = ('msg_type', 'ip', 'port', 'peer_list', 'message')
+
     def __init__(self, peer_list=None, self_ip=None, self_port=None, message_body=None):
         """
         :param peer_list: if pull message was received, use this parameter to add received peer address
-        :param self_ip: to send a pull message, use this parameter for own ip
+        :param self_ip: to send a pull message, use this parameter for own ip, hostname or ipv6 address
         :param self_port: to send a pull message, use this parameter for own port
         :param message_body: if pull message was received, use this parameter
         """
@@ -178,7 +401,6 @@ class GossipPushMessage:
             self.msg_type = GOSSIP_P2P_PUSH
             self.ip = self_ip
             self.port = self_port
-            self.size = 10
         if message_body:
             self.peer_list = peer_list
             self.message = message_body
@@ -188,19 +410,17 @@ class GossipPushMessage:
         Pack a push message with our own address
         :return: packed message
         """
-        ip1, ip2, ip3, ip4 = (int(x) for x in self.ip.split("."))
-        message = struct.pack(">HHBBBBH", self.size, self.msg_type, ip1, ip2, ip3, ip4, self.port)
-        return message
+        body = encode_address(pack_address(format_address(self.ip, self.port)))
+        return struct.pack(">HH", 4 + len(body), self.msg_type) + body
 
     def add_received_peer(self):
         """
         Add pushed peer from received message to known list of peers
         :return: peer received in this message
         """
-        ip1, ip2, ip3, ip4, port = struct.unpack(">BBBBH", self.message)
-        received_peer = "{}.{}.{}.{}:{}".format(ip1, ip2, ip3, ip4, port)
-        self.peer_list.append(received_peer)
-        logging.info("New peer list: {}".format(self.peer_list))
+        received_peer = unpack_address(decode_address(self.message))
+        self.peer_list.add(received_peer)
+        logger.debug("Received pushed peer %s, %d known", received_peer, len(self.peer_list))
         return received_peer
 
 
@@ -209,6 +429,8 @@ class GossipSendContentMessage:
         Class to handle received arbitrary content and
         to send arbitrary content
     """
+    __slots__ = ('outer_msg_type', 'outer_size', 'msg_body', 'inner_size', 'inner_msg_type')
+
     def __init__(self, msg_to_send=None, message_body=None):
         """
         :param msg_to_send: to send message, use this parameter
@@ -233,6 +455,13 @@ class GossipSendContentMessage:
     def get_content_body(self):
         return self.msg_body
 
+    def prepare_relay_message(self):
+        """
+        Pack a received announce message to be relayed to other peers with its ttl reduced by 1
+        :return: tuple of buffers which make up the message or None if the ttl is used up
+        """
+        return pack_relay_message(self.inner_msg_type, self.msg_body)
+
     def prepare_message(self, inner_msg_type=None):
         """
         Pack an arbitrary message
@@ -246,5 +475,62 @@ class GossipSendContentMessage:
         else:
             message = struct.pack(">HH", self.outer_size, self.outer_msg_type)
         message += self.msg_body
-        logging.info("Created arbitrary msg: {}".format(message))
         return message
+
+
+class GossipShuffleMessage:
+    """
+        Class to handle shuffle messages, which exchange small random samples of peers between neighbours.
+        They are sent as content of a GOSSIP_P2P_SEND_CONTENT message, so peers which don't know them ignore them.
+    """
+    __slots__ = ('msg_type', 'peers', 'message')
+
+    def __init__(self, peers=None, reply=False, message_body=None):
+        """
+        :param peers: to send a shuffle message, use this parameter for the peers in format <host>:<port>
+        :param reply: True to send the reply to a received shuffle message
+        :param message_body: if shuffle message was received, use this parameter for the content body
+        """
+        self.msg_type = GOSSIP_P2P_SHUFFLE_REPLY if reply else GOSSIP_P2P_SHUFFLE
+        if peers is not None:
+            self.peers = peers
+        if message_body is not None:
+            self.message = message_body
+
+    def prepare_message(self):
+        """
+        Pack a shuffle message with our sample of peers
+        :return: packed message
+        """
+        # the inner header of the send content message takes another 4 bytes
+        body = pack_peer_list(self.peers, MAX_PEER_LIST_SIZE - 4)
+        return GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=self.msg_type)
+
+    def get_peers(self):
+        """
+        Extract peers from received shuffle message
+        :return: list of peers in format <host>:<port>
+        """
+        return unpack_peer_list(self.message)
+
+
+class GossipHelloMessage:
+    """
+        Class to handle hello messages, which announce the capabilities of their sender when a connection is opened.
+        They are sent as content of a GOSSIP_P2P_SEND_CONTENT message, so peers which don't know them ignore them.
+    """
+    __slots__ = ('capabilities',)
+
+    def __init__(self, capabilities=0):
+        """
+        :param capabilities: bit flags of the CAPABILITY_* codes supported by this peer
+        """
+        self.capabilities = capabilities
+
+    def prepare_message(self):
+        """
+        Pack a hello message with our capabilities
+        :return: packed message
+        """
+        body = struct.pack(">H", self.capabilities)
+        return GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=GOSSIP_P2P_HELLO)
@@ -1,48 +1,132 @@
 # Deals with cache to store announced Data and subscribers to data types
-from collections import defaultdict
-from random import randint
+from collections import defaultdict, OrderedDict
+from random import randrange
+import time
+from typing import Any, NamedTuple
+from gossip.locks import InstrumentedLock
+from gossip.subscribers import SubscriberRegistry
+
+# Message ids are sent as 16 bit fields in notification and validation messages
+MSG_ID_SPACE = 1 << 16
+
+
+class StoredMessage(NamedTuple):
+    """Message kept in the cache, valid is set to False once an API client reported it as invalid"""
+    message: Any
+    ttl: int
+    valid: int = 0
 
 
 class MessageStorage:
     """
     Class to maintain a storage for messages.
+    When the cache is full the least recently used message is evicted,
+    messages older than max_age are expired.
+    All messages are guarded by lock, the subscribers by the lock of their registry.
 
     Attributes:
         data_types: Stores message ids of all announced messages of given data_type
-            dict of list, index: data_type, value: list of message ids
-        messages: Stores message info of given message_id
-            dict of dict, index: message id, value of format: {"message":message, "ttl": ttl, "valid":0}
-        subscribers: Stores list of subscribers to given data_type
-            dict of list, index: data_type, value: list of subscribers
+            dict of dict, index: data_type, value: dict with message ids as keys in insertion order
+        messages: Stores message info of given message_id, least recently used first
+            OrderedDict of StoredMessage, index: message id
+        created: Stores time a message was added, oldest first
+            OrderedDict, index: message id, value: (time of creation, data_type)
+        subscribers: SubscriberRegistry of the API clients subscribed to data types
         cache_size: Maximum number of messages that can be stored
+        max_age: Seconds after which a message is expired, 0 keeps messages until they are evicted
+        evictions: Number of messages removed because the cache was full
+        expirations: Number of messages removed because they were older than max_age
     """
-    def __init__(self, cache_size):
-        self.data_types = defaultdict(list)
-        self.messages = {}
-        self.subscribers = defaultdict(list)
+    def __init__(self, cache_size, max_age=0, clock=time.monotonic):
+        if not 0 < cache_size <= MSG_ID_SPACE:
+            raise ValueError("cache_size must be between 1 and {}".format(MSG_ID_SPACE))
+        self.data_types = defaultdict(dict)
+        self.messages = OrderedDict()
+        self.created = OrderedDict()
+        self.subscribers = SubscriberRegistry()
         self.cache_size = cache_size
+        self.max_age = max_age
+        self.clock = clock
+        self.evictions = 0
+        self.expirations = 0
+        self.next_msg_id = randrange(MSG_ID_SPACE)
+        self.lock = InstrumentedLock('message_storage', reentrant=True)
 
     def add_data(self, data_type, data, ttl):
-        if len(self.messages) < self.cache_size:
-            msg_id = self.get_random_msg_id()
-            self.data_types[data_type].append(msg_id)
-            self.messages[msg_id] = {"message":data, "ttl": ttl, "valid":0}
+        with self.lock:
+            self.expire()
+            if len(self.messages) >= self.cache_size:
+                # evict least recently used message
+                msg_id = next(iter(self.messages))
+                self.remove(msg_id)
+                self.evictions += 1
+            msg_id = self.get_free_msg_id()
+            self.data_types[data_type][msg_id] = None
+            self.messages[msg_id] = StoredMessage(data, ttl)
+            self.created[msg_id] = (self.clock(), data_type)
             return msg_id
 
+    def get_message(self, msg_id):
+        """
+        Looks up a message and marks it as recently used
+        :param msg_id: id of the message
+        :return: StoredMessage or None if the message is not (anymore) in the cache
+        """
+        with self.lock:
+            message = self.messages.get(msg_id)
+            if message is not None:
+                self.messages.move_to_end(msg_id)
+            return message
+
+    def remove(self, msg_id):
+        with self.lock:
+            self.messages.pop(msg_id)
+            created, data_type = self.created.pop(msg_id)
+            ids = self.data_types[data_type]
+            ids.pop(msg_id)
+            if not ids:
+                del self.data_types[data_type]
+
+    def expire(self):
+        if not self.max_age:
+            return
+        with self.lock:
+            deadline = self.clock() - self.max_age
+            while self.created:
+                msg_id, (created, data_type) = next(iter(self.created.items()))
+                if created > deadline:
+                    break
+                self.remove(msg_id)
+                self.expirations += 1
+
     def add_subscriber(self, data_type, subscriber):
-        self.subscribers[data_type].append(subscriber)
+        return self.subscribers.add(data_type, subscriber)
+
+    def remove_subscriber(self, subscriber):
+        self.subscribers.remove(subscriber)
 
     def get_message_ids(self, data_type):
-        return self.data_types[data_type]
+        with self.lock:
+            return list(self.data_types.get(data_type, ()))
 
     def get_subscribers(self, data_type):
-        return self.subscribers[data_type]
+        return self.subscribers.get(data_type)
 
-    def get_random_msg_id(self):
-        r = randint(0, 100)
-        while r in self.messages.keys():
-            r = randint(0, 100)
-        return r
+    def get_free_msg_id(self):
+        # ids are handed out round robin over the whole id space, at most cache_size of them are in use
+        with self.lock:
+            msg_id = self.next_msg_id
+            while msg_id in self.messages:
+                msg_id = (msg_id + 1) % MSG_ID_SPACE
+            self.next_msg_id = (msg_id + 1) % MSG_ID_SPACE
+            return msg_id
 
     def make_invalid(self, msg_id):
-        self.messages[msg_id]["valid"] = False
+        with self.lock:
+            message = self.messages.get(msg_id)
+            if message is not None:
+                # replacing the value of an existing key keeps its position in the LRU order
+                self.messages[msg_id] = message._replace(valid=False)
+
+    def __len__(self):
+        return len(self.messages)
@@ -0,0 +1,162 @@
+# Counters, gauges and summaries of a running node and an HTTP endpoint to scrape them
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import json
+import logging
+import gossip.codes as c
+from gossip.address import address_family as family_of
+
+logger = logging.getLogger(__name__)
+
+# Names of the message type codes, used as label values
+CODE_NAMES = {value: name for name, value in vars(c).items() if name.startswith('GOSSIP_')}
+
+
+class Metrics:
+    """
+    Registry of metrics. Recording only updates a dict entry under a lock, gauges are
+    callables which are evaluated when the metrics are read.
+
+    Attributes:
+        counters: dict, index: (name, labels), value: total
+        summaries: dict, index: (name, labels), value: [count, sum, max]
+        gauges: dict, index: (name, labels), value: callable returning the current value
+    """
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.summaries = {}
+        self.gauges = {}
+        self.lock = Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                self.summaries[key] = [1, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                if value > summary[2]:
+                    summary[2] = value
+
+    def gauge(self, name, callback, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = callback
+
+    def snapshot(self):
+        """
+        :return: dict of all current values, index: name with labels in prometheus notation
+        """
+        values = {}
+        with self.lock:
+            for key, value in self.counters.items():
+                values[format_key(*key)] = value
+            for (name, labels), (count, total, maximum) in self.summaries.items():
+                values[format_key(name + '_count', labels)] = count
+                values[format_key(name + '_sum', labels)] = total
+                values[format_key(name + '_max', labels)] = maximum
+        for key, callback in list(self.gauges.items()):
+            try:
+                values[format_key(*key)] = callback()
+            except Exception as error:
+                logger.debug("Could not read gauge %s: %s", key[0], error)
+        return values
+
+    def exposition(self):
+        """
+        :return: all current values in the prometheus text format
+        """
+        return "".join("{} {}\n".format(key, value) for key, value in sorted(self.snapshot().items()))
+
+
+def format_key(name, labels):
+    if not labels:
+        return name
+    return "{}{{{}}}".format(name, ",".join('{}="{}"'.format(label, value) for label, value in labels))
+
+
+def count_sent(message, layer, metrics=None):
+    """
+    Records a message that is sent
+    :param message: packed message, either bytes like or a tuple of bytes like parts
+    :param layer: 'p2p' or 'api'
+    :param metrics: registry to record to, REGISTRY if not given
+    """
+    metrics = metrics or REGISTRY
+    parts = message if isinstance(message, tuple) else (message,)
+    msg_type = int.from_bytes(parts[0][2:4], byteorder='big')
+    msg_type = CODE_NAMES.get(msg_type, msg_type)
+    metrics.inc('gossip_messages_sent_total', layer=layer, type=msg_type)
+    metrics.inc('gossip_bytes_sent_total', sum(len(part) for part in parts), layer=layer, type=msg_type)
+
+
+def count_received(msg, layer, metrics=None):
+    """
+    Records a message that was received
+    :param msg: Frame of the message as returned by FrameReader
+    :param layer: 'p2p' or 'api'
+    :param metrics: registry to record to, REGISTRY if not given
+    """
+    metrics = metrics or REGISTRY
+    msg_type = CODE_NAMES.get(msg.type, msg.type)
+    metrics.inc('gossip_messages_received_total', layer=layer, type=msg_type)
+    metrics.inc('gossip_bytes_received_total', msg.size, layer=layer, type=msg_type)
+
+
+# Registry used by all modules of a node
+REGISTRY = Metrics()
+
+
+class MetricsServerThread(Thread):
+    """
+    Serves the metrics over HTTP, /metrics in prometheus text format and /metrics.json as JSON snapshot
+    """
+    def __init__(self, address, port, metrics=REGISTRY):
+        """
+        :param address: address to bind to
+        :param port: port to bind to
+        :param metrics: registry to serve
+        """
+        Thread.__init__(self, daemon=True)
+        self.address = address
+        self.port = port
+        self.metrics = metrics
+
+    def run(self):
+        metrics = self.metrics
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = metrics.exposition().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class MetricsServer(ThreadingHTTPServer):
+            address_family = family_of(self.address)
+
+        try:
+            server = MetricsServer((self.address, self.port), MetricsRequestHandler)
+            logger.info("Started metrics server at %s:%s", self.address, self.port)
+            server.serve_forever()
+        except Exception as error:
+            logger.error("Metrics server crashed at %s:%s %s", self.address, self.port, error)
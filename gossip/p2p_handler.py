@@ -1,28 +1,60 @@
-from threading import Thread, Lock
+from threading import Thread
 import gossip.codes as c
 from gossip.message import *
+from gossip.address import format_address, unpack_address
+from gossip.seen_cache import SeenCache
+from gossip.dispatch import Dispatcher
+from gossip.log import MESSAGE_LOG
+from gossip.queues import P2PItem, AnnounceItem
+from gossip.validation import RELAY_IMMEDIATE, RELAY_VALIDATED, count_relay
 import logging
 import random
 
+logger = logging.getLogger(__name__)
+
+
+class Batch:
+    """
+    Actions collected while handling a batch of messages, they are taken once after the batch
+    """
+    __slots__ = ('relays', 'obtained_peers', 'reconnect')
+
+    def __init__(self):
+        self.relays = []
+        self.obtained_peers = []
+        self.reconnect = False
+
 
 class P2PHandler(Thread):
     """
-        Thread to process incoming messages from P2P connections and take corresponding actions based on message type
+        Thread to process incoming messages from P2P connections and take corresponding actions based on message type.
+        Messages are handed to the handlers registered in dispatcher by their type, send content messages to
+        those registered in content_dispatcher by their inner type. Third party types register there too, outer
+        types also with gossip.dispatch.register_message_type.
     """
     def __init__(self, incoming_queue, peer_list, announce_queue, p2p_queue, p2p_connections, self_address, self_port,
-                 bootstrapper_address, bootstrapper_port, degree):
+                 bootstrapper_address, bootstrapper_port, degree, seen_cache, rng=random, batch_size=64,
+                 batch_wait=0, relay_policy=RELAY_IMMEDIATE, pull_response_size=MAX_PULL_RESPONSE_PEERS, join=True):
         """
 
         :param incoming_queue: contains messages from connections along with sender info
-        :param peer_list: peers known by own P2P server
+        :param peer_list: PeerTable of peers known by own P2P server
         :param announce_queue: queue to put announce messages to be later processed by API handler
         :param p2p_queue: queue to put messages to be sent to other peers
-        :param p2p_connections: dict of active p2p connections with address as key
+        :param p2p_connections: ConnectionManager of the active p2p connections
         :param self_address: address of own p2p server
         :param self_port: port of own p2p server
         :param bootstrapper_address: address of bootstrapper server
         :param bootstrapper_port: port of bootstrapper server
         :param degree: maximum connections that can be handled by this peer
+        :param seen_cache: digests of announce messages which were already relayed
+        :param rng: source of randomness for choosing peers
+        :param batch_size: maximum number of messages taken from the incoming queue at once
+        :param batch_wait: seconds to wait for more messages to fill a batch, 0 to take only what is queued
+        :param relay_policy: RELAY_IMMEDIATE to relay announces right away or RELAY_VALIDATED to hold them
+            back until a local API client validated them
+        :param pull_response_size: maximum number of peers sent in a pull response
+        :param join: True to contact the bootstrapper when started, False if another handler of the node does
         """
         Thread.__init__(self)
         self.incoming_queue = incoming_queue
@@ -35,89 +67,202 @@ class P2PHandler(Thread):
         self.bootstrapper_address = bootstrapper_address
         self.bootstrapper_port = bootstrapper_port
         self.degree = degree
-        self.lock = Lock()
+        self.seen_cache = seen_cache
+        self.rng = rng
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.relay_policy = relay_policy
+        self.pull_response_size = pull_response_size
+        self.join = join
+        # handlers of the message types received from peers, called with sender, message body and Batch
+        self.dispatcher = Dispatcher({
+            c.GOSSIP_P2P_PUSH: self.handle_push,
+            c.GOSSIP_P2P_PULL: self.handle_pull,
+            c.GOSSIP_P2P_PULL_RESPONSE: self.handle_pull_response,
+            c.GOSSIP_P2P_SEND_CONTENT: self.handle_content,
+            c.GOSSIP_P2P_BATCH: self.handle_content_batch,
+            c.P2P_CONNECTION_CLOSED: self.handle_connection_closed,
+        })
+        # handlers of the inner types of send content messages, called with sender, ContentView and Batch
+        self.content_dispatcher = Dispatcher({
+            c.GOSSIP_ANNOUNCE: self.handle_announce,
+            c.GOSSIP_P2P_SHUFFLE: self.handle_shuffle,
+            c.GOSSIP_P2P_SHUFFLE_REPLY: self.handle_shuffle,
+            c.GOSSIP_P2P_HELLO: self.handle_hello,
+        })
 
     def run(self) -> None:
+        if self.join:
+            self.bootstrap()
+
+        while True:
+            msgs = self.incoming_queue.get_batch(self.batch_size, self.batch_wait)
+            self.handle_batch(msgs)
+            self.incoming_queue.tasks_done(len(msgs))
+
+    def bootstrap(self):
         # connect to a bootstrapper and get first list of peers
-        bootstrapper = "{}:{}".format(self.bootstrapper_address, self.bootstrapper_port)
+        bootstrapper = format_address(self.bootstrapper_address, self.bootstrapper_port)
         created_pull_message = GossipPullMessage(self_ip=self.address, self_port=self.port).prepare_message()
-        self.p2p_queue.put(
-            {'action': P2P_ACTION_SEND, 'to_address': bootstrapper, 'message': created_pull_message})
+        self.p2p_queue.put(P2PItem(P2P_ACTION_SEND, bootstrapper, created_pull_message))
 
-        while True:
-            msg = self.incoming_queue.get()
-            sender = msg['sender']
-            msg_type = msg['msg_type']
-            msg_body = msg['msg_body']
-
-            with self.lock:
-                if msg_type == c.GOSSIP_P2P_PUSH:
-                    logging.info("Received message type GOSSIP_P2P_PUSH")
-                    push_message = GossipPushMessage(peer_list=self.peer_list, message_body=msg_body)
-                    # Adding pushed peer address to our list of known peers
-                    received_peer = push_message.add_received_peer()
-                    # Correcting p2p server address of this connection by adding separate attribute
-                    self.connections[sender]['p2p_server_address'] = received_peer
-
-                elif msg_type == c.GOSSIP_P2P_PULL_RESPONSE:
-                    logging.info("Received message type GOSSIP_P2P_PULL_RESPONSE")
-                    pull_response_message = GossipPullResponseMessage(peer_list=self.peer_list, message_body=msg_body)
-                    # Adding received list of peers to our known peer list
-                    obtained_peers = pull_response_message.update_peer_list()
-                    # Creating connections to the received peer list
-                    self.add_new_connections(obtained_peers)
-
-                elif msg_type == c.GOSSIP_P2P_PULL:
-                    logging.info("Received message type GOSSIP_P2P_PULL")
-                    pull_message = GossipPullMessage(message_body=msg_body)
-                    requester_server_addr = pull_message.get_requester_address()
-
-                    # Updating p2p server address of this connection
-                    self.connections[sender]['p2p_server_address'] = requester_server_addr
-                    # Send pull response with our known peers to this connection
-                    created_pull_response_message = GossipPullResponseMessage(self.peer_list).prepare_message()
-                    self.p2p_queue.put({'action': c.P2P_ACTION_SEND, 'to_address': sender,
-                                        'message': created_pull_response_message})
-
-                elif msg_type == c.GOSSIP_P2P_SEND_CONTENT:
-                    logging.info("Received Announce message")
-                    send_content_message = GossipSendContentMessage(message_body=msg_body)
-
-                    # If we received an announce message, put in api announce queue
-                    # and send it to other peers after reducing ttl by 1
-                    if send_content_message.get_inner_content_type() == c.GOSSIP_ANNOUNCE:
-                        announce_message_body = send_content_message.get_content_body()
-                        announce_message = AnnounceMessage(announce_message_body)
-                        self.announce_queue.put({'message':announce_message_body, 'resend': False})
-
-                        updated_announce_message = announce_message.reduce_ttl()
-                        self.p2p_queue.put({'action': c.P2P_ACTION_SEND_ALL, 'message': updated_announce_message})
-
-                elif msg_type == c.P2P_CONNECTION_CLOSED:
-                    # Adding new connection from known peer list
-                    logging.info("Received connection closed message {}".format(sender))
-                    self.add_new_connections(self.peer_list)
-
-            self.incoming_queue.task_done()
-
-    def add_new_connections(self, available_peers):
-        # collect server ips of open connections
-        server_addresses = []
-        for key in self.connections.keys():
-            server_addresses.append(self.connections[key]['p2p_server_address'])
-        for address in available_peers:
-            if len(self.connections.keys()) >= self.degree:
-                break
-            else:
-                # only checking peer address is not enough as connection might be in diff name
-                if address not in self.connections.keys() and address not in server_addresses:
-                    # create new connection and add to list of connections
-                    # with equal probability send either a PUSH or PULL message to the new peer
-                    r = random.randint(0,1)
-                    actions = ['PUSH', 'PULL']
-                    message = None
-                    if actions[r] == 'PUSH':
-                        message = GossipPushMessage(self_ip=self.address, self_port=self.port).prepare_message()
-                    elif actions[r] == 'PULL':
-                        message = GossipPullMessage(self_ip=self.address, self_port=self.port).prepare_message()
-                    self.p2p_queue.put({'action': P2P_ACTION_SEND, 'to_address': address, 'message': message})
\ No newline at end of file
+    def handle_message(self, msg):
+        """
+        Takes the action required for one message of the incoming queue
+        :param msg: IncomingItem of the message
+        """
+        self.handle_batch([msg])
+
+    def handle_batch(self, msgs):
+        """
+        Takes the actions required for a batch of messages of the incoming queue. Relayed announces, peers of
+        pull responses and reconnects after closed connections are collected and acted on once per batch.
+        :param msgs: list of IncomingItems of the messages
+        """
+        batch = Batch()
+        for msg in msgs:
+            MESSAGE_LOG.debug("Received message type %d from %s", msg.msg_type, msg.sender)
+            try:
+                handled = self.dispatcher.dispatch(msg.msg_type, msg.sender, msg.msg_body, batch)
+            except ValueError as error:
+                # a malformed message of one peer must not stop the handling of all others
+                MESSAGE_LOG.warning("Dropping malformed message type %d from %s: %s", msg.msg_type, msg.sender, error)
+                continue
+            if not handled:
+                MESSAGE_LOG.debug("Ignoring message type %d from %s", msg.msg_type, msg.sender)
+
+        if batch.relays:
+            self.p2p_queue.put(P2PItem(c.P2P_ACTION_RELAY, messages=batch.relays))
+        if batch.obtained_peers or batch.reconnect:
+            # Creating connections to the peers received in all pull responses of the batch first, slots of
+            # closed connections which they don't fill, e.g. as all of them are connected, from known peer list
+            self.add_new_connections(list(dict.fromkeys(batch.obtained_peers)), fill=batch.reconnect)
+
+    def handle_push(self, sender, body, batch):
+        try:
+            record = PeerAddressView(body).record
+        except ValueError as error:
+            logger.warning("Invalid push message from %s: %s", sender, error)
+            return
+        # Adding pushed peer address to our list of known peers
+        self.peer_list.add_records((record,))
+        # Correcting p2p server address of this connection by adding separate attribute
+        self.connections.set_server_address(sender, unpack_address(record))
+
+    def handle_pull(self, sender, body, batch):
+        try:
+            address = PeerAddressView(body).address
+        except ValueError as error:
+            logger.warning("Invalid pull message from %s: %s", sender, error)
+            return
+        # Updating p2p server address of this connection
+        self.connections.set_server_address(sender, address)
+        # Send pull response with our known peers to this connection
+        created_pull_response_message = GossipPullResponseMessage(
+            self.peer_list, max_peers=self.pull_response_size).prepare_message()
+        self.p2p_queue.put(P2PItem(c.P2P_ACTION_SEND, sender, created_pull_response_message))
+
+    def handle_pull_response(self, sender, body, batch):
+        # Adding received list of peers to our known peer list, connections are created after the batch
+        try:
+            records = PullResponseView(body).records
+        except ValueError as error:
+            logger.warning("Invalid pull response from %s: %s", sender, error)
+            return
+        self.peer_list.add_records(records)
+        batch.obtained_peers.extend(unpack_address(record) for record in records)
+
+    def handle_content(self, sender, body, batch):
+        self.dispatch_content(sender, ContentView(body), batch)
+
+    def handle_content_batch(self, sender, body, batch):
+        # a batch frame carries the bodies of several send content messages
+        for content in BatchView(body).contents:
+            self.dispatch_content(sender, content, batch)
+
+    def dispatch_content(self, sender, content, batch):
+        if not self.content_dispatcher.dispatch(content.inner_type, sender, content, batch):
+            MESSAGE_LOG.debug("Ignoring content type %d from %s", content.inner_type, sender)
+
+    def handle_connection_closed(self, sender, body, batch):
+        logger.info("Received connection closed message %s", sender)
+        batch.reconnect = True
+
+    def handle_announce(self, sender, content, batch):
+        """
+        Puts a received announce into the announce queue and relays it to other peers with its ttl reduced by 1
+        :param sender: address of the connection the announce was received on
+        :param content: ContentView of the received message
+        :param batch: Batch the relay is collected in
+        """
+        announce_message_body = content.content
+        # reading the data type rejects truncated announces before anything is queued
+        data_type = AnnounceView(announce_message_body).data_type
+        # Drop announcements that were already seen, including copies within this batch
+        if self.seen_cache.check_and_add(SeenCache.digest(announce_message_body)):
+            MESSAGE_LOG.debug("Dropping duplicate announce message from %s", sender)
+            return
+        # The received message is forwarded as is, only its ttl is replaced
+        relay_message = content.relay_message()
+        if relay_message and self.relay_policy == RELAY_VALIDATED:
+            # the announce handler holds the relay back until the announce was validated
+            self.announce_queue.put(AnnounceItem(announce_message_body, False, (relay_message, sender)))
+            return
+        self.announce_queue.put(AnnounceItem(announce_message_body, False))
+        if relay_message:
+            batch.relays.append((relay_message, sender))
+            count_relay(data_type, True)
+
+    def handle_hello(self, sender, content, batch):
+        capabilities = HelloView(content.content).capabilities
+        logger.debug("Peer %s announced capabilities %d", sender, capabilities)
+        self.connections.set_capabilities(sender, capabilities)
+
+    def handle_shuffle(self, sender, content, batch):
+        """
+        Mixes the peers of a received shuffle into the peer list. A shuffle request is answered with
+        as many peers of our own, which are replaced first by the received ones when the peer list is full.
+        :param sender: address of the connection the shuffle was received on
+        :param content: ContentView of the received message carrying the shuffle
+        :param batch: Batch of the received message
+        """
+        own_address = format_address(self.address, self.port)
+        try:
+            received = [peer for peer in ShuffleView(content.content).peers if peer != own_address]
+        except ValueError as error:
+            logger.warning("Invalid shuffle from %s: %s", sender, error)
+            return
+        sent = ()
+        if content.inner_type == c.GOSSIP_P2P_SHUFFLE:
+            sent = self.peer_list.sample(len(received), exclude=set(received) | {own_address})
+            reply = GossipShuffleMessage(sent, reply=True).prepare_message()
+            self.p2p_queue.put(P2PItem(c.P2P_ACTION_SEND, sender, reply))
+        self.peer_list.exchange(received, sent)
+
+    def add_new_connections(self, available_peers=(), fill=True):
+        """
+        Opens connections to new peers until degree is reached
+        :param available_peers: peers to choose from first
+        :param fill: True to choose from a uniform sample of the peer list for the slots available_peers leave free
+        """
+        free_slots = self.degree - len(self.connections) - len(self.connections.connecting)
+        if free_slots <= 0:
+            return
+        # only checking peer address is not enough as connection might be in diff name
+        connected = self.connections.addresses()
+        connected.add(format_address(self.address, self.port))
+        new_peers = [address for address in available_peers if address not in connected]
+        new_peers = self.rng.sample(new_peers, min(free_slots, len(new_peers)))
+        if fill and len(new_peers) < free_slots:
+            new_peers += self.peer_list.sample(free_slots - len(new_peers), exclude=connected | set(new_peers))
+        for address in new_peers:
+            # create new connection and add to list of connections
+            # with equal probability send either a PUSH or PULL message to the new peer
+            r = self.rng.randint(0,1)
+            actions = ['PUSH', 'PULL']
+            message = None
+            if actions[r] == 'PUSH':
+                message = GossipPushMessage(self_ip=self.address, self_port=self.port).prepare_message()
+            elif actions[r] == 'PULL':
+                message = GossipPullMessage(self_ip=self.address, self_port=self.port).prepare_message()
+            self.p2p_queue.put(P2PItem(P2P_ACTION_SEND, address, message))
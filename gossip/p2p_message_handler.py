@@ -1,9 +1,15 @@
 import logging
 import socket
-from threading import Thread, Lock
+from threading import Thread
 import gossip.codes as c
 from gossip.server import P2PClientThread
+from gossip.connection_manager import configure_socket
+from gossip.address import split_address
 from gossip.message import GossipSendContentMessage
+from gossip.metrics import REGISTRY
+from gossip.log import MESSAGE_LOG
+
+logger = logging.getLogger(__name__)
 
 
 class P2PMessageHandler(Thread):
@@ -12,91 +18,126 @@ class P2PMessageHandler(Thread):
         to either send response message to a single peer
         or to broadcast messages to all known peers
     """
-    def __init__(self, p2p_queue, p2p_connections, peer_list, incoming_queue, degree):
+    def __init__(self, p2p_queue, p2p_connections, peer_list, incoming_queue, degree, send_queue_size,
+                 send_queue_policy, open_connection=None):
         """
 
         :param p2p_queue: shared queue from which messages to be sent to other peers are read
-        :param p2p_connections: dict of active p2p connections with address as key
-        :param peer_list: peers known by own P2P server
+        :param p2p_connections: ConnectionManager of the active p2p connections
+        :param peer_list: PeerTable of peers known by own P2P server
         :param incoming_queue: contains messages from connections along with sender info
         :param degree: maximum connections that can be handled by this peer
+        :param send_queue_size: maximum number of messages waiting to be sent on a connection
+        :param send_queue_policy: whether to drop or block when the send queue of a connection is full
+        :param open_connection: callable taking an address begin_connect was called for and the first message,
+            it has to end the attempt with finish_connect. Starts a PeerSenderThread if not given, the
+            simulator passes one which connects simulated nodes
         """
         Thread.__init__(self)
         self.queue = p2p_queue
-        self.lock = Lock()
         self.connections = p2p_connections
         self.peer_list = peer_list
         self.incoming_queue = incoming_queue
         self.degree = degree
+        self.send_queue_size = send_queue_size
+        self.send_queue_policy = send_queue_policy
+        self.open_connection = open_connection or self.start_peer_sender
 
     def run(self) -> None:
         while True:
             # Processing one message from p2p queue
-            m = self.queue.get()
-            logging.info("Received message {}".format(m))
-            with self.lock:
-                # Send message to a given address
-                if m['action'] == c.P2P_ACTION_SEND:
-                    p = PeerSenderThread(m['to_address'], m['message'], self.connections, self.incoming_queue, self.degree)
-                    p.start()
-                # Only when messages are announce messages
-                elif m['action'] == c.P2P_ACTION_SEND_ALL:
-                    # Sending to all open p2p connections
-                    a = GossipSendContentMessage(msg_to_send=m['message']).prepare_message(inner_msg_type=c.GOSSIP_ANNOUNCE)
-                    for addr in self.connections.keys():
-                        logging.info("Sending to {}".format(addr))
-                        s = PeerSenderThread(addr, a, self.connections, self.incoming_queue, self.degree)
-                        s.start()
-
+            self.handle(self.queue.get())
             self.queue.task_done()
 
+    def handle(self, m):
+        """
+        Takes the action of one item of the p2p queue
+        :param m: P2PItem
+        """
+        MESSAGE_LOG.debug("Processing action %d", m.action)
+        # Send message to a given address
+        if m.action == c.P2P_ACTION_SEND:
+            # reuse a connection to the peer, also when it connected to us from an ephemeral port
+            connection = self.connections.lookup(m.to_address)
+            if connection:
+                connection['writer'].send(m.message)
+            elif self.connections.begin_connect(m.to_address, m.message, self.degree):
+                self.open_connection(m.to_address, m.message)
+        # Only when messages are announce messages
+        elif m.action == c.P2P_ACTION_SEND_ALL:
+            # Queueing to the writers of all open p2p connections
+            connections = self.connections.snapshot()
+            MESSAGE_LOG.debug("Sending %d announces to %d peers", len(m.messages), len(connections))
+            for message in m.messages:
+                a = GossipSendContentMessage(msg_to_send=message).prepare_message(inner_msg_type=c.GOSSIP_ANNOUNCE)
+                for _, connection in connections:
+                    connection['writer'].send(a)
+                REGISTRY.observe('gossip_relay_fanout', len(connections))
+        # Forwarding received announce messages to all open p2p connections except their sender
+        elif m.action == c.P2P_ACTION_RELAY:
+            connections = self.connections.snapshot()
+            for message, sender in m.messages:
+                fanout = 0
+                for addr, connection in connections:
+                    if addr != sender:
+                        connection['writer'].send(message)
+                        fanout += 1
+                REGISTRY.observe('gossip_relay_fanout', fanout)
+
+    def start_peer_sender(self, to_address, message):
+        PeerSenderThread(to_address, message, self.connections, self.incoming_queue, self.send_queue_size,
+                         self.send_queue_policy).start()
+
 
 class PeerSenderThread(Thread):
     """
-    Thread to send messages to given peer
+    Thread to open a connection to a new peer and send the first message to it, followed by the messages
+    queued by the ConnectionManager while connecting. Further messages are sent by the writer of the connection.
     """
-    def __init__(self, to_addr, message, connections, incoming_queue, degree):
+    def __init__(self, to_addr, message, connections, incoming_queue, send_queue_size, send_queue_policy):
         """
 
-        :param to_addr: address of peer to send a message to
+        :param to_addr: address of peer to send a message to, begin_connect was called for it
         :param message: message to be sent
-        :param connections: dict of active p2p connections with address as key
+        :param connections: ConnectionManager of the active p2p connections
         :param incoming_queue: contains messages from connections along with sender info
-        :param degree: maximum connections that can be handled by this peer
+        :param send_queue_size: maximum number of messages waiting to be sent on the connection
+        :param send_queue_policy: whether to drop or block when the send queue of the connection is full
         """
         Thread.__init__(self)
         self.to_addr = to_addr
         self.message = message
         self.connections = connections
         self.incoming_queue = incoming_queue
-        self.degree = degree
+        self.send_queue_size = send_queue_size
+        self.send_queue_policy = send_queue_policy
 
     def run(self):
-        # If existing connection reuse it otherwise create a new one
-        if self.to_addr in self.connections.keys():
-            conn = self.connections[self.to_addr]['connection']
-            conn.sendall(self.message)
-        else:
-            if len(self.connections) < self.degree:
-                host, port = self.to_addr.split(":")
-                logging.info("Creating new conn for {} {}".format(host, port))
-                try:
-                    conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    conn.connect((host, int(port)))
-                    self.connections[self.to_addr] = {'connection': conn, 'p2p_server_address': self.to_addr}
-                    conn.sendall(self.message)
-                    # also start a new client to handle further messages
-                    t = P2PClientThread(conn,
-                                        host,
-                                        port,
-                                        self.connections,
-                                        self.incoming_queue)
-
-                    t.start()
-                except ConnectionRefusedError as error:
-                    logging.error("Connection refused by {} {}".format(self.to_addr, error))
-                except Exception as error:
-                    logging.error("Could not establish connection to {} {}".format(self.to_addr, error))
-            else:
-                logging.info("Could not add socket for {}, connection limit exceeded".format(self.to_addr))
-            logging.info("Exiting thread for {}".format(self.to_addr))
+        entry = None
+        try:
+            host, port = split_address(self.to_addr)
+            # bounds the number of handshakes in flight
+            with self.connections.connect_slots:
+                logger.info("Creating new conn for %s %s", host, port)
+                conn = socket.create_connection((host, port))
+            configure_socket(conn)
+            # also start a new client to handle further messages
+            t = P2PClientThread(conn,
+                                host,
+                                port,
+                                self.connections,
+                                self.incoming_queue,
+                                self.send_queue_size,
+                                self.send_queue_policy)
+            t.writer.send(self.message)
+            entry = {'connection': conn, 'p2p_server_address': self.to_addr, 'writer': t.writer}
+            for message in self.connections.finish_connect(self.to_addr, entry):
+                t.writer.send(message)
+            t.start()
+        except ConnectionRefusedError as error:
+            logger.error("Connection refused by %s %s", self.to_addr, error)
+        except Exception as error:
+            logger.error("Could not establish connection to %s %s", self.to_addr, error)
+        if entry is None:
+            self.connections.finish_connect(self.to_addr)
+        logger.info("Exiting thread for %s", self.to_addr)
@@ -0,0 +1,295 @@
+# Table of known peers shared by the P2P handlers
+from collections import OrderedDict
+import mmap
+import multiprocessing
+import random
+import struct
+from gossip.address import pack_address, unpack_address, encode_peer_list
+from gossip.locks import InstrumentedLock
+
+# Header of SharedPeerTable: version of the table and size of the records following it
+SHARED_HEADER = struct.Struct('=QI')
+# Largest tagged record, a hostname of 255 bytes
+MAX_RECORD_SIZE = 4 + 255
+
+
+class PeerTable:
+    """
+    Thread safe, bounded set of peers with O(1) membership test and uniform random sampling.
+    When the table is full the peer that was not seen for the longest time is replaced.
+    Peers are kept as the tagged records of gossip.address, so peers received in pull responses
+    are added without formatting them and a pull response is encoded without parsing the peers.
+
+    Attributes:
+        records: packed peers, in no particular order
+            list of tagged records
+        index: Stores position of a peer in records
+            dict, index: packed peer, value: index in records
+        last_seen: Stores peers in the order they were last added, least recently seen first
+            OrderedDict, index: packed peer, value: None
+        max_size: Maximum number of peers that are kept
+        evictions: Number of peers replaced because the table was full
+
+    The encoded peer list is cached until the table changes, peers which are seen again don't change it.
+    """
+    def __init__(self, max_size, peers=(), rng=random):
+        self.records = []
+        self.index = {}
+        self.last_seen = OrderedDict()
+        self.max_size = max_size
+        self.evictions = 0
+        self.rng = rng
+        self.lock = InstrumentedLock('peer_table')
+        self._packed = None
+        self.add_many(peers)
+
+    @staticmethod
+    def pack(peer):
+        """
+        :param peer: peer in format <host>:<port>
+        :return: tagged record
+        """
+        return pack_address(peer)
+
+    @staticmethod
+    def unpack(record):
+        """
+        :param record: tagged record
+        :return: peer in format <host>:<port>
+        """
+        return unpack_address(record)
+
+    def add(self, peer):
+        """
+        Adds a peer or marks it as recently seen if it is already known
+        :param peer: peer in format <host>:<port>
+        :return: True if the peer was not known before
+        """
+        record = self.pack(peer)
+        with self.lock:
+            return self.add_record(record)
+
+    def add_many(self, peers):
+        """
+        :param peers: iterable of peers in format <host>:<port>
+        :return: list of peers which were not known before
+        """
+        packed = [(peer, self.pack(peer)) for peer in peers]
+        with self.lock:
+            return [peer for peer, record in packed if self.add_record(record)]
+
+    def add_records(self, records):
+        """
+        Adds peers given as tagged records, e.g. decoded from a pull response
+        :param records: iterable of tagged records
+        :return: number of peers which were not known before
+        """
+        with self.lock:
+            return sum(self.add_record(record) for record in records)
+
+    def add_record(self, record):
+        # caller holds the lock
+        if record in self.index:
+            self.last_seen.move_to_end(record)
+            return False
+        if len(self.index) >= self.max_size:
+            oldest, _ = self.last_seen.popitem(last=False)
+            self.remove_record(oldest)
+            self.evictions += 1
+        self.index[record] = len(self.records)
+        self.records.append(record)
+        self.last_seen[record] = None
+        self._packed = None
+        return True
+
+    def exchange(self, received, sent=()):
+        """
+        Adds the peers received in a shuffle. While the table is full, peers that were sent to the other
+        side in the same shuffle are replaced before the least recently seen ones, so the views of the
+        two peers get mixed without growing.
+        :param received: peers in format <host>:<port> received from the other side
+        :param sent: peers in format <host>:<port> sent to the other side
+        :return: list of peers which were not known before
+        """
+        received = [(peer, self.pack(peer)) for peer in received]
+        replaceable = list(dict.fromkeys(self.pack(peer) for peer in sent))
+        with self.lock:
+            added = []
+            for peer, record in received:
+                if record not in self.index and len(self.index) >= self.max_size:
+                    while replaceable:
+                        old = replaceable.pop()
+                        if old in self.index:
+                            self.last_seen.pop(old)
+                            self.remove_record(old)
+                            break
+                if self.add_record(record):
+                    added.append(peer)
+            return added
+
+    def remove(self, peer):
+        record = self.pack(peer)
+        with self.lock:
+            if record in self.index:
+                self.last_seen.pop(record)
+                self.remove_record(record)
+
+    def remove_record(self, record):
+        # caller holds the lock, fill the gap with the last record to keep records dense
+        position = self.index.pop(record)
+        self._packed = None
+        last = self.records.pop()
+        if position != len(self.records):
+            self.records[position] = last
+            self.index[last] = position
+
+    def sample_records(self, k, exclude=()):
+        """
+        Picks up to k distinct peers uniformly at random
+        :param k: number of peers to pick
+        :param exclude: tagged records of peers which must not be picked
+        :return: list of tagged records
+        """
+        with self.lock:
+            count = len(self.records)
+            # every excluded peer can hit at most one of the drawn positions
+            positions = self.rng.sample(range(count), min(count, k + len(exclude)))
+            records = []
+            for position in positions:
+                record = self.records[position]
+                if record not in exclude:
+                    records.append(record)
+                    if len(records) == k:
+                        break
+            return records
+
+    def sample(self, k, exclude=()):
+        """
+        Picks up to k distinct peers uniformly at random
+        :param k: number of peers to pick
+        :param exclude: peers in format <host>:<port> which must not be picked
+        :return: list of peers in format <host>:<port>
+        """
+        exclude = {self.pack(peer) for peer in exclude}
+        return [self.unpack(record) for record in self.sample_records(k, exclude)]
+
+    def packed(self):
+        """
+        :return: all peers as peer list of a pull response, see gossip.address
+        """
+        with self.lock:
+            if self._packed is None:
+                self._packed = encode_peer_list(self.records)
+            return self._packed
+
+    def __contains__(self, peer):
+        return self.pack(peer) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.peers())
+
+    def peers(self):
+        """
+        :return: snapshot of all peers in format <host>:<port>
+        """
+        with self.lock:
+            records = list(self.records)
+        return [self.unpack(record) for record in records]
+
+
+class SharedTableLock(InstrumentedLock):
+    """
+    Process shared lock of a SharedPeerTable. Entering it loads the table if another process changed it,
+    leaving it stores the table if it was changed meanwhile.
+    """
+    def __init__(self, name, table, lock):
+        InstrumentedLock.__init__(self, name)
+        self.table = table
+        self.lock = lock
+
+    def acquire(self, blocking=True, timeout=None):
+        # process shared locks only block forever without a timeout
+        return InstrumentedLock.acquire(self, blocking, timeout)
+
+    def __enter__(self):
+        self.acquire()
+        try:
+            self.table.load()
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.table.changed:
+                self.table.store()
+        finally:
+            self.release()
+
+
+class SharedPeerTable(PeerTable):
+    """
+    PeerTable in shared memory, so all worker processes of a node have one view of the membership.
+    Must be created before the workers are forked.
+
+    The records are kept in an anonymous shared mapping in the order they were last seen, together with a
+    version which is increased on every change. Every process keeps the structures of PeerTable as a copy of
+    the table and reloads them when it finds a newer version, so lookups and samples only pay for the
+    process shared lock. evictions are counted per process.
+    """
+    def __init__(self, max_size, peers=(), rng=random):
+        self.version = 0
+        self.changed = False
+        # anonymous shared mappings are inherited by forked processes
+        self.table = mmap.mmap(-1, SHARED_HEADER.size + max_size * MAX_RECORD_SIZE)
+        PeerTable.__init__(self, max_size, rng=rng)
+        self.lock = SharedTableLock('peer_table', self, multiprocessing.get_context('fork').Lock())
+        self.add_many(peers)
+
+    def load(self):
+        # caller holds the lock
+        self.changed = False
+        version, size = SHARED_HEADER.unpack_from(self.table)
+        if version == self.version:
+            return
+        data = self.table[SHARED_HEADER.size:SHARED_HEADER.size + size]
+        records = []
+        offset = 0
+        while offset < size:
+            end = offset + 4 + data[offset + 1]
+            records.append(data[offset:end])
+            offset = end
+        self.records = records
+        self.index = {record: position for position, record in enumerate(records)}
+        self.last_seen = OrderedDict.fromkeys(records)
+        self._packed = None
+        self.version = version
+
+    def store(self):
+        # caller holds the lock, the table is rewritten in the order the peers were last seen
+        data = b''.join(self.last_seen)
+        self.version += 1
+        SHARED_HEADER.pack_into(self.table, 0, self.version, len(data))
+        self.table[SHARED_HEADER.size:SHARED_HEADER.size + len(data)] = data
+        self.changed = False
+
+    def add_record(self, record):
+        self.changed = True
+        return PeerTable.add_record(self, record)
+
+    def remove_record(self, record):
+        self.changed = True
+        PeerTable.remove_record(self, record)
+
+    def __contains__(self, peer):
+        record = self.pack(peer)
+        with self.lock:
+            return record in self.index
+
+    def __len__(self):
+        with self.lock:
+            return len(self.index)
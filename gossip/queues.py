@@ -0,0 +1,212 @@
+# Queues connecting the stages of the processing pipeline
+import collections
+import queue
+import time
+from typing import Any, NamedTuple
+import gossip.codes as c
+from gossip.metrics import REGISTRY
+
+# Priorities of queued items, control messages are kept over content when a queue is full
+PRIORITY_CONTROL = 0
+PRIORITY_CONTENT = 1
+
+
+# Items passed between the stages. Every received message becomes one of them, so they are tuples:
+# smaller than a dict and created without hashing any keys.
+
+class IncomingItem(NamedTuple):
+    """Item of the incoming queue: a message received from a peer or the closing of its connection"""
+    sender: str
+    msg_type: int
+    msg_body: Any
+
+
+class P2PItem(NamedTuple):
+    """
+    Item of the p2p queue. Depending on action it carries the address and message to send (P2P_ACTION_SEND),
+    the announces to send to all peers (P2P_ACTION_SEND_ALL) or (message, sender) pairs to relay
+    to all peers except their sender (P2P_ACTION_RELAY) as messages.
+    """
+    action: int
+    to_address: str = None
+    message: Any = None
+    messages: list = None
+
+
+class AnnounceItem(NamedTuple):
+    """
+    Item of the announce queue: the body of an announce, whether to send it to all peers
+    and for received announces the (message, sender) pair to relay once it is validated
+    """
+    message: Any
+    resend: bool
+    relay: tuple = None
+
+
+class InstrumentedQueue(queue.Queue):
+    """
+    Queue which reports its depth and how long items waited in it.
+    Items are stored together with the time they were put.
+    """
+    def __init__(self, name, maxsize=0, metrics=REGISTRY):
+        """
+        :param name: name of the queue, used as label of its metrics
+        :param maxsize: maximum number of items, 0 for unbounded
+        :param metrics: registry to record to
+        """
+        queue.Queue.__init__(self, maxsize)
+        self.name = name
+        self.metrics = metrics
+        metrics.gauge('gossip_queue_depth', self.qsize, queue=name)
+
+    def _put(self, item):
+        self.queue.append((time.monotonic(), item))
+
+    def _get(self):
+        return self._waited(self.queue.popleft())
+
+    def _waited(self, entry):
+        put_at, item = entry
+        self.metrics.observe('gossip_queue_wait_seconds', time.monotonic() - put_at, queue=self.name)
+        return item
+
+    def get_batch(self, max_items, max_wait=0):
+        """
+        Waits for an item and takes it together with everything else that is queued, taking the lock only once
+        :param max_items: maximum number of items to take
+        :param max_wait: seconds to wait for more items after the first one arrived, 0 to take only what is queued
+        :return: list of items in the order they are taken out of the queue
+        """
+        with self.not_empty:
+            while not self._qsize():
+                self.not_empty.wait()
+            if max_wait:
+                deadline = time.monotonic() + max_wait
+                while self._qsize() < max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.not_empty.wait(remaining)
+            items = [self._get() for _ in range(min(max_items, self._qsize()))]
+            self.not_full.notify_all()
+            return items
+
+    def tasks_done(self, count):
+        """
+        Same as calling task_done count times
+        """
+        with self.all_tasks_done:
+            unfinished = self.unfinished_tasks - count
+            if unfinished < 0:
+                raise ValueError('tasks_done() called too many times')
+            if unfinished == 0:
+                self.all_tasks_done.notify_all()
+            self.unfinished_tasks = unfinished
+
+
+class BoundedPriorityQueue(InstrumentedQueue):
+    """
+    Bounded queue which never blocks the producer. When it is full, the oldest item of the lowest
+    priority is dropped to make room, or the new item if its priority is lower than that of all queued
+    items. Control items are taken out before content items, each in the order they were put.
+    """
+    def __init__(self, name, maxsize, priority=lambda item: PRIORITY_CONTENT, metrics=REGISTRY):
+        """
+        :param name: name of the queue, used as label of its metrics
+        :param maxsize: maximum number of items, 0 for unbounded
+        :param priority: function returning PRIORITY_CONTROL or PRIORITY_CONTENT for an item
+        :param metrics: registry to record to
+        """
+        self.priority = priority
+        self.dropped = 0
+        # callables waiting for room, see when_not_full
+        self.capacity_callbacks = []
+        InstrumentedQueue.__init__(self, name, maxsize, metrics)
+
+    def _init(self, maxsize):
+        self.queues = (collections.deque(), collections.deque())
+
+    def _qsize(self):
+        return len(self.queues[PRIORITY_CONTROL]) + len(self.queues[PRIORITY_CONTENT])
+
+    def _put(self, item):
+        self.queues[self.priority(item)].append((time.monotonic(), item))
+
+    def _get(self):
+        if self.capacity_callbacks:
+            callbacks, self.capacity_callbacks = self.capacity_callbacks, []
+            for callback in callbacks:
+                callback()
+        if self.queues[PRIORITY_CONTROL]:
+            return self._waited(self.queues[PRIORITY_CONTROL].popleft())
+        return self._waited(self.queues[PRIORITY_CONTENT].popleft())
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Puts an item into the queue, dropping an item if the queue is full. Never blocks.
+        :return: False if the new item was dropped
+        """
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                priority = self.priority(item)
+                if self.queues[PRIORITY_CONTENT]:
+                    victim = self.queues[PRIORITY_CONTENT]
+                elif priority == PRIORITY_CONTROL:
+                    victim = self.queues[PRIORITY_CONTROL]
+                else:
+                    self._count_drop()
+                    return False
+                # the dropped item replaces the new one in the count of unfinished tasks
+                victim.popleft()
+                self._count_drop()
+            else:
+                self.unfinished_tasks += 1
+            self._put(item)
+            self.not_empty.notify()
+            return True
+
+    def _count_drop(self):
+        self.dropped += 1
+        self.metrics.inc('gossip_messages_dropped_total', stage=self.name)
+
+    def wait_for_capacity(self, timeout=None):
+        """
+        Blocks while the queue is full, used by producers which can pause, e.g. by not reading from their socket
+        :param timeout: maximum number of seconds to wait, None to wait until there is room
+        :return: True if there is room in the queue
+        """
+        with self.not_full:
+            return self.not_full.wait_for(lambda: not 0 < self.maxsize <= self._qsize(), timeout)
+
+    def when_not_full(self, callback):
+        """
+        Calls callback once the queue has room, right away if it has room now. Lets producers running on
+        an event loop wait without blocking it.
+        :param callback: callable without arguments. It is called by the consumer with the lock of the queue
+            held, so it must not block or use the queue
+        """
+        with self.mutex:
+            if 0 < self.maxsize <= self._qsize():
+                self.capacity_callbacks.append(callback)
+                return
+        callback()
+
+
+# Types of received messages which carry content, single or in batch frames
+_CONTENT_TYPES = frozenset((c.GOSSIP_P2P_SEND_CONTENT, c.GOSSIP_P2P_BATCH))
+
+
+def incoming_priority(item):
+    """
+    :param item: item of the incoming queue
+    :return: PRIORITY_CONTENT for content received from peers, PRIORITY_CONTROL otherwise
+    """
+    return PRIORITY_CONTENT if item.msg_type in _CONTENT_TYPES else PRIORITY_CONTROL
+
+
+def p2p_priority(item):
+    """
+    :param item: item of the p2p queue
+    :return: PRIORITY_CONTENT for announces to be sent to all peers, PRIORITY_CONTROL otherwise
+    """
+    return PRIORITY_CONTENT if item.action in (c.P2P_ACTION_SEND_ALL, c.P2P_ACTION_RELAY) else PRIORITY_CONTROL
@@ -0,0 +1,131 @@
+# Periodic gossip rounds which keep the peer lists of all nodes converging
+from threading import Thread
+import logging
+import random
+import time
+import gossip.codes as c
+from gossip.address import format_address
+from gossip.message import GossipPushMessage, GossipPullMessage, GossipShuffleMessage
+from gossip.queues import P2PItem
+
+logger = logging.getLogger(__name__)
+
+# What is exchanged with the peers picked in a round
+MODE_PUSH = 'push'
+MODE_PULL = 'pull'
+MODE_PUSHPULL = 'pushpull'
+MODE_SHUFFLE = 'shuffle'
+
+
+class GossipScheduler(Thread):
+    """
+    Thread running gossip rounds. Every round picks fanout random peers of the peer list and sends them
+    our address (push), asks them for their peers (pull) or both. With push-pull every node learns about
+    every other node within O(log n) rounds. Once the open connections reached degree no new connection
+    can be opened for a round, so the peers are picked from the connected ones instead.
+
+    In shuffle mode the peer list is a bounded partial view instead: every round exchanges a sample of
+    shuffle_length peers, including our own address, with fanout connected peers. Neither the view nor
+    the messages grow with the size of the network. Without connections a push-pull is sent instead.
+
+    The interval adapts to churn like a trickle timer: it is reset to interval whenever the peer list or
+    the open connections changed since the last round and doubles up to max_interval while they stay the same.
+    The bootstrapper is only contacted when no other peer is known.
+    """
+    def __init__(self, peer_list, p2p_connections, p2p_queue, self_address, self_port, bootstrapper_address,
+                 bootstrapper_port, interval, max_interval, fanout, mode=MODE_PUSHPULL, shuffle_length=8,
+                 rng=random, degree=None):
+        """
+        :param peer_list: PeerTable of peers known by own P2P server
+        :param p2p_connections: ConnectionManager of the active p2p connections
+        :param p2p_queue: queue to put messages to be sent to other peers
+        :param self_address: address of own p2p server
+        :param self_port: port of own p2p server
+        :param bootstrapper_address: address of bootstrapper server
+        :param bootstrapper_port: port of bootstrapper server
+        :param interval: seconds between two rounds while the network changes
+        :param max_interval: seconds between two rounds while the network is stable
+        :param fanout: number of peers contacted per round
+        :param mode: MODE_PUSH, MODE_PULL, MODE_PUSHPULL or MODE_SHUFFLE
+        :param shuffle_length: number of peers exchanged in a shuffle
+        :param rng: source of randomness for choosing peers
+        :param degree: maximum connections of the node, None if unlimited
+        """
+        Thread.__init__(self, daemon=True)
+        self.peer_list = peer_list
+        self.connections = p2p_connections
+        self.p2p_queue = p2p_queue
+        self.address = format_address(self_address, self_port)
+        self.bootstrapper = format_address(bootstrapper_address, bootstrapper_port)
+        self.min_interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.interval = interval
+        self.fanout = fanout
+        self.mode = mode
+        self.shuffle_length = shuffle_length
+        self.rng = rng
+        self.degree = degree
+        self.rounds = 0
+        self.state = None
+
+        # all messages of a round are sent as one write, so a new connection is only opened once per peer
+        message = b''
+        if mode in (MODE_PUSH, MODE_PUSHPULL, MODE_SHUFFLE):
+            message += GossipPushMessage(self_ip=self_address, self_port=self_port).prepare_message()
+        if mode in (MODE_PULL, MODE_PUSHPULL, MODE_SHUFFLE):
+            message += GossipPullMessage(self_ip=self_address, self_port=self_port).prepare_message()
+        if not message:
+            raise ValueError("Unknown gossip mode {}".format(mode))
+        self.message = message
+
+    def run_round(self):
+        """
+        Sends the messages of one round and adapts the interval
+        :return: seconds until the next round
+        """
+        self.rounds += 1
+        connected = [address for address, _ in self.connections.snapshot()]
+        if self.mode == MODE_SHUFFLE and connected:
+            peers = self.shuffle(self.rng.sample(connected, min(self.fanout, len(connected))))
+        else:
+            if self.degree is not None and len(connected) + len(self.connections.connecting) >= self.degree:
+                # sends to peers without a connection would be dropped by begin_connect
+                peers = self.rng.sample(connected, min(self.fanout, len(connected)))
+            else:
+                peers = self.peer_list.sample(self.fanout, exclude={self.address, self.bootstrapper})
+                if not peers and self.bootstrapper != self.address:
+                    peers = [self.bootstrapper]
+            for peer in peers:
+                self.p2p_queue.put(P2PItem(c.P2P_ACTION_SEND, peer, self.message))
+
+        state = (len(self.peer_list), frozenset(connected))
+        if state != self.state:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * 2)
+        self.state = state
+        logger.debug("Gossip round %d with %d peers, next in %.1fs", self.rounds, len(peers), self.interval)
+        return self.interval
+
+    def shuffle(self, connected):
+        """
+        Sends a shuffle to each of the given connections
+        :param connected: addresses of open connections
+        :return: addresses the shuffles were sent to
+        """
+        sent_to = []
+        for address in connected:
+            connection = self.connections.get(address)
+            if connection is None:
+                continue
+            sample = self.peer_list.sample(self.shuffle_length - 1,
+                                           exclude={self.address, connection['p2p_server_address']})
+            message = GossipShuffleMessage([self.address] + sample).prepare_message()
+            self.p2p_queue.put(P2PItem(c.P2P_ACTION_SEND, address, message))
+            sent_to.append(address)
+        return sent_to
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.run_round()
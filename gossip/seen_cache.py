@@ -0,0 +1,140 @@
+# Remembers digests of announced content so every announcement is relayed at most once per node
+from collections import OrderedDict
+from gossip.locks import InstrumentedLock
+import hashlib
+import mmap
+import multiprocessing
+import struct
+import time
+
+# Slot of SharedSeenCache: whether it is used, digest and time the digest was first seen
+SHARED_SLOT = struct.Struct('=?16sd')
+
+
+class SeenCache:
+    """
+    Bounded, time expiring set of message digests.
+
+    Attributes:
+        entries: digests of seen messages in the order they were first seen
+            OrderedDict, index: digest, value: time the digest was first seen
+        capacity: Maximum number of digests that are remembered
+        ttl: Seconds after which a digest is forgotten, 0 keeps digests until they are pushed out by capacity
+        hits: Number of lookups for a digest that was already seen
+        misses: Number of lookups for a digest that was not seen before
+    """
+    def __init__(self, capacity, ttl=0, clock=time.monotonic):
+        self.entries = OrderedDict()
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.lock = InstrumentedLock('seen_cache')
+
+    @staticmethod
+    def digest(announce_message_body):
+        """
+        Digest of an announce message body. The ttl byte is skipped since it changes on every hop.
+        :param announce_message_body: packed announce message without header
+        :return: 16 byte digest
+        """
+        return hashlib.blake2b(announce_message_body[1:], digest_size=16).digest()
+
+    def check_and_add(self, digest):
+        """
+        Checks whether a digest was seen before and remembers it if not
+        :param digest: digest of a message as returned by digest
+        :return: True if the digest was already seen
+        """
+        with self.lock:
+            now = self.clock()
+            self.expire(now)
+            if digest in self.entries:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self.entries[digest] = now
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return False
+
+    def expire(self, now):
+        # entries are ordered by insertion time, so only the oldest ones need to be checked
+        if not self.ttl:
+            return
+        while self.entries:
+            digest, seen_at = next(iter(self.entries.items()))
+            if now - seen_at < self.ttl:
+                break
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SharedSeenCache:
+    """
+    Seen cache in shared memory, so announces are deduplicated across all worker processes of a node.
+    Must be created before the workers are forked.
+
+    The digests are kept in a fixed size set associative table: every digest belongs to one bucket of
+    ways slots and replaces the oldest digest of its bucket when the bucket is full. Buckets are guarded
+    by a fixed number of process shared locks, so workers only wait for each other on the same stripe.
+    hits and misses are counted per process.
+    """
+    def __init__(self, capacity, ttl=0, clock=time.monotonic, ways=4, stripes=64):
+        """
+        :param capacity: number of digests that fit into the table
+        :param ttl: seconds after which a digest is forgotten, 0 keeps digests until they are replaced
+        :param clock: function returning the current time in seconds, the same in all processes
+        :param ways: slots per bucket
+        :param stripes: number of locks guarding the buckets
+        """
+        self.ways = ways
+        self.buckets = max(1, -(-capacity // ways))
+        self.capacity = self.buckets * ways
+        self.ttl = ttl
+        self.clock = clock
+        # anonymous shared mappings are inherited by forked processes
+        self.table = mmap.mmap(-1, self.capacity * SHARED_SLOT.size)
+        context = multiprocessing.get_context('fork')
+        self.locks = [context.Lock() for _ in range(min(stripes, self.buckets))]
+        self.hits = 0
+        self.misses = 0
+
+    digest = staticmethod(SeenCache.digest)
+
+    def check_and_add(self, digest):
+        """
+        Checks whether a digest was seen before by any process and remembers it if not
+        :param digest: digest of a message as returned by digest
+        :return: True if the digest was already seen
+        """
+        key = bytes(digest[:16]).ljust(16, b'\0')
+        bucket = int.from_bytes(key[:8], byteorder='little') % self.buckets
+        start = bucket * self.ways * SHARED_SLOT.size
+        with self.locks[bucket % len(self.locks)]:
+            now = self.clock()
+            victim = victim_seen_at = None
+            for offset in range(start, start + self.ways * SHARED_SLOT.size, SHARED_SLOT.size):
+                used, stored, seen_at = SHARED_SLOT.unpack_from(self.table, offset)
+                if not used or (self.ttl and now - seen_at >= self.ttl):
+                    seen_at = float('-inf')
+                elif stored == key:
+                    self.hits += 1
+                    return True
+                if victim is None or seen_at < victim_seen_at:
+                    victim, victim_seen_at = offset, seen_at
+            SHARED_SLOT.pack_into(self.table, victim, True, key, now)
+            self.misses += 1
+            return False
+
+    def __len__(self):
+        now = self.clock()
+        count = 0
+        for offset in range(0, len(self.table), SHARED_SLOT.size):
+            used, _, seen_at = SHARED_SLOT.unpack_from(self.table, offset)
+            if used and not (self.ttl and now - seen_at >= self.ttl):
+                count += 1
+        return count
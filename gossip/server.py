@@ -1,24 +1,91 @@
 import socket, logging
-from threading import Thread, Lock
+from threading import Thread
 import gossip.exceptions as e
 import gossip.codes as c
 from gossip.message import *
-from gossip.utils import parse_header
+from gossip.utils import FrameReader
+from gossip.connection_writer import ConnectionWriter
+from gossip.connection_manager import configure_socket
+from gossip.address import address_family, format_address
+from gossip.metrics import count_received
+from gossip.dispatch import Dispatcher
+from gossip.log import MESSAGE_LOG
+from gossip.queues import IncomingItem, AnnounceItem
+
+logger = logging.getLogger(__name__)
+
+# Sent first on every p2p connection, every transport understands batch frames
+HELLO_MESSAGE = GossipHelloMessage(c.CAPABILITY_BATCH).prepare_message()
 
 
 ############################ API ############################
 
+def handle_announce(body, oaddr, queue, message_storage, pending_validations):
+    # reading the data type rejects truncated announces before they are queued, like on the P2P side
+    AnnounceView(body).data_type
+    # add the announce to the shared queue
+    queue.put(AnnounceItem(body, True))
+
+
+def handle_notify(body, oaddr, queue, message_storage, pending_validations):
+    # add address of the sender to the subscriber list
+    message_storage.add_subscriber(NotifyView(body).data_type, oaddr)
+
+
+def handle_validation(body, oaddr, queue, message_storage, pending_validations):
+    # if invalid, update validity of the message
+    message = ValidationView(body)
+    if not message.valid:
+        message_storage.make_invalid(message.msg_id)
+    if pending_validations is not None:
+        # relays or drops the announce if it is still waiting for its validation
+        pending_validations.validate(message.msg_id, message.valid)
+
+
+# Handlers of the message types received from API clients, third party types can be registered
+# together with gossip.dispatch.register_message_type
+API_DISPATCHER = Dispatcher({
+    c.GOSSIP_ANNOUNCE: handle_announce,
+    c.GOSSIP_NOTIFY: handle_notify,
+    c.GOSSIP_VALIDATION: handle_validation,
+})
+
+
+def process_api_message(msg, oaddr, queue, message_storage, pending_validations=None):
+    """Takes the action required for a message received from an API client.
+    Shared by the threaded and the asyncio transport.
+
+    :param msg: parsed message as returned by parse_header
+    :param oaddr: address of the API client in format <host>:<port>
+    :param queue: Queue to put received announce messages
+    :param message_storage: cache to store messages and subscribers
+    :param pending_validations: PendingValidations if relays wait for validation, otherwise None
+    """
+    try:
+        handled = API_DISPATCHER.dispatch(msg.type, msg.data, oaddr, queue, message_storage, pending_validations)
+    except ValueError as error:
+        # a malformed message is dropped, the client stays connected
+        MESSAGE_LOG.warning("Dropping malformed message type %d from API client %s: %s", msg.type, oaddr, error)
+        return
+    if not handled:
+        MESSAGE_LOG.debug("Ignoring message type %d from API client %s", msg.type, oaddr)
+
+
 class APIServerThread(Thread):
     """Server thread for the API. Accepts connections and creates new API client threads.
     """
-    def __init__(self, address, port, connections, queue, message_storage):
+    def __init__(self, address, port, connections, queue, message_storage, send_queue_size, send_queue_policy,
+                 pending_validations=None):
         """Constructor.
 
         :param address: address to bind to
         :param port: port to bind to
-        :param connections: dict of active connections with address as key
+        :param connections: ConnectionRegistry of the connected API clients
         :param queue: Queue to put received announce messages
         :param message_storage: cache to store messages and subscribers
+        :param send_queue_size: maximum number of notifications waiting to be sent to a client
+        :param send_queue_policy: whether to drop or block when the send queue of a client is full
+        :param pending_validations: PendingValidations if relays wait for validation, otherwise None
         """
         Thread.__init__(self)
         self.address = address
@@ -26,18 +93,21 @@ class APIServerThread(Thread):
         self.queue = queue
         self.message_storage = message_storage
         self.connections = connections
+        self.send_queue_size = send_queue_size
+        self.send_queue_policy = send_queue_policy
+        self.pending_validations = pending_validations
 
     def run(self):
-        logging.info("Started API Server at {}:{}" \
-                     .format(self.address, self.port))
+        logger.info("Started API Server at %s:%s", self.address, self.port)
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s = socket.socket(address_family(self.address), socket.SOCK_STREAM)
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind((self.address, self.port))
 
             while True:
                 s.listen(5)
-                (conn, (ip, port)) = s.accept()
+                conn, (ip, port, *_) = s.accept()
+                configure_socket(conn)
 
                 c = APIClientThread(conn,
                                     self.address,
@@ -46,20 +116,23 @@ class APIServerThread(Thread):
                                     port,
                                     self.queue,
                                     self.message_storage,
-                                    self.connections)
+                                    self.connections,
+                                    self.send_queue_size,
+                                    self.send_queue_policy,
+                                    self.pending_validations)
 
                 c.start()
             s.close()
         except:
-            logging.error("API server crashed at {}:{}" \
-                          .format(self.address, self.port))
+            logger.error("API server crashed at %s:%s", self.address, self.port)
 
 
 class APIClientThread(Thread):
     """
         Client thread to handle a client that connects to API server
     """
-    def __init__(self, connection, ip, port, oip, oport, queue, message_storage, connections):
+    def __init__(self, connection, ip, port, oip, oport, queue, message_storage, connections, send_queue_size,
+                 send_queue_policy, pending_validations=None):
         """Constructor.
 
         :param connection: connection to use
@@ -69,7 +142,10 @@ class APIClientThread(Thread):
         :param oport: port of the requesting client
         :param queue: Queue to put received announce messages
         :param message_storage: cache to store messages and subscribers
-        :param connections: dict of active connections with address as key
+        :param connections: ConnectionRegistry of the connected API clients
+        :param send_queue_size: maximum number of notifications waiting to be sent to this client
+        :param send_queue_policy: whether to drop or block when the send queue is full
+        :param pending_validations: PendingValidations if relays wait for validation, otherwise None
         """
         Thread.__init__(self)
         self.connection = connection
@@ -80,52 +156,41 @@ class APIClientThread(Thread):
         self.queue = queue
         self.message_storage = message_storage
         self.connections = connections
-        self.lock = Lock()
+        self.pending_validations = pending_validations
+        # notifications to this client are sent through the writer
+        self.writer = ConnectionWriter(connection, format_address(oip, oport), send_queue_size, send_queue_policy,
+                                       layer='api')
 
     def run(self):
-        logging.info("Connection from {}:{}" \
-                     .format(self.ip, self.port))
-        logging.info("Started API Client for {}:{}" \
-                     .format(self.oip, self.oport))
-        oaddr = self.oip + ":" + str(self.oport)
-        with self.lock:
-            self.connections[oaddr] = self.connection
+        logger.info("Connection from %s:%s", self.ip, self.port)
+        logger.info("Started API Client for %s:%s", self.oip, self.oport)
+        oaddr = format_address(self.oip, self.oport)
+        self.connections[oaddr] = self.writer
+        self.writer.start()
         try:
+            reader = FrameReader(self.connection)
             while True:
-                msg = parse_header(self.connection)
-                msg_type = msg["type"]
-
-                if msg_type == c.GOSSIP_ANNOUNCE:
-                    # if announce message, add it to shared queue
-                    self.queue.put({'message':msg["data"], 'resend': True})
-
-                elif msg_type == c.GOSSIP_NOTIFY:
-                    # if notify, add ip address of sender to subscriber list
-                    message = NotifyMessage(msg["data"])
-                    with self.lock:
-                        self.message_storage.add_subscriber(message.data_type, oaddr)
-                elif msg_type == c.GOSSIP_VALIDATION:
-                    # if validation, if false, update validity of message
-                    message = ValidationMessage(msg["data"])
-                    if not message.valid:
-                        with self.lock:
-                            self.message_storage.make_invalid(message.msg_id)
+                # stop reading from the client while the announce queue is full
+                self.queue.wait_for_capacity()
+                for msg in reader.read_messages():
+                    count_received(msg, 'api')
+                    process_api_message(msg, oaddr, self.queue, self.message_storage, self.pending_validations)
 
         except e.ClientDisconnected as error:
-            logging.debug("Client disconnected: {}".format(error))
+            logger.debug("Client disconnected: %s", error)
         except e.InvalidHeader as error:
-            logging.error("Invalid header: {}".format(error))
+            logger.error("Invalid header: %s", error)
         except e.InvalidSize as error:
-            logging.error("Invalid size: {}".format(error))
+            logger.error("Invalid size: %s", error)
         except e.InvalidMessageType as error:
-            logging.error("Invalid message type: {}".format(error))
+            logger.error("Invalid message type: %s", error)
         except Exception as error:
-            logging.error("API Client crashed: {}".format(error))
-        with self.lock:
-            self.connections.pop(oaddr)
+            logger.error("API Client crashed: %s", error)
+        self.connections.pop(oaddr, None)
+        self.message_storage.remove_subscriber(oaddr)
+        self.writer.close()
         self.connection.close()
-        logging.info("API Client completed {}:{}" \
-                     .format(self.oip, self.oport))
+        logger.info("API Client completed %s:%s", self.oip, self.oport)
 
 
 ############################ P2P ############################
@@ -133,14 +198,18 @@ class APIClientThread(Thread):
 class P2PServerThread(Thread):
     """Server thread for P2P. Accepts connections and creates new P2P client threads.
     """
-    def __init__(self, address, port, connections, incoming_queue, p2p_queue):
+    def __init__(self, address, port, connections, incoming_queue, p2p_queue, send_queue_size, send_queue_policy,
+                 reuse_port=False):
         """Constructor.
 
         :param address: address to bind to
         :param port: port to bind to
-        :param connections: dict of active connections with address as key
+        :param connections: ConnectionManager of the active p2p connections
         :param incoming_queue: queue to put messages received from other peers
         :param p2p_queue: queue to put messages for internal processing
+        :param send_queue_size: maximum number of messages waiting to be sent on a connection
+        :param send_queue_policy: whether to drop or block when the send queue of a connection is full
+        :param reuse_port: True to share the port with the servers of other worker processes
         """
         Thread.__init__(self)
         self.address = address
@@ -148,31 +217,38 @@ class P2PServerThread(Thread):
         self.connections = connections
         self.incoming_queue = incoming_queue
         self.p2p_queue = p2p_queue
+        self.send_queue_size = send_queue_size
+        self.send_queue_policy = send_queue_policy
+        self.reuse_port = reuse_port
 
     def run(self):
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s = socket.socket(address_family(self.address), socket.SOCK_STREAM)
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                # the kernel spreads the incoming connections over all sockets bound to the port
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             s.bind((self.address, self.port))
 
-            logging.info("Started P2P Server at {}:{}" \
-                         .format(self.address, self.port))
+            logger.info("Started P2P Server at %s:%s", self.address, self.port)
 
             while True:
                 s.listen(5)
-                (conn, (ip, port)) = s.accept()
+                conn, (ip, port, *_) = s.accept()
+                configure_socket(conn)
 
                 c = P2PClientThread(conn,
                                     ip,
                                     port,
                                     self.connections,
-                                    self.incoming_queue)
+                                    self.incoming_queue,
+                                    self.send_queue_size,
+                                    self.send_queue_policy)
 
                 c.start()
             s.close()
         except:
-            logging.error("P2P server crashed at {}:{}" \
-                          .format(self.address, self.port))
+            logger.error("P2P server crashed at %s:%s", self.address, self.port)
         finally:
             s.close()
 
@@ -181,14 +257,16 @@ class P2PClientThread(Thread):
     """
         Client thread to handle a client that connects to P2P server
     """
-    def __init__(self, connection, oip, oport, connections, incoming_queue):
+    def __init__(self, connection, oip, oport, connections, incoming_queue, send_queue_size, send_queue_policy):
         """Constructor.
 
         :param connection: connection to use
         :param oip: address of the requesting client
         :param oport: port of the requesting client
-        :param connections: dict of active connections with address as key
-        :param incoming_queue: queue to put messages received from other peers
+        :param connections: ConnectionManager of the active p2p connections
+        :param incoming_queue: BoundedPriorityQueue to put messages received from other peers, reading pauses while it is full
+        :param send_queue_size: maximum number of messages waiting to be sent on this connection
+        :param send_queue_policy: whether to drop or block when the send queue is full
         """
         Thread.__init__(self)
         self.connection = connection
@@ -196,37 +274,39 @@ class P2PClientThread(Thread):
         self.oport = oport
         self.connections = connections
         self.incoming_queue = incoming_queue
-        self.lock = Lock()
+        # all messages to this peer are sent through the writer
+        self.writer = ConnectionWriter(connection, format_address(oip, oport), send_queue_size, send_queue_policy)
 
     def run(self) -> None:
-        logging.info("Started P2P Client for {}:{}" \
-                     .format(self.oip, self.oport))
-        oaddr = self.oip + ":" + str(self.oport)
+        logger.info("Started P2P Client for %s:%s", self.oip, self.oport)
+        oaddr = format_address(self.oip, self.oport)
 
-        with self.lock:
-            self.connections[oaddr] = {'connection': self.connection, 'p2p_server_address': oaddr}
+        self.connections[oaddr] = {'connection': self.connection, 'p2p_server_address': oaddr, 'writer': self.writer}
+        self.writer.start()
+        self.writer.send(HELLO_MESSAGE)
 
         try:
+            reader = FrameReader(self.connection)
             while True:
-                msg = parse_header(self.connection)
-                msg_type = msg["type"]
-
-                # add p2p message received on the connection to shared queue
-                self.incoming_queue.put({'sender': oaddr, 'msg_type': msg_type, 'msg_body': msg["data"]})
+                # stop reading from the peer while the incoming queue is full, TCP then slows the peer down
+                self.incoming_queue.wait_for_capacity()
+                for msg in reader.read_messages():
+                    count_received(msg, 'p2p')
+                    # add p2p message received on the connection to shared queue
+                    self.incoming_queue.put(IncomingItem(oaddr, msg.type, msg.data))
 
         except e.ClientDisconnected as error:
-            logging.debug("Client disconnected")
+            logger.debug("Client disconnected")
         except e.InvalidHeader as error:
-            logging.error("Invalid header: {}".format(error))
+            logger.error("Invalid header: %s", error)
         except e.InvalidSize as error:
-            logging.error("Invalid size: {}".format(error))
+            logger.error("Invalid size: %s", error)
         except e.InvalidMessageType as error:
-            logging.error("Invalid message type: {}".format(error))
+            logger.error("Invalid message type: %s", error)
         except Exception as error:
-            logging.error("P2P Client crashed: {}".format(error))
-        with self.lock:
-            self.connections.pop(oaddr)
+            logger.error("P2P Client crashed: %s", error)
+        self.connections.pop(oaddr, None)
+        self.writer.close()
         self.connection.close()
-        logging.info("P2P Client completed {}:{}" \
-                     .format(self.oip, self.oport))
-        self.incoming_queue.put({'sender':oaddr, 'msg_type': c.P2P_CONNECTION_CLOSED, 'msg_body': None})
\ No newline at end of file
+        logger.info("P2P Client completed %s:%s", self.oip, self.oport)
+        self.incoming_queue.put(IncomingItem(oaddr, c.P2P_CONNECTION_CLOSED, None))
\ No newline at end of file
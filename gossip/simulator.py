@@ -0,0 +1,345 @@
+# Deterministic in-process simulation of a gossip network, used to tune degree and cache_size
+import argparse
+import heapq
+import json
+import logging
+import queue
+import random
+import struct
+import gossip.codes as c
+from gossip.address import format_address
+from gossip.api_message_handler import AnnounceMessageHandler
+from gossip.connection_manager import ConnectionManager
+from gossip.message import MAX_PULL_RESPONSE_PEERS
+from gossip.message_storage import MessageStorage
+from gossip.p2p_handler import P2PHandler
+from gossip.p2p_message_handler import P2PMessageHandler
+from gossip.peer_table import PeerTable
+from gossip.queues import IncomingItem, AnnounceItem
+from gossip.scheduler import GossipScheduler, MODE_PUSHPULL
+from gossip.seen_cache import SeenCache
+from gossip.utils import check_header
+
+
+class SimulatedWriter:
+    """
+    Stands in for the ConnectionWriter of a connection and hands messages to the simulated network
+    """
+    def __init__(self, network, from_addr, to_addr):
+        self.network = network
+        self.from_addr = from_addr
+        self.to_addr = to_addr
+
+    def send(self, message):
+        if isinstance(message, tuple):
+            # the parts end up one after the other on the stream, like with the scatter/gather write
+            message = b''.join(message)
+        self.network.transmit(self.from_addr, self.to_addr, message)
+        return True
+
+    def close(self):
+        pass
+
+
+class SimulatedNode:
+    """
+    One gossip node. Runs the real P2PHandler, P2PMessageHandler, AnnounceMessageHandler, MessageStorage and
+    PeerTable without their threads, the queues between them are drained after every received message.
+    Connections are opened through the ConnectionManager like by the transports, the handshake takes
+    a round trip.
+    """
+    def __init__(self, network, address, port, bootstrapper_address, bootstrapper_port, degree, cache_size,
+                 max_peers, seen_cache_size, gossip_interval=0, gossip_fanout=3, gossip_mode=MODE_PUSHPULL,
+                 pull_response_size=MAX_PULL_RESPONSE_PEERS):
+        """
+        :param network: network the node is part of
+        :param address: address of the node's p2p server
+        :param port: port of the node's p2p server
+        :param bootstrapper_address: address of bootstrapper server
+        :param bootstrapper_port: port of bootstrapper server
+        :param degree: maximum connections that can be handled by this peer
+        :param cache_size: maximum number of messages in the node's MessageStorage
+        :param max_peers: maximum number of peers in the node's PeerTable
+        :param seen_cache_size: maximum number of digests in the node's SeenCache
+        :param gossip_interval: seconds between the gossip rounds of the node's GossipScheduler, 0 for no rounds
+        :param gossip_fanout: peers contacted per gossip round
+        :param gossip_mode: what the node's GossipScheduler exchanges
+        :param pull_response_size: maximum number of peers in a pull response
+        """
+        self.network = network
+        self.address = format_address(address, port)
+        self.degree = degree
+        self.incoming_queue = queue.Queue()
+        self.announce_queue = queue.Queue()
+        self.p2p_queue = queue.Queue()
+        self.connections = ConnectionManager()
+        self.peer_list = PeerTable(max_peers, rng=network.rng)
+        self.seen_cache = SeenCache(seen_cache_size, clock=network.now)
+        self.message_storage = MessageStorage(cache_size, clock=network.now)
+        self.p2p_handler = P2PHandler(self.incoming_queue, self.peer_list, self.announce_queue, self.p2p_queue,
+                                      self.connections, address, port, bootstrapper_address, bootstrapper_port,
+                                      degree, self.seen_cache, rng=network.rng,
+                                      pull_response_size=pull_response_size)
+        self.announce_handler = AnnounceMessageHandler(self.announce_queue, self.message_storage, {},
+                                                       self.p2p_queue, self.seen_cache)
+        # the send queue settings only matter for the writers of real connections
+        self.p2p_message_handler = P2PMessageHandler(self.p2p_queue, self.connections, self.peer_list,
+                                                     self.incoming_queue, degree, 0, None,
+                                                     open_connection=self.open_connection)
+        self.scheduler = None
+        if gossip_interval:
+            self.scheduler = GossipScheduler(self.peer_list, self.connections, self.p2p_queue, address, port,
+                                             bootstrapper_address, bootstrapper_port, gossip_interval,
+                                             gossip_interval * 8, gossip_fanout, gossip_mode, rng=network.rng,
+                                             degree=degree)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def bootstrap(self):
+        self.p2p_handler.bootstrap()
+        self.process_queues()
+        if self.scheduler:
+            self.network.schedule(self.network.time + self.scheduler.interval, self.gossip_round)
+
+    def gossip_round(self):
+        interval = self.scheduler.run_round()
+        self.process_queues()
+        if self.network.time + interval < self.network.until:
+            self.network.schedule(self.network.time + interval, self.gossip_round)
+
+    def announce(self, message_body):
+        # same as an announce message received from a local API client
+        self.announce_queue.put(AnnounceItem(message_body, True))
+        self.process_queues()
+
+    def receive(self, sender, message):
+        # a write can contain several messages
+        msgs = []
+        while message:
+            size, msg_type = check_header(message[:4])
+            if msg_type == c.GOSSIP_P2P_SEND_CONTENT and message[6:8] == c.GOSSIP_ANNOUNCE.to_bytes(2, 'big'):
+                self.network.content_received += 1
+            msgs.append(IncomingItem(sender, msg_type, message[4:size]))
+            message = message[size:]
+        self.p2p_handler.handle_batch(msgs)
+        self.process_queues()
+
+    def process_queues(self):
+        while not self.announce_queue.empty() or not self.p2p_queue.empty():
+            while not self.announce_queue.empty():
+                r = self.announce_queue.get_nowait()
+                self.network.record_delivery(self, r.message)
+                self.announce_handler.handle_announce(r)
+            while not self.p2p_queue.empty():
+                self.p2p_message_handler.handle(self.p2p_queue.get_nowait())
+
+    def open_connection(self, to_addr, message):
+        # called by the P2PMessageHandler instead of starting a PeerSenderThread
+        self.network.schedule(self.network.time + 2 * self.network.latency, self.finish_connect, to_addr, message)
+
+    def finish_connect(self, to_addr, message):
+        # like PeerSenderThread, the first message is followed by those queued by the ConnectionManager meanwhile
+        entry = self.network.connect(self, to_addr)
+        if entry is not None:
+            entry['writer'].send(message)
+        for queued in self.connections.finish_connect(to_addr, entry):
+            entry['writer'].send(queued)
+
+
+class SimulatedNetwork:
+    """
+    Discrete event simulation of the connections between nodes.
+    All randomness comes from one seeded generator, so a run is fully reproducible.
+    """
+    def __init__(self, seed, latency, jitter, loss):
+        """
+        :param seed: seed of the random number generator
+        :param latency: minimum one way delay of a message in seconds
+        :param jitter: maximum additional random delay of a message in seconds
+        :param loss: probability that a message is lost
+        """
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.time = 0.0
+        self.until = 0.0
+        self.events = []
+        self.sequence = 0
+        self.nodes = {}
+        self.link_free = {}
+        self.messages_lost = 0
+        self.max_message_size = 0
+        self.content_received = 0
+        self.announced = {}
+        self.deliveries = {}
+
+    def now(self):
+        return self.time
+
+    def schedule(self, at, callback, *args):
+        # the sequence number keeps events at the same time in the order they were scheduled
+        heapq.heappush(self.events, (at, self.sequence, callback, args))
+        self.sequence += 1
+
+    def run(self):
+        while self.events:
+            self.time, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+
+    def connect(self, node, to_addr):
+        """
+        Opens a connection between node and the node with server address to_addr. The other end is registered
+        right away, node registers its end with finish_connect of its ConnectionManager.
+        :return: entry of the connection for node, None if the connection could not be opened
+        """
+        target = self.nodes.get(to_addr)
+        if target is None or target is node:
+            return None
+        target.connections[node.address] = {'connection': None, 'p2p_server_address': node.address,
+                                            'writer': SimulatedWriter(self, to_addr, node.address)}
+        return {'connection': None, 'p2p_server_address': to_addr,
+                'writer': SimulatedWriter(self, node.address, to_addr)}
+
+    def transmit(self, from_addr, to_addr, message):
+        self.nodes[from_addr].bytes_sent += len(message)
+        self.max_message_size = max(self.max_message_size, len(message))
+        if self.rng.random() < self.loss:
+            self.messages_lost += 1
+            return
+        # messages on one connection arrive in order like on a TCP stream
+        arrival = self.time + self.latency + self.rng.uniform(0, self.jitter)
+        arrival = max(arrival, self.link_free.get((from_addr, to_addr), 0))
+        self.link_free[(from_addr, to_addr)] = arrival
+        self.schedule(arrival, self.deliver, from_addr, to_addr, message)
+
+    def deliver(self, from_addr, to_addr, message):
+        target = self.nodes[to_addr]
+        target.bytes_received += len(message)
+        target.receive(from_addr, message)
+
+    def announce(self, node, message_body):
+        self.announced[SeenCache.digest(message_body)] = (self.time, node.address)
+        node.announce(message_body)
+
+    def record_delivery(self, node, message_body):
+        delivered = self.deliveries.setdefault(SeenCache.digest(message_body), {})
+        delivered.setdefault(node.address, self.time)
+
+
+def percentile(values, p):
+    # nearest rank percentile of sorted values
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def simulate(nodes=100, degree=30, cache_size=50, max_peers=1000, seen_cache_size=10000, announces=20, ttl=0,
+             seed=1, latency=0.02, jitter=0.01, loss=0.0, join_interval=0.05, announce_interval=0.5,
+             gossip_interval=0, gossip_fanout=3, gossip_mode=MODE_PUSHPULL,
+             pull_response_size=MAX_PULL_RESPONSE_PEERS):
+    """
+    Simulates a network in which all nodes join through the first node and then some of them announce data
+
+    :param nodes: number of nodes
+    :param degree: maximum connections of each node
+    :param cache_size: size of the MessageStorage of each node
+    :param max_peers: size of the PeerTable of each node
+    :param seen_cache_size: size of the SeenCache of each node
+    :param announces: number of announce messages sent by randomly chosen nodes
+    :param ttl: ttl of the announce messages, 0 for unlimited hops
+    :param seed: seed of the random number generator
+    :param latency: minimum one way delay of a message in seconds
+    :param jitter: maximum additional random delay of a message in seconds
+    :param loss: probability that a message is lost
+    :param join_interval: seconds between two nodes joining the network
+    :param announce_interval: seconds between two announce messages, the first one is sent after all nodes joined
+    :param gossip_interval: seconds between the gossip rounds of every node, 0 for no rounds
+    :param gossip_fanout: peers contacted per gossip round
+    :param gossip_mode: what is exchanged in the gossip rounds
+    :param pull_response_size: maximum number of peers in a pull response
+    :return: report as dict
+    """
+    network = SimulatedNetwork(seed, latency, jitter, loss)
+    start = nodes * join_interval + 1
+    # gossip rounds continue until the last announce was sent
+    network.until = start + announces * announce_interval
+    bootstrapper = ("10.0.0.0", 6001)
+    for i in range(nodes):
+        address = "10.{}.{}.{}".format(i >> 16 & 255, i >> 8 & 255, i & 255)
+        node = SimulatedNode(network, address, 6001, bootstrapper[0], bootstrapper[1], degree, cache_size,
+                             max_peers, seen_cache_size, gossip_interval, gossip_fanout, gossip_mode,
+                             pull_response_size)
+        network.nodes[node.address] = node
+        if i > 0:
+            network.schedule(i * join_interval, node.bootstrap)
+
+    node_list = list(network.nodes.values())
+    for i in range(announces):
+        origin = network.rng.choice(node_list)
+        body = struct.pack(">BBH", ttl, 0, 1) + "simulated announce {}".format(i).encode()
+        network.schedule(start + i * announce_interval, network.announce, origin, body)
+    network.run()
+
+    latencies = []
+    useful = 0
+    coverage = []
+    for digest, (announced_at, origin) in network.announced.items():
+        delivered = network.deliveries.get(digest, {})
+        coverage.append(len(delivered) / nodes)
+        for address, delivered_at in delivered.items():
+            if address != origin:
+                latencies.append(delivered_at - announced_at)
+                useful += 1
+    latencies.sort()
+    bytes_sent = [node.bytes_sent for node in node_list]
+    return {
+        'nodes': nodes,
+        'degree': degree,
+        'cache_size': cache_size,
+        'seed': seed,
+        'announces': announces,
+        'coverage': sum(coverage) / len(coverage) if coverage else None,
+        'latency': {'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+                    'p99': percentile(latencies, 99), 'max': latencies[-1] if latencies else None},
+        'redundant_ratio': 1 - useful / network.content_received if network.content_received else 0.0,
+        'bytes_per_node': {'mean': sum(bytes_sent) / nodes, 'max': max(bytes_sent)},
+        'connections_per_node': sum(len(node.connections) for node in node_list) / nodes,
+        # share of the other nodes each node knows about
+        'membership': sum(len(node.peer_list) - (node.address in node.peer_list)
+                          for node in node_list) / (nodes * (nodes - 1)),
+        'messages_lost': network.messages_lost,
+        'max_message_size': network.max_message_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulates a gossip network in a single process')
+    parser.add_argument('--nodes', type=int, default=100, help='Number of nodes')
+    parser.add_argument('--degree', type=int, default=30, help='Maximum connections of each node')
+    parser.add_argument('--cache-size', type=int, default=50, help='Size of the message cache of each node')
+    parser.add_argument('--max-peers', type=int, default=1000, help='Size of the peer table of each node')
+    parser.add_argument('--announces', type=int, default=20, help='Number of announce messages')
+    parser.add_argument('--ttl', type=int, default=0, help='ttl of the announce messages, 0 for unlimited hops')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random number generator')
+    parser.add_argument('--latency', type=float, default=0.02, help='Minimum one way delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Maximum additional random delay in seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability that a message is lost')
+    parser.add_argument('--gossip-interval', type=float, default=0, help='Seconds between gossip rounds, 0 for none')
+    parser.add_argument('--gossip-fanout', type=int, default=3, help='Peers contacted per gossip round')
+    parser.add_argument('--gossip-mode', type=str, default=MODE_PUSHPULL, help='push, pull, pushpull or shuffle')
+    parser.add_argument('--pull-response-size', type=int, default=MAX_PULL_RESPONSE_PEERS,
+                        help='Maximum number of peers in a pull response')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = simulate(nodes=args.nodes, degree=args.degree, cache_size=args.cache_size, max_peers=args.max_peers,
+                      announces=args.announces, ttl=args.ttl, seed=args.seed, latency=args.latency,
+                      jitter=args.jitter, loss=args.loss, gossip_interval=args.gossip_interval,
+                      gossip_fanout=args.gossip_fanout, gossip_mode=args.gossip_mode,
+                      pull_response_size=args.pull_response_size)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Registry of the API clients which subscribed to data types
+from gossip.locks import InstrumentedLock
+
+
+class SubscriberRegistry:
+    """
+    Index of subscribers by data type. Every client is listed at most once per data type
+    and all its subscriptions are removed together when it disconnects.
+
+    Attributes:
+        by_type: dict of dict, index: data_type, value: dict with subscriber addresses as keys in subscription order
+        by_client: dict of set, index: subscriber address, value: data types the subscriber is listed for
+    """
+    def __init__(self):
+        self.by_type = {}
+        self.by_client = {}
+        self.lock = InstrumentedLock('subscribers')
+
+    def add(self, data_type, subscriber):
+        """
+        :param data_type: data type to subscribe to
+        :param subscriber: address of the API client in format <host>:<port>
+        :return: False if the subscriber was already listed for the data type
+        """
+        with self.lock:
+            subscribers = self.by_type.setdefault(data_type, {})
+            if subscriber in subscribers:
+                return False
+            subscribers[subscriber] = None
+            self.by_client.setdefault(subscriber, set()).add(data_type)
+            return True
+
+    def remove(self, subscriber):
+        """
+        Removes all subscriptions of a client
+        :param subscriber: address of the API client in format <host>:<port>
+        """
+        with self.lock:
+            for data_type in self.by_client.pop(subscriber, ()):
+                subscribers = self.by_type[data_type]
+                del subscribers[subscriber]
+                if not subscribers:
+                    del self.by_type[data_type]
+
+    def get(self, data_type):
+        """
+        :param data_type: data type of an announce message
+        :return: list of the subscribers to data_type, safe to iterate while clients (un)subscribe
+        """
+        with self.lock:
+            return list(self.by_type.get(data_type, ()))
+
+    def __len__(self):
+        return len(self.by_client)
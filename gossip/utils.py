@@ -1,14 +1,24 @@
+from typing import Any, NamedTuple
 import gossip.exceptions as e
-import gossip.codes as c
+from gossip.dispatch import MESSAGE_TYPES
 
+# Largest message that fits into the 16 bit size field
+MAX_MESSAGE_SIZE = 65535
 
-def parse_header(conn):
-    """Reads from conn and parses header
 
-    :param conn: connection to receive from
-    :return: msg header, size and data in a dictonary
+class Frame(NamedTuple):
+    """Received message: its type, its size including the header and its body as data"""
+    type: int
+    size: int
+    data: Any
+
+
+def check_header(header):
+    """Validates a 4 byte message header
+
+    :param header: raw header bytes
+    :return: tuple of message size and message type
     """
-    header = conn.recv(4)
     if len(header) == 0:
         raise e.ClientDisconnected("")
     if len(header) < 4:
@@ -18,8 +28,107 @@ def parse_header(conn):
     msgtype = int.from_bytes(header[2:4], byteorder='big')
     if size < 4:
         raise e.InvalidSize("Size: {}".format(size))
-    if msgtype > c.MAX or msgtype < c.MIN:
+    if msgtype not in MESSAGE_TYPES:
         raise e.InvalidMessageType("Message Type: {}".format(msgtype))
+    return size, msgtype
+
+
+def recv_exactly(conn, size):
+    """Receives exactly size bytes from conn, fewer only if the connection was closed
+
+    :param conn: connection to receive from
+    :param size: number of bytes to receive
+    :return: received bytes
+    """
+    data = conn.recv(size)
+    if len(data) in (0, size):
+        return data
+    data = bytearray(data)
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+def parse_header(conn):
+    """Reads from conn and parses header
+
+    :param conn: connection to receive from
+    :return: Frame of the message
+    """
+    header = recv_exactly(conn, 4)
+    size, msgtype = check_header(header)
+
+    msg = recv_exactly(conn, size - 4)
+    if len(msg) < size - 4:
+        raise e.InvalidSize("Size: {}, received: {}".format(size, len(msg) + 4))
+    return Frame(msgtype, size, msg)
+
+
+class FrameReader:
+    """
+    Per connection reader which receives large chunks into a reusable buffer
+    and splits them into messages. Short reads are kept in the buffer until the
+    rest of the message arrives.
+    """
+    def __init__(self, conn=None, chunk_size=MAX_MESSAGE_SIZE + 1):
+        """
+        :param conn: connection to receive from, can be omitted if data is passed in with feed
+        :param chunk_size: maximum number of bytes received at once
+        """
+        self.conn = conn
+        self.chunk_size = chunk_size
+        # room for one chunk plus the unfinished rest of a previous message
+        self.buffer = bytearray(chunk_size + MAX_MESSAGE_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def read_messages(self):
+        """
+        Receives one chunk from the connection
+        :return: list of Frames of all complete messages in the buffer, the data of each is a read only memoryview
+        """
+        self.make_room()
+        received = self.conn.recv_into(self.view[self.end:self.end + self.chunk_size])
+        if received == 0:
+            raise e.ClientDisconnected("")
+        self.end += received
+        return self.split_messages()
+
+    def feed(self, data):
+        """
+        Adds data which was received elsewhere, e.g. by an asyncio stream
+        :param data: received bytes, at most chunk_size
+        :return: list of all complete messages in the buffer, same as read_messages
+        """
+        if not data:
+            raise e.ClientDisconnected("")
+        self.make_room()
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        return self.split_messages()
+
+    def make_room(self):
+        # move the unfinished message to the front if a full chunk doesn't fit behind it
+        if len(self.buffer) - self.end < self.chunk_size:
+            pending = self.end - self.start
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
 
-    msg=conn.recv(size - 4)
-    return {"type": msgtype, "size": size, "data": msg}
\ No newline at end of file
+    def split_messages(self):
+        messages = []
+        while self.end - self.start >= 4:
+            size, msgtype = check_header(self.view[self.start:self.start + 4])
+            if self.end - self.start < size:
+                break
+            # the message is copied out of the reused buffer once, its body is handed out as a view
+            frame = bytes(self.view[self.start:self.start + size])
+            messages.append(Frame(msgtype, size, memoryview(frame)[4:]))
+            self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+        return messages
@@ -0,0 +1,134 @@
+# Holds received announces back until the local API clients validated them
+from collections import OrderedDict
+from threading import Thread
+import time
+import gossip.codes as c
+from gossip.metrics import REGISTRY
+from gossip.locks import InstrumentedLock
+from gossip.queues import P2PItem
+
+# When announces are relayed to other peers
+RELAY_IMMEDIATE = 'immediate'
+RELAY_VALIDATED = 'validated'
+
+# What to do with an announce that was not validated in time
+TIMEOUT_DROP = 'drop'
+TIMEOUT_FORWARD = 'forward'
+
+
+class PendingValidations(Thread):
+    """
+    Bounded table of received announces waiting for a validation message from a local API client.
+    Valid announces are relayed, invalid ones are dropped. Announces that are not validated within
+    timeout, that have no subscriber to validate them or that are pushed out of the full table
+    are dropped or relayed according to timeout_policy. The thread applies the timeouts.
+
+    Attributes:
+        pending: OrderedDict, index: message id, value: (deadline, data_type, relay), oldest first
+            where relay is the (relay_message, sender) pair to be put into the p2p queue
+    """
+    def __init__(self, p2p_queue, capacity, timeout, timeout_policy=TIMEOUT_DROP, clock=time.monotonic,
+                 metrics=REGISTRY):
+        """
+        :param p2p_queue: queue to put the announces to be relayed
+        :param capacity: maximum number of announces waiting for validation
+        :param timeout: seconds to wait for a validation
+        :param timeout_policy: TIMEOUT_DROP or TIMEOUT_FORWARD
+        :param clock: function returning the current time in seconds
+        :param metrics: registry to record the per data type statistics to
+        """
+        Thread.__init__(self, daemon=True)
+        self.p2p_queue = p2p_queue
+        self.capacity = capacity
+        self.timeout = timeout
+        self.timeout_policy = timeout_policy
+        self.clock = clock
+        self.metrics = metrics
+        self.pending = OrderedDict()
+        self.lock = InstrumentedLock('pending_validations')
+
+    def add(self, msg_id, data_type, relay, has_subscribers=True):
+        """
+        :param msg_id: id under which the announce was stored
+        :param data_type: data type of the announce
+        :param relay: (relay_message, sender) pair as put into the p2p queue
+        :param has_subscribers: False if no API client can validate the announce
+        """
+        if not has_subscribers:
+            self.finish(data_type, relay, 'unsubscribed')
+            return
+        with self.lock:
+            evicted = []
+            # a reused message id replaces the old announce
+            if msg_id in self.pending:
+                evicted.append(self.pending.pop(msg_id))
+            while len(self.pending) >= self.capacity:
+                evicted.append(self.pending.popitem(last=False)[1])
+            self.pending[msg_id] = (self.clock() + self.timeout, data_type, relay)
+        for _, old_data_type, old_relay in evicted:
+            self.finish(old_data_type, old_relay, 'evicted')
+
+    def validate(self, msg_id, valid):
+        """
+        Relays or drops an announce according to the result of its validation
+        :param msg_id: id of the validated message
+        :param valid: result of the validation
+        :return: False if no announce with that id is waiting
+        """
+        with self.lock:
+            entry = self.pending.pop(msg_id, None)
+        if entry is None:
+            return False
+        _, data_type, relay = entry
+        self.finish(data_type, relay, 'valid' if valid else 'invalid')
+        return True
+
+    def expire(self):
+        """
+        Applies the timeout policy to all announces waiting longer than timeout
+        """
+        now = self.clock()
+        expired = []
+        with self.lock:
+            while self.pending:
+                msg_id, (deadline, data_type, relay) = next(iter(self.pending.items()))
+                if deadline > now:
+                    break
+                del self.pending[msg_id]
+                expired.append((data_type, relay))
+        for data_type, relay in expired:
+            self.finish(data_type, relay, 'timeout')
+
+    def finish(self, data_type, relay, outcome):
+        if outcome == 'valid':
+            forward = True
+        elif outcome == 'invalid':
+            forward = False
+        else:
+            forward = self.timeout_policy == TIMEOUT_FORWARD
+        self.metrics.inc('gossip_validations_total', data_type=data_type, outcome=outcome)
+        count_relay(data_type, forward, self.metrics)
+        if forward:
+            self.p2p_queue.put(P2PItem(c.P2P_ACTION_RELAY, messages=[relay]))
+
+    def run(self):
+        interval = max(0.01, min(1.0, self.timeout / 10))
+        while True:
+            time.sleep(interval)
+            self.expire()
+
+    def __len__(self):
+        return len(self.pending)
+
+
+def count_relay(data_type, forwarded, metrics=REGISTRY):
+    """
+    Records whether a received announce was relayed to other peers or not
+    :param data_type: data type of the announce
+    :param forwarded: True if the announce was relayed
+    :param metrics: registry to record to
+    """
+    if forwarded:
+        metrics.inc('gossip_announces_relayed_total', data_type=data_type)
+    else:
+        metrics.inc('gossip_announces_not_relayed_total', data_type=data_type)
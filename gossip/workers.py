@@ -0,0 +1,215 @@
+# Multi-process mode: worker processes share the P2P port, the parent process serves the API
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from threading import Thread
+import gossip.codes as c
+from gossip.log import setup_logging
+from gossip.queues import BoundedPriorityQueue, AnnounceItem, incoming_priority, p2p_priority
+from gossip.connection_manager import ConnectionManager
+from gossip.peer_table import SharedPeerTable
+from gossip.server import P2PServerThread
+from gossip.p2p_message_handler import P2PMessageHandler
+from gossip.p2p_handler import P2PHandler
+from gossip.scheduler import GossipScheduler
+
+logger = logging.getLogger(__name__)
+
+# The shared seen cache and the queues between the processes are inherited, so workers are always forked
+FORK = multiprocessing.get_context('fork')
+
+
+def to_bytes(message):
+    """
+    :param message: packed message, either bytes like or a tuple of bytes like parts
+    :return: the message as bytes
+    """
+    if isinstance(message, tuple):
+        return b''.join(message)
+    return bytes(message)
+
+
+def portable(item):
+    """
+    Copies a queue item so it can be passed to another process, memoryviews can not be pickled
+    :param item: AnnounceItem or P2PItem
+    :return: the item with all messages as bytes
+    """
+    if isinstance(item, AnnounceItem):
+        relay = item.relay
+        if relay is not None:
+            relay = (to_bytes(relay[0]), relay[1])
+        return item._replace(message=to_bytes(item.message), relay=relay)
+    if item.action == c.P2P_ACTION_RELAY:
+        return item._replace(messages=[(to_bytes(message), sender) for message, sender in item.messages])
+    if item.action == c.P2P_ACTION_SEND_ALL:
+        return item._replace(messages=[to_bytes(message) for message in item.messages])
+    return item._replace(message=to_bytes(item.message))
+
+
+class QueueForwarder(Thread):
+    """
+    Thread moving the items of a queue into other queues, e.g. from a process queue into a local one
+    """
+    def __init__(self, source, targets):
+        """
+        :param source: queue to take the items from
+        :param targets: queues to put every item into
+        """
+        Thread.__init__(self, daemon=True)
+        self.source = source
+        self.targets = targets
+
+    def run(self):
+        while True:
+            item = portable(self.source.get())
+            for target in self.targets:
+                target.put(item)
+            if isinstance(self.source, queue.Queue):
+                self.source.task_done()
+
+
+class SiblingRelayQueue:
+    """
+    p2p queue of a worker which also passes relays to the other workers,
+    so received announces reach the connections of all workers
+    """
+    def __init__(self, p2p_queue, siblings):
+        """
+        :param p2p_queue: p2p queue of the worker
+        :param siblings: process queues of the other workers
+        """
+        self.p2p_queue = p2p_queue
+        self.siblings = siblings
+
+    def put(self, item):
+        self.p2p_queue.put(item)
+        if item.action == c.P2P_ACTION_RELAY:
+            item = portable(item)
+            for sibling in self.siblings:
+                sibling.put(item)
+
+
+class ProcessQueue:
+    """
+    Announce queue of a worker, the announces are handled by the parent process
+    """
+    def __init__(self, process_queue):
+        self.process_queue = process_queue
+
+    def put(self, item):
+        self.process_queue.put(portable(item))
+
+
+class WorkerProcess(FORK.Process):
+    """
+    Process running a P2P server on the shared port together with its own P2P handlers and connections.
+    Announces received by the worker are handled by the parent process, announces to be sent and relays
+    of the other workers arrive in its inbox.
+
+    The first worker is the membership worker: only it contacts the bootstrapper, runs the gossip rounds
+    and opens connections to other peers, up to degree. The other workers serve the connections the kernel
+    hands them. All workers keep the peers they learn in the shared peer table.
+    """
+    def __init__(self, index, config, seen_cache, peer_list, to_coordinator, inboxes):
+        """
+        :param index: number of the worker, 0 for the membership worker
+        :param config: parsed configuration of the node
+        :param seen_cache: SharedSeenCache of all workers
+        :param peer_list: SharedPeerTable of all workers
+        :param to_coordinator: process queue for the received announces
+        :param inboxes: process queues of all workers, index: worker number
+        """
+        FORK.Process.__init__(self, name='gossip-worker-{}'.format(index), daemon=True)
+        self.index = index
+        self.config = config
+        self.seen_cache = seen_cache
+        self.peer_list = peer_list
+        self.to_coordinator = to_coordinator
+        self.inbox = inboxes[index]
+        self.siblings = [inbox for i, inbox in enumerate(inboxes) if i != index]
+        self.parent = os.getpid()
+
+    def run(self):
+        config = self.config
+        # the log thread of the parent does not exist in the forked process
+        setup_logging(config['log_level'], config['log_levels'], config['log_message_rate'], config['log_queue'])
+        logger.info("Started worker %d", self.index)
+        membership = self.index == 0
+        # only the membership worker opens connections, the others never get to call begin_connect for new peers
+        degree = config['degree'] if membership else 0
+        batch_wait = config['batch_wait_ms'] / 1000
+        p2p_queue = BoundedPriorityQueue('p2p_queue', config['p2p_queue_size'], p2p_priority)
+        incoming_queue = BoundedPriorityQueue('incoming_queue', config['incoming_queue_size'], incoming_priority)
+        relay_queue = SiblingRelayQueue(p2p_queue, self.siblings)
+        connections = ConnectionManager(config['max_connecting'], config['frame_batch_size'],
+                                        config['frame_batch_wait_ms'] / 1000)
+        peer_list = self.peer_list
+
+        threads = [
+            QueueForwarder(self.inbox, [p2p_queue]),
+            P2PMessageHandler(p2p_queue, connections, peer_list, incoming_queue, degree,
+                              config['send_queue_size'], config['send_queue_policy']),
+            P2PServerThread(config['p2p_address']['address'], config['p2p_address']['port'], connections,
+                            incoming_queue, p2p_queue, config['send_queue_size'], config['send_queue_policy'],
+                            reuse_port=True),
+            P2PHandler(incoming_queue, peer_list, ProcessQueue(self.to_coordinator), relay_queue, connections,
+                       config['p2p_address']['address'], config['p2p_address']['port'],
+                       config['bootstrapper']['address'], config['bootstrapper']['port'],
+                       degree, self.seen_cache, batch_size=config['batch_size'], batch_wait=batch_wait,
+                       relay_policy=config['relay_policy'], pull_response_size=config['pull_response_size'],
+                       join=membership)]
+        if membership and config['gossip_interval']:
+            threads.append(GossipScheduler(peer_list, connections, relay_queue,
+                                           config['p2p_address']['address'], config['p2p_address']['port'],
+                                           config['bootstrapper']['address'], config['bootstrapper']['port'],
+                                           config['gossip_interval'], config['gossip_max_interval'],
+                                           config['gossip_fanout'], config['gossip_mode'], config['shuffle_length'],
+                                           degree=degree))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # exit together with the parent process, also when it was killed
+        while os.getppid() == self.parent:
+            time.sleep(1)
+        logger.info("Parent process exited, stopping worker %d", self.index)
+
+
+class WorkerPool:
+    """
+    Worker processes sharing the P2P port of the node through SO_REUSEPORT. The kernel spreads the incoming
+    connections over the workers and each worker owns the connections it accepted or opened, so parsing
+    and relaying run on as many cores as there are workers. All workers share one seen cache, so an
+    announce is still relayed only once by the node, and one peer table, so the node has one view of
+    the membership which only the first worker acts on.
+
+    The parent process coordinates the workers: it serves the API, stores received announces and notifies
+    the API clients. Announces received by a worker are put into to_coordinator, announces to be sent and
+    validated relays are put into the inbox of every worker.
+    """
+    def __init__(self, config, seen_cache):
+        """
+        :param config: parsed configuration of the node, workers is the number of processes
+        :param seen_cache: SharedSeenCache of all workers
+        """
+        self.to_coordinator = FORK.Queue()
+        self.inboxes = [FORK.Queue() for _ in range(config['workers'])]
+        self.peer_list = SharedPeerTable(config['max_peers'])
+        self.processes = [WorkerProcess(index, config, seen_cache, self.peer_list, self.to_coordinator, self.inboxes)
+                          for index in range(config['workers'])]
+
+    def start(self):
+        # must happen before the parent starts its handler threads, only the forking thread exists in the workers
+        for process in self.processes:
+            process.start()
+
+    def coordinator_threads(self, announce_queue, p2p_queue):
+        """
+        :param announce_queue: announce queue of the parent process
+        :param p2p_queue: p2p queue of the parent process
+        :return: threads passing the announces of the workers to announce_queue and p2p_queue to all workers
+        """
+        return [QueueForwarder(self.to_coordinator, [announce_queue]), QueueForwarder(p2p_queue, self.inboxes)]
@@ -1,13 +1,22 @@
 import sys, logging, os
+from gossip.log import setup_logging
 from gossip.config_parser import parse_config
 from gossip.server import APIServerThread, P2PServerThread
-import queue
+from gossip.async_server import AsyncTransportThread
+from gossip.queues import BoundedPriorityQueue, incoming_priority, p2p_priority
+from gossip.metrics import REGISTRY, MetricsServerThread
 from gossip.api_message_handler import AnnounceMessageHandler
 from gossip.message_storage import MessageStorage
+from gossip.seen_cache import SeenCache, SharedSeenCache
+from gossip.peer_table import PeerTable
+from gossip.connection_manager import ConnectionManager, ConnectionRegistry
 from gossip.p2p_message_handler import P2PMessageHandler
 from gossip.p2p_handler import P2PHandler
+from gossip.validation import PendingValidations, RELAY_VALIDATED
+from gossip.scheduler import GossipScheduler
+from gossip.workers import WorkerPool
 
-logging.basicConfig(level=logging.DEBUG)
+setup_logging()
 
 
 def main():
@@ -33,57 +42,154 @@ def main():
 
     # parse configuration file
     config=parse_config(config_path)
+    setup_logging(config['log_level'], config['log_levels'], config['log_message_rate'], config['log_queue'])
+
+    workers = None
+    if config['workers'] > 1:
+        if config['transport'] != 'threaded':
+            logging.error('Multiple workers are only supported with the threaded transport')
+            logging.error('Exiting Gossip')
+            return
+        # the P2P side runs in worker processes, which are forked before any other thread is started
+        seen_cache = SharedSeenCache(config['seen_cache_size'], config['seen_cache_ttl'])
+        workers = WorkerPool(config, seen_cache)
+        workers.start()
+    else:
+        seen_cache = SeenCache(config['seen_cache_size'], config['seen_cache_ttl'])
 
     # initializing objects
-    message_storage = MessageStorage(config['cache_size'])
-    announce_queue = queue.Queue()
-    p2p_queue = queue.Queue()
-    incoming_queue = queue.Queue()
-
-    api_connections = {}
-    p2p_connections = {}
-
-    peer_list = []
-
-    announce_message_handler = AnnounceMessageHandler(announce_queue, message_storage, api_connections, p2p_queue)
+    message_storage = MessageStorage(config['cache_size'], config['cache_max_age'])
+    announce_queue = BoundedPriorityQueue('announce_queue', config['announce_queue_size'])
+    p2p_queue = BoundedPriorityQueue('p2p_queue', config['p2p_queue_size'], p2p_priority)
+    incoming_queue = BoundedPriorityQueue('incoming_queue', config['incoming_queue_size'], incoming_priority)
+
+    api_connections = ConnectionRegistry('api_connections')
+    p2p_connections = ConnectionManager(config['max_connecting'], config['frame_batch_size'],
+                                        config['frame_batch_wait_ms'] / 1000)
+
+    # in multi-process mode the workers keep the peers in a shared table
+    peer_list = workers.peer_list if workers is not None else PeerTable(config['max_peers'])
+
+    # values which are read when the metrics are scraped
+    REGISTRY.gauge('gossip_p2p_connections', lambda: len(p2p_connections))
+    REGISTRY.gauge('gossip_p2p_connecting', lambda: len(p2p_connections.connecting))
+    REGISTRY.gauge('gossip_api_connections', lambda: len(api_connections))
+    REGISTRY.gauge('gossip_degree', lambda: config['degree'])
+    REGISTRY.gauge('gossip_known_peers', lambda: len(peer_list))
+    REGISTRY.gauge('gossip_storage_messages', lambda: len(message_storage))
+    REGISTRY.gauge('gossip_storage_capacity', lambda: message_storage.cache_size)
+    REGISTRY.gauge('gossip_storage_evictions_total', lambda: message_storage.evictions)
+    REGISTRY.gauge('gossip_storage_expirations_total', lambda: message_storage.expirations)
+    REGISTRY.gauge('gossip_subscribers', lambda: len(message_storage.subscribers))
+    REGISTRY.gauge('gossip_seen_cache_hits_total', lambda: seen_cache.hits)
+    REGISTRY.gauge('gossip_seen_cache_misses_total', lambda: seen_cache.misses)
+    for lock in (p2p_connections.lock, api_connections.lock, message_storage.lock, message_storage.subscribers.lock,
+                 peer_list.lock):
+        lock.register_metrics(REGISTRY)
+    if workers is None:
+        seen_cache.lock.register_metrics(REGISTRY)
+    if config['metrics_address']:
+        MetricsServerThread(config['metrics_address']['address'], config['metrics_address']['port']).start()
+
+    # received announces are only relayed after a local API client validated them
+    pending_validations = None
+    if config['relay_policy'] == RELAY_VALIDATED:
+        pending_validations = PendingValidations(p2p_queue, config['pending_validations_size'],
+                                                 config['validation_timeout'], config['validation_timeout_policy'])
+        REGISTRY.gauge('gossip_pending_validations', lambda: len(pending_validations))
+        pending_validations.lock.register_metrics(REGISTRY)
+        pending_validations.start()
+
+    batch_wait = config['batch_wait_ms'] / 1000
+    announce_message_handler = AnnounceMessageHandler(announce_queue, message_storage, api_connections, p2p_queue,
+                                                      seen_cache, config['batch_size'], batch_wait,
+                                                      pending_validations)
     announce_message_handler.start()
 
-    logging.debug('Starting API server thread')
-
-    apiserverthread = APIServerThread(
+    if config['transport'] == 'asyncio':
+        logging.debug('Starting asyncio transport thread')
+        server_threads = [AsyncTransportThread(
                                    config['api_address']['address'],
                                    config['api_address']['port'],
+                                   config['p2p_address']['address'],
+                                   config['p2p_address']['port'],
                                    api_connections,
+                                   p2p_connections,
                                    announce_queue,
-                                   message_storage)
-
-    apiserverthread.start()
+                                   incoming_queue,
+                                   p2p_queue,
+                                   message_storage,
+                                   config['degree'],
+                                   pending_validations,
+                                   config['send_queue_size'],
+                                   config['send_queue_policy'])]
+    elif workers is not None:
+        logging.debug('Starting API server and worker coordination threads')
+        server_threads = [APIServerThread(
+                                   config['api_address']['address'],
+                                   config['api_address']['port'],
+                                   api_connections,
+                                   announce_queue,
+                                   message_storage,
+                                   config['send_queue_size'],
+                                   config['send_queue_policy'],
+                                   pending_validations)] + workers.coordinator_threads(announce_queue, p2p_queue)
+    else:
+        logging.debug('Starting API server thread')
+        apiserverthread = APIServerThread(
+                                   config['api_address']['address'],
+                                   config['api_address']['port'],
+                                   api_connections,
+                                   announce_queue,
+                                   message_storage,
+                                   config['send_queue_size'],
+                                   config['send_queue_policy'],
+                                   pending_validations)
 
-    p2p_message_handler = P2PMessageHandler(p2p_queue, p2p_connections, peer_list, incoming_queue, config['degree'])
-    p2p_message_handler.start()
+        p2p_message_handler = P2PMessageHandler(p2p_queue, p2p_connections, peer_list, incoming_queue, config['degree'],
+                                                config['send_queue_size'], config['send_queue_policy'])
+        p2p_message_handler.start()
 
-    logging.debug('Starting P2P server thread')
-    p2pserverthread = P2PServerThread(
+        logging.debug('Starting P2P server thread')
+        p2pserverthread = P2PServerThread(
                                    config['p2p_address']['address'],
                                    config['p2p_address']['port'],
                                    p2p_connections,
                                    incoming_queue,
-                                   p2p_queue)
-    p2pserverthread.start()
-    p2p_handler = P2PHandler(incoming_queue, peer_list, announce_queue, p2p_queue, p2p_connections,
-                             config['p2p_address']['address'], config['p2p_address']['port'],
-                             config['bootstrapper']['address'], config['bootstrapper']['port'],
-                             config['degree'])
-    p2p_handler.start()
+                                   p2p_queue,
+                                   config['send_queue_size'],
+                                   config['send_queue_policy'])
+        server_threads = [apiserverthread, p2pserverthread]
+
+    for server_thread in server_threads:
+        server_thread.start()
+
+    # peers, gossip rounds and the P2P handlers are run by the workers in multi-process mode
+    if workers is None:
+        p2p_handler = P2PHandler(incoming_queue, peer_list, announce_queue, p2p_queue, p2p_connections,
+                                 config['p2p_address']['address'], config['p2p_address']['port'],
+                                 config['bootstrapper']['address'], config['bootstrapper']['port'],
+                                 config['degree'], seen_cache, batch_size=config['batch_size'], batch_wait=batch_wait,
+                                 relay_policy=config['relay_policy'], pull_response_size=config['pull_response_size'])
+        p2p_handler.start()
+
+    if workers is None and config['gossip_interval']:
+        gossip_scheduler = GossipScheduler(peer_list, p2p_connections, p2p_queue,
+                                           config['p2p_address']['address'], config['p2p_address']['port'],
+                                           config['bootstrapper']['address'], config['bootstrapper']['port'],
+                                           config['gossip_interval'], config['gossip_max_interval'],
+                                           config['gossip_fanout'], config['gossip_mode'], config['shuffle_length'],
+                                           degree=config['degree'])
+        REGISTRY.gauge('gossip_rounds_total', lambda: gossip_scheduler.rounds)
+        REGISTRY.gauge('gossip_round_interval_seconds', lambda: gossip_scheduler.interval)
+        gossip_scheduler.start()
 
     # join the threads
     try:
-        logging.debug('Joining API server thread')
-        apiserverthread.join()
+        logging.debug('Joining server threads')
+        for server_thread in server_threads:
+            server_thread.join()
         announce_queue.join()
-
-        logging.debug('Joining P2P server thread')
-        p2pserverthread.join()
         p2p_queue.join()
         incoming_queue.join()
     except KeyboardInterrupt as e:
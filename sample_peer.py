@@ -6,6 +6,7 @@ import sys
 
 from gossip.codes import *
 from gossip.message import *
+from gossip.peer_table import PeerTable
 from gossip.utils import parse_header
 
 
@@ -50,13 +51,13 @@ def run_server(address, port, peer_list):
 
             t = parse_header(conn)
             print("Received message :",t)
-            if t['type'] == GOSSIP_P2P_PUSH:
+            if t.type == GOSSIP_P2P_PUSH:
                 print("Received a PUSH message")
-                m = GossipPushMessage(peer_list=peer_list, message_body=t['data'])
+                m = GossipPushMessage(peer_list=peer_list, message_body=t.data)
                 p = m.add_received_peer()
                 print('Pushed peer address:', p)
 
-            if t['type'] == GOSSIP_P2P_PULL:
+            if t.type == GOSSIP_P2P_PULL:
                 print("Received a PULL message")
                 response_message = GossipPullResponseMessage(peer_list).prepare_message()
                 conn.sendall(response_message)
@@ -65,7 +66,7 @@ def run_server(address, port, peer_list):
             # Block to receive an announce message after push or pull
             t = parse_header(conn)
             print("Received message : ",t)
-            a = extract_announce(t['data'])
+            a = extract_announce(t.data)
             if a['type'] == GOSSIP_ANNOUNCE:
                 am = AnnounceMessage(a['data'])
                 print("Announced data: ", am.get_all_data())
@@ -102,7 +103,7 @@ def pull_from_peer(address, port, dest_addr, dest_port, peer_list):
         try:
             t = parse_header(s)
             print("Received message : ",t)
-            m = GossipPullResponseMessage(peer_list=peer_list, message_body=t['data'])
+            m = GossipPullResponseMessage(peer_list=peer_list, message_body=t.data)
             p = m.update_peer_list()
             print("Received peer list", p)
         except KeyboardInterrupt:
@@ -125,10 +126,7 @@ def main():
 
     address = args.address
     port = int(args.port)
-    if not args.peers:
-        peer_list = []
-    else:
-        peer_list = args.peers
+    peer_list = PeerTable(1000, args.peers or [])
     action = args.action
     dest_address = args.dest_address
     if args.dest_port:
@@ -0,0 +1,52 @@
+# Test class to test the encoding of peer addresses
+import struct
+import unittest
+from gossip.address import ADDRESS_IPV4, ADDRESS_IPV6, ADDRESS_HOSTNAME, split_address, format_address, \
+    pack_address, unpack_address, encode_address, decode_address, encode_peer_list, decode_peer_list
+
+
+class TestAddress(unittest.TestCase):
+    def test_split_and_format(self):
+        self.assertEqual(split_address("10.0.0.1:6001"), ("10.0.0.1", 6001))
+        self.assertEqual(split_address("[::1]:6001"), ("::1", 6001))
+        self.assertEqual(split_address("node.example:6001"), ("node.example", 6001))
+        self.assertEqual(format_address("::1", 6001), "[::1]:6001")
+        self.assertEqual(format_address("::ffff:10.0.0.1", 6001), "10.0.0.1:6001")
+        with self.assertRaises(ValueError):
+            split_address("10.0.0.1")
+
+    def test_pack_families(self):
+        self.assertEqual(pack_address("10.0.0.1:6001")[:2], bytes((ADDRESS_IPV4, 4)))
+        self.assertEqual(pack_address("[2001:db8::1]:6001")[:2], bytes((ADDRESS_IPV6, 16)))
+        self.assertEqual(pack_address("node.example:6001")[:2], bytes((ADDRESS_HOSTNAME, 12)))
+        for address in ("10.0.0.1:6001", "[2001:db8::1]:6001", "node.example:6001"):
+            self.assertEqual(unpack_address(pack_address(address)), address)
+        # ipv6 addresses are kept in their canonical form
+        self.assertEqual(pack_address("[2001:db8:0::1]:1"), pack_address("[2001:db8::1]:1"))
+
+    def test_push_address(self):
+        self.assertEqual(encode_address(pack_address("10.0.0.1:6001")), struct.pack(">BBBBH", 10, 0, 0, 1, 6001))
+        for address in ("10.0.0.1:6001", "[::1]:6001", "ab:6001", "node.example:6001"):
+            body = encode_address(pack_address(address))
+            self.assertEqual(unpack_address(decode_address(memoryview(body))), address)
+        with self.assertRaises(ValueError):
+            decode_address(bytes((9, 1, 0, 0, 0)))
+
+    def test_peer_list(self):
+        peers = ["10.0.0.1:1", "[::1]:2", "10.0.0.2:3", "node.example:4"]
+        body = encode_peer_list([pack_address(peer) for peer in peers])
+        self.assertEqual(sorted(unpack_address(record) for record in decode_peer_list(body)), sorted(peers))
+        # the ipv4 peers come first in the format of the first protocol version
+        self.assertEqual(struct.unpack(">H", body[:2])[0], 2)
+        self.assertEqual(body[2:14], struct.pack(">BBBBHBBBBH", 10, 0, 0, 1, 1, 10, 0, 0, 2, 3))
+        # records of unknown families are skipped
+        self.assertEqual(len(decode_peer_list(body + bytes((9, 2, 1, 2, 0, 1)))), 4)
+
+    def test_truncated_peer_list(self):
+        for body in (b"", b"\x00", struct.pack(">HBBBBH", 2, 10, 0, 0, 1, 1)):
+            with self.assertRaises(ValueError):
+                decode_peer_list(body)
+
+    def test_peer_list_size_limit(self):
+        records = [pack_address("10.0.0.{}:1".format(i)) for i in range(10)]
+        self.assertEqual(len(encode_peer_list(records, max_size=2 + 6 * 4)), 2 + 6 * 4)
@@ -0,0 +1,57 @@
+# Test class to test functionality of class AnnounceMessageHandler
+import queue
+import struct
+import unittest
+import gossip.codes as c
+from gossip.api_message_handler import AnnounceMessageHandler
+from gossip.message_storage import MessageStorage
+from gossip.queues import AnnounceItem, P2PItem
+from gossip.seen_cache import SeenCache
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+        return True
+
+
+class TestAnnounceMessageHandler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.message_storage = MessageStorage(cache_size=10)
+        self.connections = {"127.0.0.1:5000": FakeConnection(), "127.0.0.1:5001": FakeConnection()}
+        self.p2p_queue = queue.Queue()
+        self.handler = AnnounceMessageHandler(queue.Queue(), self.message_storage, self.connections, self.p2p_queue,
+                                              SeenCache(100))
+
+    def test_notifications(self):
+        for address in ("127.0.0.1:5000", "127.0.0.1:5001", "127.0.0.1:5002"):
+            self.message_storage.add_subscriber(1001, address)
+        msg_id = self.handler.handle_announce(AnnounceItem(struct.pack(">BBH", 5, 0, 1001) + b"data", False))
+        expected = struct.pack(">HHHH", 12, c.GOSSIP_NOTIFICATION, msg_id, 1001) + b"data"
+        for connection in self.connections.values():
+            self.assertEqual(connection.sent, [expected])
+        # the notification is encoded once and shared by all subscribers
+        self.assertIs(self.connections["127.0.0.1:5000"].sent[0], self.connections["127.0.0.1:5001"].sent[0])
+
+    def test_repeated_announce_is_sent_once(self):
+        body = struct.pack(">BBH", 5, 0, 1001) + b"data"
+        self.handler.handle_announce(AnnounceItem(body, True))
+        self.handler.handle_announce(AnnounceItem(body, True))
+        self.assertEqual(self.p2p_queue.get_nowait(), P2PItem(c.P2P_ACTION_SEND_ALL, messages=[body]))
+        self.assertTrue(self.p2p_queue.empty())
+
+    def test_malformed_announce_is_dropped(self):
+        body = struct.pack(">BBH", 5, 0, 1001) + b"data"
+        msg_ids = self.handler.handle_batch([AnnounceItem(memoryview(b"\x05\x00"), True), AnnounceItem(body, True)])
+        self.assertEqual(len(msg_ids), 1)
+        self.assertEqual(self.p2p_queue.get_nowait(), P2PItem(c.P2P_ACTION_SEND_ALL, messages=[body]))
+        self.assertIsNone(self.handler.handle_announce(AnnounceItem(memoryview(b""), True)))
+
+    def test_batch_coalesces_duplicates(self):
+        body = struct.pack(">BBH", 5, 0, 1001) + b"data"
+        msg_ids = self.handler.handle_batch([AnnounceItem(body, False), AnnounceItem(body, True)])
+        self.assertEqual(len(msg_ids), 1)
+        self.assertEqual(self.p2p_queue.get_nowait(), P2PItem(c.P2P_ACTION_SEND_ALL, messages=[body]))
@@ -0,0 +1,184 @@
+# Test class to test functionality of the asyncio transport
+import asyncio
+import random
+import socket
+import struct
+import threading
+import time
+import unittest
+import gossip.codes as c
+from gossip.api_message_handler import AnnounceMessageHandler
+from gossip.async_server import AsyncConnection, AsyncTransportThread, wait_for_capacity
+from gossip.connection_manager import ConnectionManager, ConnectionRegistry
+from gossip.connection_writer import POLICY_BLOCK, POLICY_DROP
+from gossip.message import GossipSendContentMessage, GossipPushMessage, ContentView, AnnounceView
+from gossip.message_storage import MessageStorage
+from gossip.p2p_handler import P2PHandler
+from gossip.peer_table import PeerTable
+from gossip.queues import BoundedPriorityQueue, incoming_priority, p2p_priority
+from gossip.seen_cache import SeenCache
+from gossip.utils import FrameReader, parse_header
+
+# larger than what the socket buffers of a peer which reads nothing take
+LARGE = 16 * 1024 * 1024
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not reached within {} seconds".format(timeout))
+        time.sleep(0.01)
+
+
+class TestAsyncTransport(unittest.TestCase):
+    def setUp(self) -> None:
+        self.message_storage = MessageStorage(50)
+        self.announce_queue = BoundedPriorityQueue('announce_queue', 100)
+        self.incoming_queue = BoundedPriorityQueue('incoming_queue', 100, incoming_priority)
+        self.p2p_queue = BoundedPriorityQueue('p2p_queue', 100, p2p_priority)
+        self.api_connections = ConnectionRegistry('api_connections')
+        self.p2p_connections = ConnectionManager()
+        self.transport = AsyncTransportThread("127.0.0.1", 0, "127.0.0.1", 0, self.api_connections,
+                                              self.p2p_connections, self.announce_queue, self.incoming_queue,
+                                              self.p2p_queue, self.message_storage, 30)
+        self.transport.daemon = True
+        self.transport.start()
+        self.assertTrue(self.transport.started.wait(2))
+        self.sockets = []
+
+    def tearDown(self) -> None:
+        for sock in self.sockets:
+            sock.close()
+        self.transport.stop()
+        self.transport.join(2)
+        self.assertFalse(self.transport.is_alive())
+
+    def connect(self, port):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.settimeout(2)
+        self.sockets.append(sock)
+        return sock
+
+    def test_api_announce_is_notified(self):
+        handler = AnnounceMessageHandler(self.announce_queue, self.message_storage, self.api_connections,
+                                         self.p2p_queue, SeenCache(100))
+        handler.daemon = True
+        handler.start()
+        subscriber = self.connect(self.transport.api_port)
+        subscriber.sendall(struct.pack(">HHHH", 8, c.GOSSIP_NOTIFY, 0, 1234))
+        wait_until(lambda: self.message_storage.get_subscribers(1234))
+        announcer = self.connect(self.transport.api_port)
+        announcer.sendall(struct.pack(">HHBBH", 13, c.GOSSIP_ANNOUNCE, 5, 0, 1234) + b"hello")
+        notification = parse_header(subscriber)
+        self.assertEqual(notification.type, c.GOSSIP_NOTIFICATION)
+        self.assertTrue(bytes(notification.data).endswith(b"hello"))
+
+    def test_p2p_relay(self):
+        handler = P2PHandler(self.incoming_queue, PeerTable(10), self.announce_queue, self.p2p_queue,
+                             self.p2p_connections, "127.0.0.1", self.transport.p2p_port, "127.0.0.1", 1, 30,
+                             SeenCache(100), rng=random.Random(1))
+        threading.Thread(target=lambda: [handler.handle_batch(self.incoming_queue.get_batch(64))
+                                         for _ in iter(int, 1)], daemon=True).start()
+        sender = self.connect(self.transport.p2p_port)
+        receiver = self.connect(self.transport.p2p_port)
+        wait_until(lambda: len(self.p2p_connections) == 2)
+        body = struct.pack(">BBH", 5, 0, 1234) + b"hello"
+        sender.sendall(GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=c.GOSSIP_ANNOUNCE))
+
+        reader = FrameReader(receiver)
+        relayed = None
+        while relayed is None:
+            for frame in reader.read_messages():
+                # the transport says hello first
+                if frame.type == c.GOSSIP_P2P_SEND_CONTENT and ContentView(frame.data).inner_type == c.GOSSIP_ANNOUNCE:
+                    relayed = AnnounceView(ContentView(frame.data).content)
+        self.assertEqual((relayed.ttl, bytes(relayed.data)), (4, b"hello"))
+        # the sender only got the hello
+        sender.settimeout(0.2)
+        frames = FrameReader(sender).read_messages()
+        self.assertEqual([frame.type for frame in frames], [c.GOSSIP_P2P_SEND_CONTENT])
+        self.assertEqual(ContentView(frames[0].data).inner_type, c.GOSSIP_P2P_HELLO)
+
+
+class TestAsyncConnection(unittest.TestCase):
+    def setUp(self) -> None:
+        self.listener = socket.create_server(("127.0.0.1", 0))
+
+    def tearDown(self) -> None:
+        self.listener.close()
+
+    def run_connection(self, queue_size, policy, scenario):
+        async def run():
+            _, writer = await asyncio.open_connection(*self.listener.getsockname())
+            peer, _ = self.listener.accept()
+            try:
+                connection = AsyncConnection(asyncio.get_running_loop(), writer, 'p2p', queue_size, policy)
+                return await scenario(connection, peer)
+            finally:
+                writer.close()
+                peer.close()
+        return asyncio.run(run())
+
+    def test_drop_when_buffer_full(self):
+        async def scenario(connection, peer):
+            return [connection.write(b"x" * LARGE) for _ in range(3)], connection.dropped
+        self.assertEqual(self.run_connection(2, POLICY_DROP, scenario), ([True, True, False], 1))
+
+    def test_block_waits_for_peer(self):
+        def read_all(peer, size):
+            while size > 0:
+                size -= len(peer.recv(1 << 20))
+
+        async def scenario(connection, peer):
+            connection.write(b"x" * LARGE)
+            put = asyncio.ensure_future(connection.put(b"y"))
+            await asyncio.sleep(0.1)
+            blocked = not put.done()
+            reader = threading.Thread(target=read_all, args=(peer, LARGE + 1), daemon=True)
+            reader.start()
+            result = await asyncio.wait_for(put, 5)
+            # the peer is closed after the scenario, the reader must be done with it
+            await asyncio.get_running_loop().run_in_executor(None, reader.join, 5)
+            return blocked, result
+        self.assertEqual(self.run_connection(1, POLICY_BLOCK, scenario), (True, True))
+
+    def test_content_is_batched_once_enabled(self):
+        def announce(text):
+            body = struct.pack(">BBH", 5, 0, 1001) + text
+            return GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=c.GOSSIP_ANNOUNCE)
+        push = GossipPushMessage(self_ip="10.0.0.1", self_port=6001).prepare_message()
+
+        async def scenario(connection, peer):
+            connection.enable_batching(2 * len(announce(b"a")) - 4)
+            for message in (announce(b"a"), announce(b"b"), announce(b"c"), push, announce(b"d")):
+                connection.write(message)
+            # the others were sent right away, the last announce waits until the end of the loop iteration
+            pending = connection.pending()
+            await asyncio.sleep(0)
+            peer.settimeout(2)
+            reader = FrameReader(peer)
+            frames = []
+            while len(frames) < 4:
+                frames.extend(reader.read_messages())
+            return pending, [(frame.type, bytes(frame.data)) for frame in frames]
+        pending, frames = self.run_connection(10, POLICY_DROP, scenario)
+        self.assertEqual(pending, 1)
+        # the third announce does not fit into the first batch frame, the push ends the second one
+        self.assertEqual(frames, [(c.GOSSIP_P2P_BATCH, announce(b"a")[4:] + announce(b"b")[4:]),
+                                  (c.GOSSIP_P2P_SEND_CONTENT, announce(b"c")[4:]),
+                                  (c.GOSSIP_P2P_PUSH, push[4:]),
+                                  (c.GOSSIP_P2P_SEND_CONTENT, announce(b"d")[4:])])
+
+    def test_wait_for_capacity(self):
+        full = BoundedPriorityQueue('incoming_queue', 1)
+        full.put(1)
+
+        async def scenario():
+            waiter = asyncio.ensure_future(wait_for_capacity(full))
+            await asyncio.sleep(0.05)
+            blocked = not waiter.done()
+            threading.Thread(target=full.get, daemon=True).start()
+            await asyncio.wait_for(waiter, 2)
+            return blocked
+        self.assertTrue(asyncio.run(scenario()))
@@ -0,0 +1,59 @@
+# Test class to test functionality of class ConnectionManager
+import socket
+import unittest
+from gossip.connection_manager import ConnectionManager, configure_socket
+
+
+def entry(server_address):
+    return {'connection': None, 'p2p_server_address': server_address, 'writer': None}
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connections = ConnectionManager()
+
+    def test_lookup_by_server_address(self):
+        self.connections["10.0.0.1:40000"] = entry("10.0.0.1:40000")
+        self.assertIsNone(self.connections.lookup("10.0.0.1:6001"))
+        self.connections.set_server_address("10.0.0.1:40000", "10.0.0.1:6001")
+        self.assertIs(self.connections.lookup("10.0.0.1:6001"), self.connections["10.0.0.1:40000"])
+        self.assertEqual(self.connections.addresses(), {"10.0.0.1:40000", "10.0.0.1:6001"})
+
+        self.connections.pop("10.0.0.1:40000")
+        self.assertIsNone(self.connections.lookup("10.0.0.1:6001"))
+        self.assertEqual(self.connections.by_server, {})
+
+    def test_connect_attempts_are_deduplicated(self):
+        self.assertTrue(self.connections.begin_connect("10.0.0.1:6001", b"a", degree=2))
+        self.assertFalse(self.connections.begin_connect("10.0.0.1:6001", b"b", degree=2))
+        self.assertFalse(self.connections.begin_connect("10.0.0.1:6001", b"c", degree=2))
+        self.assertIn("10.0.0.1:6001", self.connections.addresses())
+
+        queued = self.connections.finish_connect("10.0.0.1:6001", entry("10.0.0.1:6001"))
+        self.assertEqual(queued, [b"b", b"c"])
+        self.assertIsNotNone(self.connections.lookup("10.0.0.1:6001"))
+        self.assertEqual(self.connections.connecting, {})
+
+    def test_pending_connects_count_towards_degree(self):
+        self.connections["10.0.0.1:6001"] = entry("10.0.0.1:6001")
+        self.assertTrue(self.connections.begin_connect("10.0.0.2:6001", b"a", degree=2))
+        self.assertFalse(self.connections.begin_connect("10.0.0.3:6001", b"a", degree=2))
+        # a failed attempt frees its slot and drops its queued messages
+        self.connections.finish_connect("10.0.0.2:6001")
+        self.assertNotIn("10.0.0.2:6001", self.connections)
+        self.assertTrue(self.connections.begin_connect("10.0.0.3:6001", b"a", degree=2))
+
+    def test_snapshot_is_copied_on_write(self):
+        self.connections["10.0.0.1:6001"] = entry("10.0.0.1:6001")
+        snapshot = self.connections.snapshot()
+        self.assertIs(self.connections.snapshot(), snapshot)
+        self.connections["10.0.0.2:6001"] = entry("10.0.0.2:6001")
+        self.connections.pop("10.0.0.1:6001")
+        self.assertEqual([address for address, _ in snapshot], ["10.0.0.1:6001"])
+        self.assertEqual([address for address, _ in self.connections.snapshot()], ["10.0.0.2:6001"])
+
+    def test_configure_socket(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            configure_socket(sock)
+            self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+            self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
@@ -0,0 +1,114 @@
+# Test class to test functionality of class ConnectionWriter
+import socket
+import struct
+import threading
+import time
+import unittest
+import gossip.codes as c
+from gossip.connection_writer import ConnectionWriter, POLICY_DROP, POLICY_BLOCK
+from gossip.message import GossipSendContentMessage, GossipPushMessage
+from gossip.metrics import REGISTRY
+
+
+def announce(text):
+    body = struct.pack(">BBH", 5, 0, 1001) + text
+    return GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=c.GOSSIP_ANNOUNCE)
+
+
+def read_frames(connection, count):
+    frames = []
+    data = b""
+    while len(frames) < count:
+        data += connection.recv(65536)
+        while len(data) >= 4 and len(data) >= struct.unpack(">H", data[:2])[0]:
+            size, msg_type = struct.unpack(">HH", data[:4])
+            frames.append((msg_type, data[4:size]))
+            data = data[size:]
+    return frames
+
+
+class TestConnectionWriter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sender, self.receiver = socket.socketpair()
+        self.receiver.settimeout(2)
+
+    def tearDown(self) -> None:
+        self.sender.close()
+        self.receiver.close()
+
+    def test_pending_messages_are_sent_in_order(self):
+        writer = ConnectionWriter(self.sender, "peer", 10)
+        for i in range(5):
+            self.assertTrue(writer.send(bytes([i]) * 3))
+        writer.start()
+        writer.close()
+        writer.join(2)
+        self.assertEqual(self.receiver.recv(100), b"\x00\x00\x00\x01\x01\x01\x02\x02\x02\x03\x03\x03\x04\x04\x04")
+
+    def test_drop_when_full(self):
+        writer = ConnectionWriter(self.sender, "peer", 2, POLICY_DROP)
+        self.assertTrue(writer.send(b"a"))
+        self.assertTrue(writer.send(b"b"))
+        self.assertFalse(writer.send(b"c"))
+        self.assertEqual(writer.dropped, 1)
+
+    def test_blocked_sender_returns_when_connection_fails(self):
+        writer = ConnectionWriter(self.sender, "peer", 1, POLICY_BLOCK)
+        writer.start()
+        # the peer reads nothing, so the writer blocks sending this and the queue fills up
+        self.assertTrue(writer.send(b"a" * 4 * 1024 * 1024))
+        time.sleep(0.05)
+        self.assertTrue(writer.send(b"b"))
+        results = []
+        producer = threading.Thread(target=lambda: results.append(writer.send(b"c")), daemon=True)
+        producer.start()
+        time.sleep(0.05)
+        self.assertEqual(results, [])
+        self.receiver.close()
+        writer.join(2)
+        producer.join(2)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(results, [False])
+        self.assertFalse(writer.send(b"d"))
+
+    def test_only_written_messages_are_counted(self):
+        def sent():
+            return REGISTRY.snapshot().get('gossip_messages_sent_total{layer="test",type="GOSSIP_P2P_PUSH"}', 0)
+        push = GossipPushMessage(self_ip="10.0.0.1", self_port=6001).prepare_message()
+        writer = ConnectionWriter(self.sender, "peer", 2, layer='test')
+        before = sent()
+        self.assertEqual([writer.send(push) for _ in range(3)], [True, True, False])
+        self.assertEqual(sent(), before)
+        writer.start()
+        writer.close()
+        writer.join(2)
+        self.assertEqual(len(read_frames(self.receiver, 2)), 2)
+        self.assertEqual(sent(), before + 2)
+
+    def test_content_is_batched_once_enabled(self):
+        writer = ConnectionWriter(self.sender, "peer", 10)
+        writer.enable_batching(2 * len(announce(b"a")) - 4)
+        push = GossipPushMessage(self_ip="10.0.0.1", self_port=6001).prepare_message()
+        for message in (announce(b"a"), announce(b"b"), announce(b"c"), push, announce(b"d")):
+            writer.send(message)
+        writer.start()
+        writer.close()
+        writer.join(2)
+        frames = read_frames(self.receiver, 4)
+        # the third announce does not fit into the first batch frame, the push ends the second one
+        self.assertEqual([msg_type for msg_type, _ in frames],
+                         [c.GOSSIP_P2P_BATCH, c.GOSSIP_P2P_SEND_CONTENT, c.GOSSIP_P2P_PUSH, c.GOSSIP_P2P_SEND_CONTENT])
+        self.assertEqual(frames[0][1], announce(b"a")[4:] + announce(b"b")[4:])
+        self.assertEqual(frames[1][1], announce(b"c")[4:])
+
+    def test_batch_wait(self):
+        writer = ConnectionWriter(self.sender, "peer", 10)
+        writer.enable_batching(1000, 0.5)
+        writer.start()
+        writer.send(announce(b"a"))
+        time.sleep(0.05)
+        writer.send(announce(b"b"))
+        writer.close()
+        writer.join(2)
+        frames = read_frames(self.receiver, 1)
+        self.assertEqual(frames, [(c.GOSSIP_P2P_BATCH, announce(b"a")[4:] + announce(b"b")[4:])])
@@ -0,0 +1,62 @@
+# Test class to test the message type registry and Dispatcher
+import queue
+import struct
+import unittest
+import gossip.codes as c
+import gossip.exceptions as e
+from gossip.dispatch import Dispatcher, MESSAGE_TYPES, register_message_type
+from gossip.message_storage import MessageStorage
+from gossip.server import process_api_message
+from gossip.utils import Frame, check_header
+
+
+class TestDispatch(unittest.TestCase):
+    def tearDown(self) -> None:
+        MESSAGE_TYPES.pop(600, None)
+
+    def test_known_types(self):
+        self.assertEqual(MESSAGE_TYPES[c.GOSSIP_ANNOUNCE], 'GOSSIP_ANNOUNCE')
+        self.assertNotIn(c.GOSSIP_P2P_SHUFFLE, MESSAGE_TYPES)
+
+    def test_register_message_type(self):
+        header = struct.pack(">HH", 4, 600)
+        with self.assertRaises(e.InvalidMessageType):
+            check_header(header)
+        register_message_type(600, 'EXAMPLE_PING')
+        register_message_type(600, 'EXAMPLE_PING')
+        self.assertEqual(check_header(header), (4, 600))
+        with self.assertRaises(ValueError):
+            register_message_type(600, 'EXAMPLE_PONG')
+        with self.assertRaises(ValueError):
+            register_message_type(1 << 16, 'TOO_LARGE')
+
+    def test_dispatcher(self):
+        received = []
+        dispatcher = Dispatcher({600: lambda *args: received.append(args)})
+        self.assertTrue(dispatcher.dispatch(600, "a", 1))
+        self.assertFalse(dispatcher.dispatch(601, "a", 1))
+        self.assertEqual(received, [("a", 1)])
+        with self.assertRaises(ValueError):
+            dispatcher.register(600, print)
+        dispatcher.register(600, print, replace=True)
+        self.assertIs(dispatcher.handlers[600], print)
+
+    def test_api_messages(self):
+        announce_queue = queue.Queue()
+        message_storage = MessageStorage(10)
+        body = memoryview(struct.pack(">HH", 0, 1001))
+        process_api_message(Frame(c.GOSSIP_NOTIFY, 8, body), "127.0.0.1:5000", announce_queue,
+                            message_storage)
+        self.assertEqual(message_storage.get_subscribers(1001), ["127.0.0.1:5000"])
+        process_api_message(Frame(c.GOSSIP_NOTIFICATION, 8, body), "127.0.0.1:5000", announce_queue,
+                            message_storage)
+        self.assertTrue(announce_queue.empty())
+
+    def test_malformed_api_messages_are_dropped(self):
+        announce_queue = queue.Queue()
+        message_storage = MessageStorage(10)
+        for msg_type in (c.GOSSIP_ANNOUNCE, c.GOSSIP_NOTIFY, c.GOSSIP_VALIDATION):
+            process_api_message(Frame(msg_type, 5, memoryview(b"\x05")), "127.0.0.1:5000", announce_queue,
+                                message_storage)
+        self.assertTrue(announce_queue.empty())
+        self.assertEqual(message_storage.get_subscribers(0), [])
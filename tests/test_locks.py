@@ -0,0 +1,47 @@
+# Test class to test functionality of class InstrumentedLock
+import threading
+import unittest
+from gossip.locks import InstrumentedLock
+from gossip.metrics import Metrics
+
+
+class TestInstrumentedLock(unittest.TestCase):
+    def test_counts_contention(self):
+        lock = InstrumentedLock('test')
+        with lock:
+            pass
+        self.assertEqual((lock.acquisitions, lock.contended), (1, 0))
+
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with lock:
+                held.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+        self.assertFalse(lock.acquire(blocking=False))
+        threading.Timer(0.05, release.set).start()
+        with lock:
+            pass
+        holder.join()
+        self.assertEqual((lock.acquisitions, lock.contended), (3, 1))
+        self.assertGreater(lock.wait_seconds, 0)
+
+    def test_reentrant(self):
+        lock = InstrumentedLock('test', reentrant=True)
+        with lock:
+            with lock:
+                pass
+        self.assertEqual((lock.acquisitions, lock.contended), (2, 0))
+
+    def test_metrics(self):
+        metrics = Metrics()
+        lock = InstrumentedLock('storage')
+        lock.register_metrics(metrics)
+        with lock:
+            pass
+        self.assertEqual(metrics.snapshot()['gossip_lock_acquisitions_total{lock="storage"}'], 1)
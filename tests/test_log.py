@@ -0,0 +1,36 @@
+# Test class to test functionality of the logging setup
+import io
+import logging
+import unittest
+from gossip.log import RateLimitFilter, parse_levels, setup_logging
+
+
+class TestLog(unittest.TestCase):
+    def tearDown(self) -> None:
+        setup_logging('WARNING')
+
+    def test_rate_limit(self):
+        now = [0]
+        rate_limit = RateLimitFilter(2, clock=lambda: now[0])
+        records = [logging.LogRecord('gossip.messages', logging.INFO, '', 0, "Received %s", ('a',), None)
+                   for _ in range(4)]
+        self.assertEqual([rate_limit.filter(record) for record in records], [True, True, False, False])
+        now[0] = 1
+        record = logging.LogRecord('gossip.messages', logging.INFO, '', 0, "Received %s", ('a',), None)
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.getMessage(), "Received a (2 similar suppressed)")
+
+    def test_parse_levels(self):
+        self.assertEqual(parse_levels("gossip.server=debug, gossip.messages=WARNING"),
+                         {'gossip.server': 'DEBUG', 'gossip.messages': 'WARNING'})
+        self.assertEqual(parse_levels(""), {})
+
+    def test_queue_handler(self):
+        stream = io.StringIO()
+        setup_logging('INFO', 'gossip.test=ERROR', use_queue=True, stream=stream)
+        logging.getLogger('gossip.test').warning("hidden")
+        logging.getLogger('gossip.other').info("shown %d", 1)
+        # reconfiguring stops the listener, which writes out everything still queued
+        setup_logging('WARNING')
+        self.assertNotIn("hidden", stream.getvalue())
+        self.assertIn("gossip.other: shown 1", stream.getvalue())
@@ -1,7 +1,13 @@
 import struct
 import unittest
-from gossip.message import AnnounceMessage, NotifyMessage, NotificationMessage, ValidationMessage
-from gossip.codes import GOSSIP_NOTIFICATION
+from gossip.message import AnnounceMessage, NotifyMessage, NotificationMessage, ValidationMessage, \
+    GossipPullResponseMessage, GossipSendContentMessage, GossipShuffleMessage, GossipPushMessage, \
+    AnnounceView, NotifyView, ValidationView, PeerAddressView, PullResponseView, ContentView, ShuffleView, \
+    BatchView, HelloView, GossipHelloMessage, pack_batch_frame, is_send_content
+from gossip.address import unpack_address
+from gossip.codes import GOSSIP_ANNOUNCE, GOSSIP_NOTIFICATION, GOSSIP_P2P_PULL_RESPONSE, GOSSIP_P2P_SEND_CONTENT, \
+    GOSSIP_P2P_SHUFFLE_REPLY, GOSSIP_P2P_PUSH, GOSSIP_P2P_BATCH, GOSSIP_P2P_HELLO, CAPABILITY_BATCH
+from gossip.peer_table import PeerTable
 
 
 class TestMessage(unittest.TestCase):
@@ -40,3 +46,117 @@ class TestMessage(unittest.TestCase):
         expected = {'msg_id': 14, 'res': 0, 'valid': True}
         validation_message = ValidationMessage(message_body)
         self.assertEqual(validation_message.get_all_data(), expected)
+
+    def test_pull_response_round_trip(self):
+        peer_list = ["127.0.0.1:6001", "10.0.0.2:7001", "192.168.178.20:65535"]
+        message = GossipPullResponseMessage(PeerTable(10, peer_list)).prepare_message()
+        size, msg_type, peer_count = struct.unpack(">HHH", message[:6])
+        self.assertEqual((size, msg_type, peer_count), (len(message), GOSSIP_P2P_PULL_RESPONSE, 3))
+        self.assertEqual(message[6:12], struct.pack(">BBBBH", 127, 0, 0, 1, 6001))
+
+        known_peers = PeerTable(10, ["10.0.0.2:7001"])
+        obtained = GossipPullResponseMessage(known_peers, message_body=message[4:]).update_peer_list()
+        self.assertEqual(obtained, peer_list)
+        self.assertEqual(sorted(known_peers), sorted(peer_list))
+
+    def test_pull_response_sample(self):
+        peer_list = PeerTable(100, ["10.0.0.{}:1".format(i) for i in range(100)])
+        message = GossipPullResponseMessage(peer_list, max_peers=10).prepare_message()
+        obtained = GossipPullResponseMessage(PeerTable(100), message_body=message[4:]).update_peer_list()
+        self.assertEqual(len(obtained), 10)
+        self.assertEqual(len(message), 6 + 6 * 10)
+
+    def test_shuffle_round_trip(self):
+        peers = ["127.0.0.1:6001", "10.0.0.2:7001"]
+        message = GossipShuffleMessage(peers, reply=True).prepare_message()
+        send_content_message = GossipSendContentMessage(message_body=message[4:])
+        self.assertEqual(struct.unpack(">HH", message[:4]), (len(message), GOSSIP_P2P_SEND_CONTENT))
+        self.assertEqual(send_content_message.get_inner_content_type(), GOSSIP_P2P_SHUFFLE_REPLY)
+        received = GossipShuffleMessage(message_body=send_content_message.get_content_body())
+        self.assertEqual(received.get_peers(), peers)
+
+    def test_relay_message_reduces_ttl(self):
+        announce = struct.pack(">BBH", self.ttl, 0, self.data_type) + self.data
+        received = GossipSendContentMessage(msg_to_send=announce).prepare_message(inner_msg_type=GOSSIP_ANNOUNCE)
+        relay_message = GossipSendContentMessage(message_body=memoryview(received)[4:]).prepare_relay_message()
+
+        expected = bytearray(received)
+        expected[8] = self.ttl - 1
+        self.assertEqual(b"".join(relay_message), expected)
+
+    def test_relay_message_ttl_limits(self):
+        for ttl, expected_ttl in ((0, 0), (1, None)):
+            announce = struct.pack(">BBH", ttl, 0, self.data_type) + self.data
+            received = GossipSendContentMessage(msg_to_send=announce).prepare_message(inner_msg_type=GOSSIP_ANNOUNCE)
+            relay_message = GossipSendContentMessage(message_body=received[4:]).prepare_relay_message()
+            if expected_ttl is None:
+                self.assertIsNone(relay_message)
+            else:
+                self.assertEqual(b"".join(relay_message)[8], expected_ttl)
+
+    def test_views(self):
+        body = memoryview(struct.pack(">BBH", self.ttl, 0, self.data_type) + self.data)
+        announce = AnnounceView(body)
+        self.assertEqual((announce.ttl, announce.data_type, bytes(announce.data)), (3, 1001, self.data))
+        self.assertEqual(NotifyView(struct.pack(">HH", 0, self.data_type)).data_type, 1001)
+        validation = ValidationView(struct.pack(">HB?", self.msg_id, 0, False))
+        self.assertEqual((validation.msg_id, validation.valid), (14, False))
+
+        push = GossipPushMessage(self_ip="10.0.0.1", self_port=6001).prepare_message()
+        self.assertEqual(PeerAddressView(memoryview(push)[4:]).address, "10.0.0.1:6001")
+        response = GossipPullResponseMessage(PeerTable(10, ["10.0.0.2:1"])).prepare_message()
+        records = PullResponseView(memoryview(response)[4:]).records
+        self.assertEqual([unpack_address(record) for record in records], ["10.0.0.2:1"])
+
+        shuffle = GossipShuffleMessage(["10.0.0.3:1"], reply=True).prepare_message()
+        content = ContentView(memoryview(shuffle)[4:])
+        self.assertEqual(content.inner_type, GOSSIP_P2P_SHUFFLE_REPLY)
+        self.assertEqual(ShuffleView(content.content).peers, ["10.0.0.3:1"])
+        with self.assertRaises(AttributeError):
+            content.body = b""
+
+    def test_truncated_views_raise_value_error(self):
+        for read in (lambda: AnnounceView(b"").ttl, lambda: AnnounceView(b"\x05").data_type,
+                     lambda: NotifyView(b"\0").data_type, lambda: ValidationView(b"\0\0\0").valid,
+                     lambda: ContentView(b"\0").inner_type, lambda: ContentView(b"\0\x05\x01\xf4").relay_message()):
+            with self.assertRaises(ValueError):
+                read()
+
+    def test_batch_frame_round_trip(self):
+        announces = [GossipSendContentMessage(msg_to_send=struct.pack(">BBH", self.ttl, 0, self.data_type) + text)
+                     .prepare_message(inner_msg_type=GOSSIP_ANNOUNCE) for text in (b"a", b"bc")]
+        relay = ContentView(memoryview(announces[1])[4:]).relay_message()
+        self.assertTrue(is_send_content(announces[0]) and is_send_content(relay))
+        frame = b"".join(pack_batch_frame([announces[0], relay]))
+        size, msg_type = struct.unpack(">HH", frame[:4])
+        self.assertEqual((size, msg_type), (len(frame), GOSSIP_P2P_BATCH))
+
+        contents = BatchView(memoryview(frame)[4:]).contents
+        self.assertEqual([content.inner_type for content in contents], [GOSSIP_ANNOUNCE] * 2)
+        self.assertEqual([AnnounceView(content.content).ttl for content in contents], [3, 2])
+        self.assertEqual(bytes(AnnounceView(contents[1].content).data), b"bc")
+        # a truncated message at the end is left out
+        self.assertEqual(len(BatchView(memoryview(frame)[4:-1]).contents), 1)
+
+    def test_hello_round_trip(self):
+        hello = GossipHelloMessage(CAPABILITY_BATCH).prepare_message()
+        self.assertFalse(is_send_content(GossipPushMessage(self_ip="10.0.0.1", self_port=6001).prepare_message()))
+        content = ContentView(memoryview(hello)[4:])
+        self.assertEqual(content.inner_type, GOSSIP_P2P_HELLO)
+        self.assertEqual(HelloView(content.content).capabilities, CAPABILITY_BATCH)
+        self.assertEqual(HelloView(b"").capabilities, 0)
+
+    def test_ipv6_and_hostname_peers(self):
+        push = GossipPushMessage(self_ip="2001:db8::1", self_port=6001).prepare_message()
+        self.assertEqual(len(push), 4 + 20)
+        self.assertEqual(PeerAddressView(memoryview(push)[4:]).address, "[2001:db8::1]:6001")
+        legacy = GossipPushMessage(self_ip="10.0.0.1", self_port=6001).prepare_message()
+        self.assertEqual(legacy, struct.pack(">HHBBBBH", 10, GOSSIP_P2P_PUSH, 10, 0, 0, 1, 6001))
+
+        peers = ["[2001:db8::2]:1", "10.0.0.2:1", "node.example:1"]
+        message = GossipPullResponseMessage(PeerTable(10, peers)).prepare_message()
+        obtained = GossipPullResponseMessage(PeerTable(10), message_body=message[4:]).update_peer_list()
+        self.assertEqual(sorted(obtained), sorted(peers))
+        # peers which only know ipv4 read the number of ipv4 records and ignore the rest
+        self.assertEqual(struct.unpack(">HBBBBH", message[4:12]), (1, 10, 0, 0, 2, 1))
+
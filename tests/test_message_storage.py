@@ -1,6 +1,7 @@
 # Test class to test functionality of class MessageStorage
+import threading
 import unittest
-from gossip.message_storage import MessageStorage
+from gossip.message_storage import MessageStorage, StoredMessage
 
 
 class TestMessageStorage(unittest.TestCase):
@@ -10,11 +11,18 @@ class TestMessageStorage(unittest.TestCase):
     def test_add_new_data(self):
         msg_id1 = self.message_storage.add_data("conn", "Connection 1 found", 2)
         msg_id2 = self.message_storage.add_data("conn", "Connected", 3)
-        expected1 = {"message":"Connection 1 found", "ttl": 2, "valid":0}
-        expected2 = {"message":"Connected", "ttl": 3, "valid":0}
+        expected1 = StoredMessage("Connection 1 found", 2, 0)
+        expected2 = StoredMessage("Connected", 3, 0)
         self.assertEqual(self.message_storage.messages[msg_id1], expected1)
         self.assertEqual(self.message_storage.messages[msg_id2], expected2)
 
+    def test_make_invalid_keeps_lru_position(self):
+        msg_id1 = self.message_storage.add_data("conn", "first", 2)
+        msg_id2 = self.message_storage.add_data("conn", "second", 2)
+        self.message_storage.make_invalid(msg_id1)
+        self.assertEqual(list(self.message_storage.messages), [msg_id1, msg_id2])
+        self.assertFalse(self.message_storage.messages[msg_id1].valid)
+
     def test_add_new_subscriber(self):
         self.message_storage.add_subscriber("conn", "res1")
         self.message_storage.add_subscriber("conn", "res5")
@@ -22,3 +30,46 @@ class TestMessageStorage(unittest.TestCase):
         self.assertIsNotNone(subs)
         self.assertEqual(subs[0], "res1")
         self.assertEqual(subs[1], "res5")
+
+    def test_evict_least_recently_used(self):
+        msg_ids = [self.message_storage.add_data("conn", i, 2) for i in range(10)]
+        self.message_storage.get_message(msg_ids[0])
+        msg_id = self.message_storage.add_data("other", "new", 2)
+        self.assertIsNotNone(msg_id)
+        self.assertEqual(len(self.message_storage), 10)
+        self.assertEqual(self.message_storage.evictions, 1)
+        self.assertIsNone(self.message_storage.get_message(msg_ids[1]))
+        self.assertIsNotNone(self.message_storage.get_message(msg_ids[0]))
+        self.assertNotIn(msg_ids[1], self.message_storage.get_message_ids("conn"))
+
+    def test_expire_old_messages(self):
+        now = [0]
+        message_storage = MessageStorage(cache_size=10, max_age=5, clock=lambda: now[0])
+        msg_id = message_storage.add_data("conn", "old", 2)
+        now[0] = 5
+        message_storage.add_data("other", "new", 2)
+        self.assertIsNone(message_storage.get_message(msg_id))
+        self.assertEqual(message_storage.expirations, 1)
+        self.assertNotIn("conn", message_storage.data_types)
+
+    def test_msg_ids_are_unique_16_bit(self):
+        message_storage = MessageStorage(cache_size=1000)
+        msg_ids = {message_storage.add_data("conn", i, 2) for i in range(1000)}
+        self.assertEqual(len(msg_ids), 1000)
+        self.assertTrue(all(0 <= i < 1 << 16 for i in msg_ids))
+
+    def test_concurrent_access(self):
+        def add():
+            for i in range(500):
+                msg_id = self.message_storage.add_data(i % 3, "data", 1)
+                self.message_storage.get_message(msg_id)
+                self.message_storage.make_invalid(msg_id)
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.message_storage), 10)
+        self.assertEqual(sum(len(ids) for ids in self.message_storage.data_types.values()), 10)
+        self.assertEqual(self.message_storage.evictions, 1990)
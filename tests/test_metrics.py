@@ -0,0 +1,40 @@
+# Test class to test functionality of class Metrics and InstrumentedQueue
+import struct
+import unittest
+from gossip.codes import GOSSIP_NOTIFICATION
+from gossip.metrics import Metrics, count_sent
+from gossip.queues import InstrumentedQueue
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self.metrics = Metrics()
+
+    def test_counters_and_summaries(self):
+        self.metrics.inc('messages_total', layer='p2p')
+        self.metrics.inc('messages_total', 2, layer='p2p')
+        self.metrics.observe('fanout', 3)
+        self.metrics.observe('fanout', 5)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['messages_total{layer="p2p"}'], 3)
+        self.assertEqual(snapshot['fanout_count'], 2)
+        self.assertEqual(snapshot['fanout_sum'], 8)
+        self.assertEqual(snapshot['fanout_max'], 5)
+
+    def test_gauges_and_exposition(self):
+        self.metrics.gauge('connections', lambda: 4)
+        self.assertEqual(self.metrics.exposition(), "connections 4\n")
+
+    def test_count_sent(self):
+        message = struct.pack(">HHHH", 10, GOSSIP_NOTIFICATION, 1, 1) + b"hi"
+        count_sent((message[:4], message[4:]), 'api', self.metrics)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['gossip_messages_sent_total{layer="api",type="GOSSIP_NOTIFICATION"}'], 1)
+        self.assertEqual(snapshot['gossip_bytes_sent_total{layer="api",type="GOSSIP_NOTIFICATION"}'], 10)
+
+    def test_instrumented_queue(self):
+        q = InstrumentedQueue('test_queue', metrics=self.metrics)
+        q.put(1)
+        self.assertEqual(self.metrics.snapshot()['gossip_queue_depth{queue="test_queue"}'], 1)
+        self.assertEqual(q.get(), 1)
+        self.assertEqual(self.metrics.snapshot()['gossip_queue_wait_seconds_count{queue="test_queue"}'], 1)
@@ -0,0 +1,124 @@
+# Test class to test functionality of class P2PHandler
+import queue
+import random
+import struct
+import unittest
+import gossip.codes as c
+from gossip.connection_manager import ConnectionManager
+from gossip.connection_writer import ConnectionWriter
+from gossip.message import GossipSendContentMessage, GossipPullResponseMessage, GossipShuffleMessage, \
+    GossipHelloMessage, pack_batch_frame
+from gossip.p2p_handler import P2PHandler
+from gossip.peer_table import PeerTable
+from gossip.queues import IncomingItem
+from gossip.seen_cache import SeenCache
+
+
+def incoming(sender, msg_type, message):
+    return IncomingItem(sender, msg_type, memoryview(message)[4:])
+
+
+def announce(text):
+    body = struct.pack(">BBH", 5, 0, 1001) + text
+    return GossipSendContentMessage(msg_to_send=body).prepare_message(inner_msg_type=c.GOSSIP_ANNOUNCE)
+
+
+class TestP2PHandler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.announce_queue = queue.Queue()
+        self.p2p_queue = queue.Queue()
+        self.connections = ConnectionManager()
+        self.handler = P2PHandler(queue.Queue(), PeerTable(100), self.announce_queue, self.p2p_queue,
+                                  self.connections, "127.0.0.1", 6001, "127.0.0.1", 8888, 30, SeenCache(100),
+                                  rng=random.Random(1))
+
+    def test_batch_relays_once(self):
+        self.handler.handle_batch([incoming("10.0.0.1:1", c.GOSSIP_P2P_SEND_CONTENT, announce(b"a")),
+                                   incoming("10.0.0.2:1", c.GOSSIP_P2P_SEND_CONTENT, announce(b"a")),
+                                   incoming("10.0.0.2:1", c.GOSSIP_P2P_SEND_CONTENT, announce(b"b"))])
+        self.assertEqual(self.announce_queue.qsize(), 2)
+        relay = self.p2p_queue.get_nowait()
+        self.assertEqual(relay.action, c.P2P_ACTION_RELAY)
+        self.assertEqual([sender for _, sender in relay.messages], ["10.0.0.1:1", "10.0.0.2:1"])
+        self.assertTrue(self.p2p_queue.empty())
+
+    def test_malformed_messages_are_dropped(self):
+        short_announce = GossipSendContentMessage(msg_to_send=b"\x05").prepare_message(inner_msg_type=c.GOSSIP_ANNOUNCE)
+        self.handler.handle_batch([incoming("10.0.0.1:1", c.GOSSIP_P2P_SEND_CONTENT, b"\0\0\0\0\x01"),
+                                   incoming("10.0.0.1:1", c.GOSSIP_P2P_SEND_CONTENT, short_announce),
+                                   incoming("10.0.0.2:1", c.GOSSIP_P2P_SEND_CONTENT, announce(b"a"))])
+        self.assertEqual(self.announce_queue.qsize(), 1)
+        self.assertEqual(bytes(self.announce_queue.get_nowait().message[4:]), b"a")
+
+    def test_truncated_pull_response_is_dropped(self):
+        self.handler.handle_batch([IncomingItem("10.0.0.1:1", c.GOSSIP_P2P_PULL_RESPONSE, memoryview(b"\x01")),
+                                   incoming("10.0.0.2:1", c.GOSSIP_P2P_SEND_CONTENT, announce(b"a"))])
+        self.assertEqual(len(self.handler.peer_list), 0)
+        self.assertEqual(self.announce_queue.qsize(), 1)
+
+    def test_truncated_shuffle_is_dropped(self):
+        self.handler.peer_list.add_many(["10.0.0.{}:1".format(i) for i in range(10)])
+        for content in (b"\x00", struct.pack(">HBBBB", 1, 10, 0, 0, 20)):
+            shuffle = GossipSendContentMessage(msg_to_send=content).prepare_message(inner_msg_type=c.GOSSIP_P2P_SHUFFLE)
+            self.handler.handle_batch([incoming("10.0.0.20:1", c.GOSSIP_P2P_SEND_CONTENT, shuffle)])
+        self.assertTrue(self.p2p_queue.empty())
+        self.assertEqual(len(self.handler.peer_list), 10)
+
+    def test_batch_frame(self):
+        frame = b"".join(pack_batch_frame([announce(b"a"), announce(b"b"), announce(b"a")]))
+        self.handler.handle_batch([incoming("10.0.0.1:1", c.GOSSIP_P2P_BATCH, frame)])
+        self.assertEqual(self.announce_queue.qsize(), 2)
+        self.assertEqual(len(self.p2p_queue.get_nowait().messages), 2)
+
+    def test_hello_enables_batching(self):
+        self.handler.connections = ConnectionManager(frame_batch_size=1000)
+        old, new = ConnectionWriter(None, "old", 10), ConnectionWriter(None, "new", 10)
+        for address, writer in (("10.0.0.1:1", old), ("10.0.0.2:1", new)):
+            self.handler.connections[address] = {'connection': None, 'p2p_server_address': address, 'writer': writer}
+        hello = GossipHelloMessage(c.CAPABILITY_BATCH).prepare_message()
+        self.handler.handle_batch([incoming("10.0.0.2:1", c.GOSSIP_P2P_SEND_CONTENT, hello)])
+        self.assertEqual(self.handler.connections["10.0.0.2:1"]['capabilities'], c.CAPABILITY_BATCH)
+        self.assertEqual((old.frame_batch_size, new.frame_batch_size), (0, 1000))
+
+    def test_batch_merges_pull_responses(self):
+        responses = [GossipPullResponseMessage(PeerTable(10, peers)).prepare_message()
+                     for peers in (["10.0.0.1:1", "10.0.0.2:1"], ["10.0.0.2:1", "10.0.0.3:1"])]
+        self.handler.handle_batch([incoming("10.0.0.9:1", c.GOSSIP_P2P_PULL_RESPONSE, response)
+                                   for response in responses] +
+                                  [IncomingItem("10.0.0.9:1", c.P2P_CONNECTION_CLOSED, None)])
+        addresses = sorted(self.p2p_queue.get_nowait().to_address for _ in range(3))
+        self.assertEqual(addresses, ["10.0.0.1:1", "10.0.0.2:1", "10.0.0.3:1"])
+        self.assertTrue(self.p2p_queue.empty())
+
+    def test_closed_connection_is_replaced_when_pulled_peers_are_connected(self):
+        self.connections["10.0.0.1:1"] = {'connection': None, 'p2p_server_address': "10.0.0.1:1", 'writer': None}
+        self.handler.peer_list.add("10.0.0.5:1")
+        response = GossipPullResponseMessage(PeerTable(10, ["10.0.0.1:1"])).prepare_message()
+        self.handler.handle_batch([incoming("10.0.0.1:1", c.GOSSIP_P2P_PULL_RESPONSE, response),
+                                   IncomingItem("10.0.0.9:1", c.P2P_CONNECTION_CLOSED, None)])
+        self.assertEqual(self.p2p_queue.get_nowait().to_address, "10.0.0.5:1")
+        self.assertTrue(self.p2p_queue.empty())
+
+    def test_shuffle_is_answered(self):
+        self.handler.peer_list.add_many(["10.0.0.{}:1".format(i) for i in range(10)])
+        shuffle = GossipShuffleMessage(["10.0.0.20:1", "10.0.0.21:1", "127.0.0.1:6001"]).prepare_message()
+        self.handler.handle_batch([incoming("10.0.0.20:1", c.GOSSIP_P2P_SEND_CONTENT, shuffle)])
+        reply = self.p2p_queue.get_nowait()
+        self.assertEqual(reply.to_address, "10.0.0.20:1")
+        body = GossipSendContentMessage(message_body=memoryview(reply.message)[4:])
+        self.assertEqual(body.get_inner_content_type(), c.GOSSIP_P2P_SHUFFLE_REPLY)
+        # our own address is neither kept nor counted
+        self.assertEqual(len(GossipShuffleMessage(message_body=body.get_content_body()).get_peers()), 2)
+        self.assertIn("10.0.0.21:1", self.handler.peer_list)
+        self.assertNotIn("127.0.0.1:6001", self.handler.peer_list)
+
+    def test_third_party_content_type(self):
+        received = []
+        self.handler.content_dispatcher.register(700, lambda sender, content, batch: received.append(
+            (sender, bytes(content.content))))
+        message = GossipSendContentMessage(msg_to_send=b"ping").prepare_message(inner_msg_type=700)
+        unknown = GossipSendContentMessage(msg_to_send=b"x").prepare_message(inner_msg_type=701)
+        self.handler.handle_batch([incoming("10.0.0.1:1", c.GOSSIP_P2P_SEND_CONTENT, message),
+                                   incoming("10.0.0.1:1", c.GOSSIP_P2P_SEND_CONTENT, unknown)])
+        self.assertEqual(received, [("10.0.0.1:1", b"ping")])
+        self.assertTrue(self.p2p_queue.empty())
@@ -0,0 +1,78 @@
+# Test class to test functionality of class PeerTable
+import multiprocessing
+import random
+import unittest
+from gossip.address import decode_peer_list
+from gossip.peer_table import PeerTable, SharedPeerTable
+
+
+class TestPeerTable(unittest.TestCase):
+    def setUp(self) -> None:
+        self.peer_table = PeerTable(max_size=3, rng=random.Random(1))
+
+    def test_add_without_duplicates(self):
+        self.assertTrue(self.peer_table.add("127.0.0.1:6001"))
+        self.assertFalse(self.peer_table.add("127.0.0.1:6001"))
+        self.assertEqual(len(self.peer_table), 1)
+        self.assertIn("127.0.0.1:6001", self.peer_table)
+        self.assertNotIn("127.0.0.1:6002", self.peer_table)
+
+    def test_replace_oldest_when_full(self):
+        self.peer_table.add_many(["10.0.0.1:1", "10.0.0.2:2", "10.0.0.3:3"])
+        # seeing a peer again makes it the youngest
+        self.peer_table.add("10.0.0.1:1")
+        self.peer_table.add("10.0.0.4:4")
+        self.assertEqual(sorted(self.peer_table), ["10.0.0.1:1", "10.0.0.3:3", "10.0.0.4:4"])
+        self.assertEqual(self.peer_table.evictions, 1)
+        self.assertEqual(len(self.peer_table.packed()), 2 + 18)
+
+    def test_remove(self):
+        self.peer_table.add_many(["10.0.0.1:1", "10.0.0.2:2", "10.0.0.3:3"])
+        self.peer_table.remove("10.0.0.1:1")
+        self.assertEqual(sorted(self.peer_table), ["10.0.0.2:2", "10.0.0.3:3"])
+        self.assertIn("10.0.0.3:3", self.peer_table)
+
+    def test_sample(self):
+        self.peer_table.add_many(["10.0.0.1:1", "10.0.0.2:2", "10.0.0.3:3"])
+        sample = self.peer_table.sample(2, exclude={"10.0.0.2:2"})
+        self.assertEqual(len(sample), 2)
+        self.assertNotIn("10.0.0.2:2", sample)
+        self.assertEqual(len(self.peer_table.sample(5)), 3)
+
+    def test_add_records(self):
+        records = decode_peer_list(PeerTable(5, ["10.0.0.1:1", "10.0.0.2:2"]).packed())
+        self.assertEqual(self.peer_table.add_records(records), 2)
+        self.assertEqual(sorted(self.peer_table), ["10.0.0.1:1", "10.0.0.2:2"])
+
+    def test_exchange_replaces_sent_peers(self):
+        self.peer_table.add_many(["10.0.0.1:1", "10.0.0.2:2", "10.0.0.3:3"])
+        added = self.peer_table.exchange(["10.0.0.4:4", "10.0.0.1:1"], sent=["10.0.0.3:3"])
+        self.assertEqual(added, ["10.0.0.4:4"])
+        self.assertEqual(sorted(self.peer_table), ["10.0.0.1:1", "10.0.0.2:2", "10.0.0.4:4"])
+        self.assertEqual(self.peer_table.evictions, 0)
+
+    def test_ipv6_and_hostnames(self):
+        peers = ["[2001:db8::1]:6001", "node.example:6002", "10.0.0.1:1"]
+        self.peer_table.add_many(peers)
+        self.assertIn("[2001:db8:0::1]:6001", self.peer_table)
+        self.assertEqual(sorted(self.peer_table), sorted(peers))
+        self.assertEqual(sorted(self.peer_table.sample(3, exclude={"10.0.0.1:1"})), peers[:2])
+        self.peer_table.remove("[2001:db8::1]:6001")
+        self.assertEqual(sorted(self.peer_table), ["10.0.0.1:1", "node.example:6002"])
+
+
+class TestSharedPeerTable(TestPeerTable):
+    def setUp(self) -> None:
+        self.peer_table = SharedPeerTable(max_size=3, rng=random.Random(1))
+
+    def test_shared_with_forked_process(self):
+        self.peer_table.add_many(["10.0.0.1:1", "10.0.0.2:2", "10.0.0.3:3"])
+        # the forked process sees the peers and its changes, including the order for replacing, are seen here
+        process = multiprocessing.get_context('fork').Process(target=self.peer_table.add_many,
+                                                              args=(["10.0.0.1:1", "node.example:4"],))
+        process.start()
+        process.join()
+        self.assertEqual(sorted(self.peer_table), ["10.0.0.1:1", "10.0.0.3:3", "node.example:4"])
+        self.peer_table.add("10.0.0.5:5")
+        self.assertEqual(sorted(self.peer_table), ["10.0.0.1:1", "10.0.0.5:5", "node.example:4"])
+        self.assertIn("node.example:4", self.peer_table)
@@ -0,0 +1,62 @@
+# Test class to test functionality of class BoundedPriorityQueue
+import threading
+import unittest
+import gossip.codes as c
+from gossip.metrics import Metrics
+from gossip.queues import BoundedPriorityQueue, IncomingItem, incoming_priority
+
+
+def incoming(msg_type, body):
+    return IncomingItem('127.0.0.1:6001', msg_type, body)
+
+
+class TestBoundedPriorityQueue(unittest.TestCase):
+    def setUp(self) -> None:
+        self.metrics = Metrics()
+        self.queue = BoundedPriorityQueue('incoming_queue', 3, incoming_priority, metrics=self.metrics)
+
+    def test_control_before_content(self):
+        self.queue.put(incoming(c.GOSSIP_P2P_SEND_CONTENT, 1))
+        self.queue.put(incoming(c.GOSSIP_P2P_BATCH, 2))
+        self.queue.put(incoming(c.GOSSIP_P2P_PULL, 3))
+        self.assertEqual([self.queue.get().msg_body for _ in range(3)], [3, 1, 2])
+
+    def test_oldest_content_dropped_first(self):
+        for i in range(3):
+            self.queue.put(incoming(c.GOSSIP_P2P_SEND_CONTENT, i))
+        self.assertTrue(self.queue.put(incoming(c.GOSSIP_P2P_PUSH, 3)))
+        self.assertTrue(self.queue.put(incoming(c.GOSSIP_P2P_SEND_CONTENT, 4)))
+        self.assertEqual([self.queue.get().msg_body for _ in range(3)], [3, 2, 4])
+        self.assertEqual(self.queue.dropped, 2)
+        self.assertEqual(self.metrics.snapshot()['gossip_messages_dropped_total{stage="incoming_queue"}'], 2)
+
+    def test_content_dropped_when_full_of_control(self):
+        for i in range(3):
+            self.queue.put(incoming(c.GOSSIP_P2P_PULL, i))
+        self.assertFalse(self.queue.put(incoming(c.GOSSIP_P2P_SEND_CONTENT, 3)))
+        self.assertTrue(self.queue.put(incoming(c.P2P_CONNECTION_CLOSED, 4)))
+        self.assertEqual([self.queue.get().msg_body for _ in range(3)], [1, 2, 4])
+
+    def test_unfinished_tasks(self):
+        for i in range(5):
+            self.queue.put(incoming(c.GOSSIP_P2P_SEND_CONTENT, i))
+        for _ in range(3):
+            self.queue.get()
+            self.queue.task_done()
+        # join returns at once because dropped items are not waited for
+        self.queue.join()
+
+    def test_wait_for_capacity(self):
+        for i in range(3):
+            self.queue.put(incoming(c.GOSSIP_P2P_SEND_CONTENT, i))
+        self.assertFalse(self.queue.wait_for_capacity(timeout=0.01))
+        threading.Timer(0.01, self.queue.get).start()
+        self.assertTrue(self.queue.wait_for_capacity(timeout=5))
+
+    def test_get_batch(self):
+        for i in range(3):
+            self.queue.put(incoming(c.GOSSIP_P2P_SEND_CONTENT, i))
+        self.assertEqual([item.msg_body for item in self.queue.get_batch(2)], [0, 1])
+        self.assertEqual([item.msg_body for item in self.queue.get_batch(2, max_wait=0.01)], [2])
+        self.queue.tasks_done(3)
+        self.queue.join()
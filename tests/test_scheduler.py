@@ -0,0 +1,77 @@
+# Test class to test functionality of class GossipScheduler
+import queue
+import random
+import unittest
+import gossip.codes as c
+from gossip.connection_manager import ConnectionManager
+from gossip.peer_table import PeerTable
+from gossip.message import GossipSendContentMessage, GossipShuffleMessage
+from gossip.scheduler import GossipScheduler, MODE_PULL, MODE_SHUFFLE
+from gossip.utils import check_header
+
+
+class TestGossipScheduler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.peer_list = PeerTable(100)
+        self.p2p_queue = queue.Queue()
+        self.scheduler = GossipScheduler(self.peer_list, ConnectionManager(), self.p2p_queue, "127.0.0.1", 6001, "127.0.0.1", 8888,
+                                         interval=1, max_interval=4, fanout=2, rng=random.Random(1))
+
+    def sent(self):
+        items = []
+        while not self.p2p_queue.empty():
+            items.append(self.p2p_queue.get_nowait())
+        return items
+
+    def test_bootstrapper_only_without_peers(self):
+        self.scheduler.run_round()
+        self.assertEqual([item.to_address for item in self.sent()], ["127.0.0.1:8888"])
+        self.peer_list.add_many(["127.0.0.1:8888", "127.0.0.1:6001", "10.0.0.1:1", "10.0.0.2:1", "10.0.0.3:1"])
+        self.scheduler.run_round()
+        addresses = [item.to_address for item in self.sent()]
+        self.assertEqual(len(addresses), 2)
+        self.assertTrue(set(addresses) <= {"10.0.0.1:1", "10.0.0.2:1", "10.0.0.3:1"})
+
+    def test_push_pull_in_one_write(self):
+        self.scheduler.run_round()
+        message = self.sent()[0].message
+        size, msg_type = check_header(message[:4])
+        self.assertEqual(msg_type, c.GOSSIP_P2P_PUSH)
+        self.assertEqual(check_header(message[size:size + 4])[1], c.GOSSIP_P2P_PULL)
+        scheduler = GossipScheduler(self.peer_list, ConnectionManager(), self.p2p_queue, "127.0.0.1", 6001, "127.0.0.1", 8888,
+                                    interval=1, max_interval=4, fanout=2, mode=MODE_PULL)
+        self.assertEqual(check_header(scheduler.message[:4])[1], c.GOSSIP_P2P_PULL)
+
+    def test_interval_adapts_to_churn(self):
+        self.assertEqual([self.scheduler.run_round() for _ in range(4)], [1, 2, 4, 4])
+        self.peer_list.add("10.0.0.1:1")
+        self.assertEqual(self.scheduler.run_round(), 1)
+
+    def test_connected_peers_once_degree_is_reached(self):
+        connections = ConnectionManager()
+        connections["10.0.0.8:4000"] = {'p2p_server_address': "10.0.0.8:1"}
+        connections["10.0.0.9:4000"] = {'p2p_server_address': "10.0.0.9:1"}
+        self.peer_list.add_many(["10.0.0.{}:1".format(i) for i in range(10)])
+        scheduler = GossipScheduler(self.peer_list, connections, self.p2p_queue, "127.0.0.1", 6001, "127.0.0.1", 8888,
+                                    interval=1, max_interval=4, fanout=3, rng=random.Random(1), degree=2)
+        scheduler.run_round()
+        self.assertEqual(sorted(item.to_address for item in self.sent()), ["10.0.0.8:4000", "10.0.0.9:4000"])
+        # with a free slot new peers are contacted again
+        scheduler.degree = 3
+        scheduler.run_round()
+        self.assertEqual(len(self.sent()), 3)
+
+    def test_shuffle_with_connections(self):
+        connections = ConnectionManager()
+        connections["10.0.0.9:4000"] = {'p2p_server_address': "10.0.0.9:1"}
+        self.peer_list.add_many(["10.0.0.{}:1".format(i) for i in range(10)])
+        scheduler = GossipScheduler(self.peer_list, connections, self.p2p_queue, "127.0.0.1", 6001, "127.0.0.1", 8888,
+                                    interval=1, max_interval=4, fanout=2, mode=MODE_SHUFFLE, shuffle_length=4)
+        scheduler.run_round()
+        item = self.sent()[0]
+        self.assertEqual(item.to_address, "10.0.0.9:4000")
+        body = GossipSendContentMessage(message_body=memoryview(item.message)[4:])
+        peers = GossipShuffleMessage(message_body=body.get_content_body()).get_peers()
+        self.assertEqual(len(peers), 4)
+        self.assertEqual(peers[0], "127.0.0.1:6001")
+        self.assertNotIn("10.0.0.9:1", peers)
@@ -0,0 +1,68 @@
+# Test class to test functionality of class SeenCache
+import multiprocessing
+import struct
+import unittest
+from gossip.seen_cache import SeenCache, SharedSeenCache
+
+
+class TestSeenCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.seen_cache = SeenCache(capacity=2, ttl=10, clock=lambda: self.now)
+
+    def test_digest_ignores_ttl(self):
+        message1 = struct.pack(">BBH", 3, 0, 1001) + b"Test Message"
+        message2 = struct.pack(">BBH", 2, 0, 1001) + b"Test Message"
+        self.assertEqual(SeenCache.digest(message1), SeenCache.digest(message2))
+
+    def test_check_and_add(self):
+        self.assertFalse(self.seen_cache.check_and_add(b"a"))
+        self.assertTrue(self.seen_cache.check_and_add(b"a"))
+        self.assertEqual(self.seen_cache.hits, 1)
+        self.assertEqual(self.seen_cache.misses, 1)
+
+    def test_capacity(self):
+        self.seen_cache.check_and_add(b"a")
+        self.seen_cache.check_and_add(b"b")
+        self.seen_cache.check_and_add(b"c")
+        self.assertEqual(len(self.seen_cache), 2)
+        self.assertFalse(self.seen_cache.check_and_add(b"a"))
+
+    def test_expiry(self):
+        self.seen_cache.check_and_add(b"a")
+        self.now = 10
+        self.assertFalse(self.seen_cache.check_and_add(b"a"))
+
+
+class TestSharedSeenCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.seen_cache = SharedSeenCache(capacity=8, ttl=10, clock=lambda: self.now, ways=4)
+
+    def test_check_and_add(self):
+        digest = SeenCache.digest(b"\x03\x00\x03\xe9Test Message")
+        self.assertFalse(self.seen_cache.check_and_add(digest))
+        self.assertTrue(self.seen_cache.check_and_add(digest))
+        self.assertEqual((self.seen_cache.hits, self.seen_cache.misses), (1, 1))
+        self.assertEqual(len(self.seen_cache), 1)
+
+    def test_oldest_of_bucket_is_replaced(self):
+        seen_cache = SharedSeenCache(capacity=2, ways=2, clock=lambda: self.now)
+        for self.now, digest in enumerate([b"a", b"b", b"c"]):
+            seen_cache.check_and_add(digest)
+        self.assertEqual(len(seen_cache), 2)
+        self.assertTrue(seen_cache.check_and_add(b"c"))
+        self.assertFalse(seen_cache.check_and_add(b"a"))
+
+    def test_expiry(self):
+        self.seen_cache.check_and_add(b"a")
+        self.now = 10
+        self.assertEqual(len(self.seen_cache), 0)
+        self.assertFalse(self.seen_cache.check_and_add(b"a"))
+
+    def test_shared_with_forked_process(self):
+        seen_cache = SharedSeenCache(capacity=64)
+        process = multiprocessing.get_context('fork').Process(target=seen_cache.check_and_add, args=(b"a",))
+        process.start()
+        process.join()
+        self.assertTrue(seen_cache.check_and_add(b"a"))
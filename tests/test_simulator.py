@@ -0,0 +1,52 @@
+# Test class to test the in-process network simulation
+import unittest
+import gossip.codes as c
+from gossip.message import GossipPushMessage
+from gossip.queues import P2PItem
+from gossip.simulator import SimulatedNetwork, SimulatedNode, simulate
+
+
+class TestSimulator(unittest.TestCase):
+    def test_announces_reach_all_nodes(self):
+        report = simulate(nodes=30, degree=5, announces=5, seed=3)
+        self.assertEqual(report['coverage'], 1.0)
+        self.assertGreater(report['latency']['p50'], 0)
+        self.assertLessEqual(report['latency']['p50'], report['latency']['p99'])
+
+    def test_runs_are_deterministic(self):
+        self.assertEqual(simulate(nodes=30, degree=5, announces=5, seed=3, jitter=0.05),
+                         simulate(nodes=30, degree=5, announces=5, seed=3, jitter=0.05))
+
+    def test_loss(self):
+        report = simulate(nodes=30, degree=5, announces=5, seed=3, loss=0.2)
+        self.assertGreater(report['messages_lost'], 0)
+        self.assertLess(report['coverage'], 1.0)
+
+    def test_gossip_rounds_spread_membership(self):
+        self.assertEqual(simulate(nodes=30, degree=5, announces=5, seed=3)['membership'], 0.0)
+        report = simulate(nodes=30, degree=5, announces=5, seed=3, gossip_interval=0.2)
+        self.assertGreater(report['membership'], 0.5)
+        self.assertEqual(report['coverage'], 1.0)
+
+    def test_gossip_rounds_spread_membership_at_degree(self):
+        # with degree 1 all nodes only stay connected to the bootstrapper, rounds go over that connection
+        report = simulate(nodes=30, degree=1, announces=5, seed=3, gossip_interval=0.2)
+        self.assertGreater(report['membership'], 0.5)
+
+    def test_connections_are_opened_by_the_p2p_message_handler(self):
+        network = SimulatedNetwork(1, latency=0.01, jitter=0, loss=0)
+        nodes = [SimulatedNode(network, "10.0.0.{}".format(i), 6001, "10.0.0.1", 6001, 1, 50, 100, 100)
+                 for i in range(1, 4)]
+        for node in nodes:
+            network.nodes[node.address] = node
+        push = GossipPushMessage(self_ip="10.0.0.1", self_port=6001).prepare_message()
+        for to_address in ("10.0.0.2:6001", "10.0.0.2:6001", "10.0.0.3:6001"):
+            nodes[0].p2p_queue.put(P2PItem(c.P2P_ACTION_SEND, to_address, push))
+        nodes[0].process_queues()
+        # the second push waits for the handshake, the third peer exceeds the degree
+        self.assertEqual(nodes[0].connections.connecting, {"10.0.0.2:6001": [push]})
+        network.run()
+        self.assertEqual(nodes[1].bytes_received, 2 * len(push))
+        self.assertEqual(nodes[2].bytes_received, 0)
+        # handshake round trip and one way delay
+        self.assertAlmostEqual(network.time, 0.03)
@@ -0,0 +1,24 @@
+# Test class to test functionality of class SubscriberRegistry
+import unittest
+from gossip.subscribers import SubscriberRegistry
+
+
+class TestSubscriberRegistry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.subscribers = SubscriberRegistry()
+
+    def test_duplicates_are_ignored(self):
+        self.assertTrue(self.subscribers.add(1001, "127.0.0.1:5000"))
+        self.assertFalse(self.subscribers.add(1001, "127.0.0.1:5000"))
+        self.subscribers.add(1001, "127.0.0.1:5001")
+        self.assertEqual(self.subscribers.get(1001), ["127.0.0.1:5000", "127.0.0.1:5001"])
+
+    def test_remove_client(self):
+        self.subscribers.add(1001, "127.0.0.1:5000")
+        self.subscribers.add(1002, "127.0.0.1:5000")
+        self.subscribers.add(1002, "127.0.0.1:5001")
+        self.subscribers.remove("127.0.0.1:5000")
+        self.assertEqual(self.subscribers.get(1001), [])
+        self.assertEqual(self.subscribers.get(1002), ["127.0.0.1:5001"])
+        self.assertEqual(len(self.subscribers), 1)
+        self.assertNotIn(1001, self.subscribers.by_type)
@@ -0,0 +1,55 @@
+# Test class to test reading of messages from connections
+import socket
+import struct
+import unittest
+import gossip.exceptions as e
+from gossip.codes import GOSSIP_ANNOUNCE, GOSSIP_NOTIFY
+from gossip.utils import Frame, FrameReader, parse_header
+
+
+class TestFrameReader(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sender, self.receiver = socket.socketpair()
+        self.announce = struct.pack(">HHBBH", 8 + 5, GOSSIP_ANNOUNCE, 3, 0, 1001) + b"hello"
+        self.notify = struct.pack(">HHHH", 8, GOSSIP_NOTIFY, 0, 1001)
+
+    def tearDown(self) -> None:
+        self.sender.close()
+        self.receiver.close()
+
+    def test_multiple_messages_in_one_chunk(self):
+        self.sender.sendall(self.announce + self.notify)
+        messages = FrameReader(self.receiver).read_messages()
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[0], Frame(GOSSIP_ANNOUNCE, 13, self.announce[4:]))
+        self.assertEqual(messages[1], Frame(GOSSIP_NOTIFY, 8, self.notify[4:]))
+
+    def test_short_reads(self):
+        reader = FrameReader()
+        self.assertEqual(reader.feed(self.announce[:3]), [])
+        self.assertEqual(reader.feed(self.announce[3:7]), [])
+        messages = reader.feed(self.announce[7:] + self.notify[:5])
+        self.assertEqual([m.type for m in messages], [GOSSIP_ANNOUNCE])
+        messages = reader.feed(self.notify[5:])
+        self.assertEqual([m.type for m in messages], [GOSSIP_NOTIFY])
+
+    def test_large_messages(self):
+        data = bytes(range(256)) * 255
+        message = struct.pack(">HHBBH", 8 + len(data), GOSSIP_ANNOUNCE, 3, 0, 1001) + data
+        reader = FrameReader(chunk_size=1000)
+        received = []
+        for _ in range(3):
+            for i in range(0, len(message), 1000):
+                received += reader.feed(message[i:i + 1000])
+        self.assertEqual(len(received), 3)
+        self.assertTrue(all(m.data[4:] == data for m in received))
+
+    def test_disconnect(self):
+        self.sender.close()
+        with self.assertRaises(e.ClientDisconnected):
+            FrameReader(self.receiver).read_messages()
+
+    def test_parse_header_exact_length(self):
+        self.sender.sendall(self.announce[:6])
+        self.sender.sendall(self.announce[6:])
+        self.assertEqual(parse_header(self.receiver).data, self.announce[4:])
@@ -0,0 +1,56 @@
+# Test class to test functionality of class PendingValidations
+import queue
+import unittest
+import gossip.codes as c
+from gossip.metrics import Metrics
+from gossip.validation import PendingValidations, TIMEOUT_FORWARD
+
+
+class TestPendingValidations(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.metrics = Metrics()
+        self.p2p_queue = queue.Queue()
+        self.pending = PendingValidations(self.p2p_queue, capacity=2, timeout=5, clock=lambda: self.now,
+                                          metrics=self.metrics)
+
+    def relayed(self):
+        messages = []
+        while not self.p2p_queue.empty():
+            item = self.p2p_queue.get_nowait()
+            self.assertEqual(item.action, c.P2P_ACTION_RELAY)
+            messages.extend(message for message, sender in item.messages)
+        return messages
+
+    def test_only_valid_announces_are_relayed(self):
+        self.pending.add(1, 1001, (b"a", "10.0.0.1:1"))
+        self.pending.add(2, 1001, (b"b", "10.0.0.1:1"))
+        self.assertTrue(self.pending.validate(1, True))
+        self.assertTrue(self.pending.validate(2, False))
+        self.assertFalse(self.pending.validate(2, True))
+        self.assertEqual(self.relayed(), [b"a"])
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['gossip_announces_relayed_total{data_type="1001"}'], 1)
+        self.assertEqual(snapshot['gossip_announces_not_relayed_total{data_type="1001"}'], 1)
+        self.assertEqual(snapshot['gossip_validations_total{data_type="1001",outcome="invalid"}'], 1)
+
+    def test_timeout_drops(self):
+        self.pending.add(1, 1001, (b"a", "10.0.0.1:1"))
+        self.now = 4
+        self.pending.add(2, 1001, (b"b", "10.0.0.1:1"))
+        self.now = 5
+        self.pending.expire()
+        self.assertEqual(len(self.pending), 1)
+        self.assertEqual(self.relayed(), [])
+
+    def test_timeout_forwards(self):
+        self.pending.timeout_policy = TIMEOUT_FORWARD
+        for msg_id in range(3):
+            self.pending.add(msg_id, 1001, (bytes([msg_id]), "10.0.0.1:1"))
+        # the oldest announce was pushed out of the full table
+        self.assertEqual(self.relayed(), [b"\x00"])
+        self.pending.add(3, 1002, (b"x", "10.0.0.1:1"), has_subscribers=False)
+        self.assertEqual(self.relayed(), [b"x"])
+        self.now = 10
+        self.pending.expire()
+        self.assertEqual(self.relayed(), [b"\x01", b"\x02"])
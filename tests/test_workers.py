@@ -0,0 +1,27 @@
+# Test class to test the queues between the worker processes
+import queue
+import unittest
+import gossip.codes as c
+from gossip.queues import AnnounceItem, P2PItem
+from gossip.workers import portable, SiblingRelayQueue
+
+
+class TestWorkers(unittest.TestCase):
+    def test_portable(self):
+        body = memoryview(b"\x00\x00\x00\x00announce")
+        item = portable(AnnounceItem(body[4:], False, ((b"\x00\x0c", body[2:]), "10.0.0.1:1")))
+        self.assertEqual(item.message, b"announce")
+        self.assertEqual(item.relay, (b"\x00\x0c\x00\x00announce", "10.0.0.1:1"))
+        relay = portable(P2PItem(c.P2P_ACTION_RELAY, messages=[((b"ab", body[4:]), "10.0.0.1:1")]))
+        self.assertEqual(relay.messages, [(b"abannounce", "10.0.0.1:1")])
+        send_all = portable(P2PItem(c.P2P_ACTION_SEND_ALL, messages=[body[4:]]))
+        self.assertEqual(send_all.messages, [b"announce"])
+
+    def test_relays_reach_siblings(self):
+        local, sibling = queue.Queue(), queue.Queue()
+        relay_queue = SiblingRelayQueue(local, [sibling])
+        relay_queue.put(P2PItem(c.P2P_ACTION_SEND, "10.0.0.1:1", b"pull"))
+        relay_queue.put(P2PItem(c.P2P_ACTION_RELAY, messages=[(memoryview(b"announce"), "10.0.0.1:1")]))
+        self.assertEqual(local.qsize(), 2)
+        self.assertEqual(sibling.get_nowait().messages, [(b"announce", "10.0.0.1:1")])
+        self.assertTrue(sibling.empty())